@@ -1,15 +1,36 @@
 import time, json
+from contextlib import nullcontext
 import streamlit as st
 from PIL import Image
 import os
 from src.ui import apply_theme, hero, side_header, side_card_start, side_card_end, side_tip
-from src.utils import pil_to_bytes, zip_images
+from src.utils import read_file, mime_for, zip_files
+from src.image_cache import get_image, get_thumbnail
 from src.safety import is_blocked_prompt
 from src.agent_loop import run_agent_loop
 from src.pipeline_sdxl import txt2img, img2img
-from src.pipeline_controlnet import controlnet_generate
+from src.pipeline_controlnet import controlnet_generate, CONTROLNETS
 from src.pipeline_inpaint import inpaint
-from src.storage import new_run_id, save_run, load_index, load_run_meta
+from src.storage import OUTPUT_DIR, new_run_id, save_run, save_sweep, load_index, load_run_meta, set_starred
+from src.storage.backends import get_backend
+from src.sweep import AXIS_PARAMS, parse_axis, plan_cells, render_cells, make_grid
+from src import retention
+from src.admission import get_controller, classify, PRIORITIES
+from src.preemption import preemptible
+from src.profiling import profile_run
+from src.model_loader import load_report, model_info
+from src.model_cache import get_model_cache
+from src import metrics
+from src.config import ENGINE_ENABLED, TOME_FAST_RATIO, CFG_FAST_CUTOFF, SIMILARITY_INDEX, FANOUT_K, FANOUT_SCORER
+from src.engine import EngineJob, get_engine
+from src.latent_cache import VAE_LOCK
+from src.similarity import get_similarity_index
+from src.uploads import from_uploaded
+from src.token_merge import token_merging
+from src.deep_cache import deep_cache
+from src.guidance import guidance_schedule, RAMPS
+from src.agent_loop import agent_variants
+from src.fanout import SCORERS, fan_out, preview_sheet
 
 
 # ----------------- PAGE -----------------
@@ -23,7 +44,46 @@ apply_theme()
 hero()
 
 
+@st.cache_resource
+def _metrics_server():
+    # one /metrics endpoint per process (only if AIG_METRICS_PORT is set)
+    return metrics.start_metrics_server()
+
+
+@st.cache_resource
+def _retention_worker():
+    # evicts old runs in small background batches (only if a limit is configured)
+    return retention.start_background()
+
+
+_retention_worker()
+
+
+_metrics_server()
+
+
 # ----------------- HELPERS -----------------
+# panels wrapped in a fragment rerun on their own when their widgets change
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _zip_outputs(paths, sig):
+    # sig = file mtimes/sizes, so a rewritten output is never served stale
+    return zip_files(list(paths))
+
+
+def _files_sig(paths):
+    sig = []
+    for p in paths:
+        try:
+            st_ = os.stat(p)
+            sig.append((st_.st_mtime_ns, st_.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
 def ss(key, default):
     if key not in st.session_state:
         st.session_state[key] = default
@@ -39,18 +99,24 @@ def apply_preset(preset: str):
         st.session_state.num_images = 1
         st.session_state.width = 768
         st.session_state.height = 768
+        st.session_state.tome_ratio = TOME_FAST_RATIO
+        st.session_state.cfg_cutoff = CFG_FAST_CUTOFF
     elif preset == "best":
         st.session_state.steps = 35
         st.session_state.guidance = 6.5
         st.session_state.num_images = 2
         st.session_state.width = 1024
         st.session_state.height = 1024
+        st.session_state.tome_ratio = 0.0
+        st.session_state.cfg_cutoff = 1.0
     elif preset == "hq":
         st.session_state.steps = 50
         st.session_state.guidance = 7.5
         st.session_state.num_images = 4
         st.session_state.width = 1024
         st.session_state.height = 1024
+        st.session_state.tome_ratio = 0.0
+        st.session_state.cfg_cutoff = 1.0
 
 
 def mode_card(mode: str):
@@ -74,11 +140,14 @@ def mode_card(mode: str):
     )
 
 
-def responsive_gallery(images, meta):
+def responsive_gallery(image_paths, meta):
     """
     Gallery grid + select one preview (more product-y).
+    Images come from disk through the shared decoded-image cache.
     """
-    if not images:
+    image_paths = [p for p in image_paths if get_backend().fetch(p)]
+    if not image_paths:
+        st.info("Images for this run are no longer available.")
         return
 
     mobile = st.session_state.get("mobile_mode", False)
@@ -88,31 +157,31 @@ def responsive_gallery(images, meta):
 
     st.markdown("### 🖼️ Gallery")
     grid = st.columns(cols, gap="medium")
-    for i, im in enumerate(images):
+    for i, path in enumerate(image_paths):
         with grid[i % cols]:
-            st.image(im, use_container_width=True)
+            st.image(get_image(path), use_container_width=True)
             if st.button("Select", key=f"select_{meta.get('run_id','run')}_{i}", use_container_width=True):
                 st.session_state["selected_idx"] = i
 
     sel = int(st.session_state.get("selected_idx", 0))
-    sel = max(0, min(sel, len(images) - 1))
+    sel = max(0, min(sel, len(image_paths) - 1))
 
     st.markdown("### 🔍 Preview")
-    st.image(images[sel], use_container_width=True)
+    st.image(get_image(image_paths[sel]), use_container_width=True)
 
+    ext = os.path.splitext(image_paths[sel])[1]
     st.download_button(
         "⬇️ Download Selected",
-        data=pil_to_bytes(images[sel]),
-        file_name=f"{meta.get('run_id','run')}_selected.png",
-        mime="image/png",
+        data=read_file(image_paths[sel]),
+        file_name=f"{meta.get('run_id','run')}_selected{ext}",
+        mime=mime_for(image_paths[sel]),
         use_container_width=True,
     )
 
 
 # ----------------- STATE DEFAULTS -----------------
-ss("latest_images", [])
+# only the run's meta (with image paths) lives in the session; pixels stay on disk
 ss("latest_meta", {})
-ss("latest_control_preview", None)
 
 ss("is_generating", False)
 
@@ -129,13 +198,39 @@ ss("num_images", 1)
 ss("seed", -1)
 ss("width", 1024)
 ss("height", 1024)
+ss("tome_ratio", 0.0)
+ss("dc_interval", 1)
+ss("dc_range", (0.1, 0.9))
+ss("cfg_cutoff", 1.0)
+ss("guidance_ramp", "constant")
+ss("guidance_end", 3.0)
+ss("priority", "auto")
 
 # tool settings
 ss("img2img_strength", 0.65)
-ss("cn_kind", "Canny")
-ss("cn_strength", 0.80)
+ss("cn_kinds", ["Canny"])
+for _k in CONTROLNETS:
+    ss(f"cn_strength_{_k}", 0.80)
+    ss(f"cn_range_{_k}", (0.0, 1.0))
 ss("inpaint_strength", 0.75)
 
+# sweep (X/Y grid, txt2img only)
+ss("sweep_enabled", False)
+ss("sweep_x", "seed")
+ss("sweep_x_values", "1, 2, 3, 4")
+ss("sweep_y", "none")
+ss("sweep_y_values", "")
+
+# best-of-K prompt variants (txt2img only)
+ss("fanout_enabled", False)
+ss("fanout_k", FANOUT_K)
+ss("fanout_scorer", FANOUT_SCORER)
+
+# diagnostics
+ss("profile_enabled", False)
+ss("profile_steps", (2, 4))
+ss("profile_cprofile", False)
+
 # responsive UI
 ss("mobile_mode", False)
 ss("mode", "Text-to-Image")
@@ -160,6 +255,7 @@ with st.sidebar:
         tabs = st.tabs(["⚡ Generate", "🧪 Studio", "🖼️ History", "🗂️ Gallery"])
         tab_choice = None
 
+    @fragment
     def render_gallery():
         side_header("Gallery", "🖼️")
         side_card_start()
@@ -197,8 +293,9 @@ with st.sidebar:
                 thumb_path = meta["image_paths"][0]
 
             with grid[i % cols]:
-                if thumb_path and os.path.exists(thumb_path):
-                    st.image(thumb_path, use_container_width=True)
+                thumb = get_thumbnail(thumb_path)
+                if thumb is not None:
+                    st.image(thumb, use_container_width=True)
                 else:
                     st.info("No image preview")
 
@@ -228,8 +325,25 @@ with st.sidebar:
         side_card_start()
         st.slider("Steps", 10, 60, key="steps", disabled=st.session_state["is_generating"])
         st.slider("Guidance", 1.0, 15.0, key="guidance", disabled=st.session_state["is_generating"])
+        st.slider("CFG cutoff", 0.3, 1.0, step=0.05, key="cfg_cutoff", disabled=st.session_state["is_generating"],
+                  help="Fraction of the steps after which the negative-prompt branch is dropped (half the UNet work "
+                       "for the rest). 1.0 = never.")
+        st.selectbox("Guidance ramp", list(RAMPS), key="guidance_ramp", disabled=st.session_state["is_generating"])
+        if st.session_state["guidance_ramp"] != "constant":
+            st.slider("Guidance at last step", 1.0, 15.0, key="guidance_end", disabled=st.session_state["is_generating"])
         st.selectbox("Batch", [1, 2, 4], key="num_images", disabled=st.session_state["is_generating"])
         st.number_input("Seed (-1 random)", key="seed", disabled=st.session_state["is_generating"])
+        st.selectbox("Priority", ["auto", *PRIORITIES], key="priority", disabled=st.session_state["is_generating"],
+                     help="Batch runs pause between steps while interactive runs use the GPU. "
+                          "Auto: batch for sweeps and large runs (steps × images × megapixels).")
+        st.slider("Token merging", 0.0, 0.75, step=0.05, key="tome_ratio", disabled=st.session_state["is_generating"],
+                  help="Share of high-resolution self-attention tokens merged per step. Faster; 0 = off.")
+        st.slider("Feature cache interval", 1, 5, key="dc_interval", disabled=st.session_state["is_generating"],
+                  help="Recompute the deep UNet blocks every N steps and reuse them in between. 1 = off.")
+        if st.session_state["dc_interval"] > 1:
+            st.slider("Feature cache active (fraction of steps)", 0.0, 1.0, step=0.05, key="dc_range",
+                      disabled=st.session_state["is_generating"],
+                      help="Steps before / after this range always run the full UNet (warmup / cooldown).")
         c1, c2, c3 = st.columns(3)
         with c1:
             st.button("⚡ Fast", use_container_width=True, on_click=apply_preset, args=("fast",), disabled=st.session_state["is_generating"])
@@ -237,7 +351,7 @@ with st.sidebar:
             st.button("✨ Best", use_container_width=True, on_click=apply_preset, args=("best",), disabled=st.session_state["is_generating"])
         with c3:
             st.button("🧪 HQ", use_container_width=True, on_click=apply_preset, args=("hq",), disabled=st.session_state["is_generating"])
-        side_tip("Presets adjust steps/guidance/batch/resolution.")
+        side_tip("Presets adjust steps/guidance/batch/resolution (Fast also merges tokens and cuts CFG early).")
         side_card_end()
 
         side_header("3) Canvas", "📐")
@@ -249,18 +363,65 @@ with st.sidebar:
 
         side_header("Tools", "🧰")
         side_card_start()
-        if mode == "Image-to-Image":
+        if mode == "Text-to-Image":
+            st.toggle("🧮 Sweep (X/Y grid)", key="sweep_enabled", disabled=st.session_state["is_generating"])
+            if st.session_state["sweep_enabled"]:
+                params = list(AXIS_PARAMS)
+                st.selectbox("X axis", params, key="sweep_x", disabled=st.session_state["is_generating"])
+                st.text_input("X values", key="sweep_x_values", disabled=st.session_state["is_generating"])
+                st.selectbox("Y axis", ["none"] + params, key="sweep_y", disabled=st.session_state["is_generating"])
+                if st.session_state["sweep_y"] != "none":
+                    st.text_input("Y values", key="sweep_y_values", disabled=st.session_state["is_generating"])
+                side_tip("Comma-separated, e.g. 5, 7, 9 or Anime, Photoreal. Same-shape cells share one batch.")
+            else:
+                st.toggle("🗳️ Best of K prompt variants", key="fanout_enabled", disabled=st.session_state["is_generating"])
+                if st.session_state["fanout_enabled"]:
+                    st.slider("Variants (K)", 2, 8, key="fanout_k", disabled=st.session_state["is_generating"])
+                    st.selectbox("Scorer", list(SCORERS), key="fanout_scorer", disabled=st.session_state["is_generating"])
+                    side_tip("Every variant (other styles / critic fixes) is previewed at low steps and resolution "
+                             "in one batch; only the best-scored one is rendered at full quality.")
+        elif mode == "Image-to-Image":
             st.slider("Img2Img strength", 0.10, 0.95, key="img2img_strength", disabled=st.session_state["is_generating"])
             side_tip("0.2–0.4 preserve reference, 0.7+ changes a lot.")
         elif mode == "ControlNet":
-            st.selectbox("Control type", ["Canny", "Depth"], key="cn_kind", disabled=st.session_state["is_generating"])
-            st.slider("Control strength", 0.05, 1.0, key="cn_strength", disabled=st.session_state["is_generating"])
-            side_tip("Canny=edges, Depth=structure.")
+            st.multiselect("Control types", list(CONTROLNETS), key="cn_kinds", disabled=st.session_state["is_generating"])
+            for k in st.session_state["cn_kinds"]:
+                st.slider(f"{k} strength", 0.05, 1.0, key=f"cn_strength_{k}", disabled=st.session_state["is_generating"])
+                st.slider(f"{k} active range", 0.0, 1.0, key=f"cn_range_{k}", step=0.05,
+                          disabled=st.session_state["is_generating"])
+            side_tip("Canny=edges, Depth=structure. Range = fraction of steps the control is applied; "
+                     "ending early frees the rest of the steps from that ControlNet.")
         elif mode == "Inpainting":
             st.slider("Inpaint strength", 0.10, 0.95, key="inpaint_strength", disabled=st.session_state["is_generating"])
             side_tip("White mask area will be edited.")
         side_card_end()
 
+        with st.expander("🩺 Diagnostics", expanded=False):
+            st.toggle("Profile this run", key="profile_enabled", disabled=st.session_state["is_generating"])
+            if st.session_state["profile_enabled"]:
+                st.slider("Profile steps", 1, 60, key="profile_steps", disabled=st.session_state["is_generating"])
+                st.checkbox("Also cProfile (Python)", key="profile_cprofile", disabled=st.session_state["is_generating"])
+                side_tip("Trace + top-N summary are written to outputs/<run_id>/.")
+            report = load_report()
+            if report.get("components"):
+                st.caption("Model load (s): " + " · ".join(f"{k} {v}" for k, v in report["components"].items())
+                           + f" · total {report.get('total', '-')}")
+            if report.get("cache_errors"):
+                st.caption("Model cache not written: " + " · ".join(f"{k} ({v})" for k, v in report["cache_errors"].items()))
+            mc = get_model_cache().stats()
+            if mc["models"]:
+                st.caption(f"Models: {mc['device_bytes'] / 2**30:.1f} GB on device, {mc['cpu_bytes'] / 2**30:.1f} GB in RAM · "
+                           f"{mc['hits']} hits · {mc['swap_ins']} swap-ins · {mc['loads']} loads · "
+                           f"{mc['demotions']} demoted · {mc['evictions']} evicted")
+            if ENGINE_ENABLED:
+                es = get_engine().stats()
+                st.caption(f"Engine: {es['images_per_minute']:.2f} img/min · busy "
+                           + " · ".join(f"{k} {100 * v:.0f}%" for k, v in es["utilisation"].items()))
+            for cls, lat in get_controller().latency_stats().items():
+                if lat["count"]:
+                    st.caption(f"{cls.capitalize()} latency ({lat['count']} runs): p50 {lat['p50']:.1f}s · "
+                               f"p90 {lat['p90']:.1f}s · p99 {lat['p99']:.1f}s · queue p90 {lat['wait_p90']:.1f}s")
+
         st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
 
         # Primary CTA
@@ -304,12 +465,24 @@ with st.sidebar:
         side_card_end()
 
     # ---------------- TAB: History ----------------
+    @fragment
     def render_history_sidebar():
         side_header("Persistent History", "🗂️")
         side_card_start()
         limit = st.slider("Load last N runs", 5, 100, 30, key="history_limit")
         index = load_index(limit=limit)
         st.write(f"Found **{len(index)}** runs on disk.")
+        report = retention.last_report()
+        if report and report.removed:
+            st.caption(f"Retention: removed {len(report.removed)} runs, "
+                       f"reclaimed {report.reclaimed_bytes / 1e6:.1f} MB in {report.seconds:.2f}s")
+        if SIMILARITY_INDEX and st.button("🔁 Find near-duplicates", key="find_dups", use_container_width=True):
+            dups = get_similarity_index().near_duplicates(limit=20)
+            if not dups:
+                st.caption("No near-duplicate images.")
+            for d in dups:
+                st.caption(f"`{d['a']['run_id']}` #{d['a']['image']} ≈ `{d['b']['run_id']}` #{d['b']['image']} "
+                           f"({d['distance']} bits)")
         side_card_end()
 
         if not index:
@@ -323,13 +496,20 @@ with st.sidebar:
             st.caption(f"Style: {row.get('style')}")
             st.caption(f"Goal: {str(row.get('goal',''))[:70]}")
 
-            if st.button(f"Load {rid}", key=f"load_{rid}", use_container_width=True):
-                meta = load_run_meta(rid)
-                if meta:
-                    st.session_state["latest_meta"] = meta
-                    st.success("Loaded run ✅")
-                else:
-                    st.error("Could not load meta.json for that run.")
+            c1, c2 = st.columns([3, 1])
+            with c1:
+                if st.button(f"Load {rid}", key=f"load_{rid}", use_container_width=True):
+                    meta = load_run_meta(rid)
+                    if meta:
+                        st.session_state["latest_meta"] = meta
+                        st.rerun()  # whole app, so the result panel shows the run
+                    else:
+                        st.error("Could not load meta.json for that run.")
+            with c2:
+                if st.button("⭐", key=f"star_{rid}", help="Star: keep this run when old outputs are cleaned up",
+                             use_container_width=True):
+                    set_starred(rid, True)
+                    st.toast("Starred ⭐")
             side_card_end()
 
     # render correct sidebar
@@ -378,23 +558,28 @@ with left:
 
     st.subheader("📤 Step 2 — Upload (only if needed)")
     ref_img = None
-    mask_img = None
+    mask_imgs = []
 
     if mode in ["Image-to-Image", "ControlNet"]:
         up = st.file_uploader("Reference Image", type=["png", "jpg", "jpeg"], key="ref_upload")
-        if up:
-            ref_img = Image.open(up).convert("RGB")
-            st.image(ref_img, use_container_width=True)
+        # decoded once per upload; the browser only gets a small preview
+        ref_img = from_uploaded(up)
+        if ref_img:
+            st.image(ref_img.preview(), use_container_width=True)
 
     if mode == "Inpainting":
         up1 = st.file_uploader("Base image", type=["png", "jpg", "jpeg"], key="base_upload")
-        up2 = st.file_uploader("Mask image (white=edit region)", type=["png", "jpg", "jpeg"], key="mask_upload")
-        if up1:
-            ref_img = Image.open(up1).convert("RGB")
-            st.image(ref_img, caption="Base image", use_container_width=True)
-        if up2:
-            mask_img = Image.open(up2).convert("RGB")
-            st.image(mask_img, caption="Mask image", use_container_width=True)
+        up2 = st.file_uploader("Mask image(s) (white=edit region; one region per mask)", type=["png", "jpg", "jpeg"],
+                               key="mask_upload", accept_multiple_files=True)
+        ref_img = from_uploaded(up1)
+        mask_imgs = [from_uploaded(u, mode="L") for u in up2 or []]
+        if ref_img:
+            st.image(ref_img.preview(), caption="Base image", use_container_width=True)
+        if mask_imgs:
+            mcols = st.columns(min(4, len(mask_imgs)))
+            for i, m in enumerate(mask_imgs):
+                with mcols[i % len(mcols)]:
+                    st.image(m.preview(256), caption=f"Mask {i + 1}", use_container_width=True)
 
 
 # ----------------- RIGHT: Agent + Output -----------------
@@ -406,168 +591,346 @@ with right:
             st.warning("Generation already running…")
             st.stop()
 
-        if is_blocked_prompt(goal):
-            st.error("Blocked prompt. Please modify.")
-            st.stop()
-
-        st.session_state["is_generating"] = True
-        progress = st.progress(0, text="Starting...")
-
-        try:
-            progress.progress(15, text="Agent planning prompt...")
-            agent = run_agent_loop(goal)
-
-            final_prompt = agent["final_prompt"]
-            final_negative = agent["final_negative_prompt"]
-
-            # Prompt studio override
-            if st.session_state["studio_enabled"] and st.session_state["studio_use_manual"]:
-                mp = st.session_state["studio_manual_prompt"].strip()
-                mn = st.session_state["studio_manual_negative"].strip()
-                if mp:
-                    final_prompt = mp
-                if mn:
-                    final_negative = mn
-
-            with st.expander("🧠 Agent details (optional)", expanded=False):
-                st.write(f"**Style:** `{agent.get('style')}`")
-                st.write("**Critic:**", agent.get("critique", {}).get("critique", ""))
-                st.write("**Final Prompt**")
-                st.code(final_prompt)
-                st.write("**Final Negative Prompt**")
-                st.code(final_negative)
-
-            meta = {
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "mode": mode,
-                "goal": goal,
-                "agent": agent,
-                "settings": {
-                    "steps": int(st.session_state["steps"]),
-                    "guidance": float(st.session_state["guidance"]),
-                    "seed": int(st.session_state["seed"]),
-                    "num_images": int(st.session_state["num_images"]),
-                    "width": int(st.session_state["width"]),
-                    "height": int(st.session_state["height"]),
+        # speed-ups are scoped to this run (and to its engine job, which copies the context)
+        with metrics.run_timings(), \
+                token_merging(st.session_state["tome_ratio"]) as tome_ratio, \
+                deep_cache(st.session_state["dc_interval"], *st.session_state["dc_range"]) as dc_settings, \
+                guidance_schedule(st.session_state["cfg_cutoff"], st.session_state["guidance_ramp"],
+                                  st.session_state["guidance_end"]) as cfg_settings:
+            with metrics.span("safety"):
+                blocked = is_blocked_prompt(goal)
+            if blocked:
+                st.error("Blocked prompt. Please modify.")
+                st.stop()
+
+            st.session_state["is_generating"] = True
+            progress = st.progress(0, text="Starting...")
+
+            try:
+                progress.progress(15, text="Agent planning prompt...")
+                with metrics.span("agent_loop"):
+                    agent = run_agent_loop(goal)
+
+                final_prompt = agent["final_prompt"]
+                final_negative = agent["final_negative_prompt"]
+
+                # Prompt studio override
+                if st.session_state["studio_enabled"] and st.session_state["studio_use_manual"]:
+                    mp = st.session_state["studio_manual_prompt"].strip()
+                    mn = st.session_state["studio_manual_negative"].strip()
+                    if mp:
+                        final_prompt = mp
+                    if mn:
+                        final_negative = mn
+
+                with st.expander("🧠 Agent details (optional)", expanded=False):
+                    st.write(f"**Style:** `{agent.get('style')}`")
+                    st.write("**Critic:**", agent.get("critique", {}).get("critique", ""))
+                    if agent.get("sources"):
+                        st.caption(" · ".join(f"{k}: {v}" for k, v in agent["sources"].items()))
+                    st.write("**Final Prompt**")
+                    st.code(final_prompt)
+                    st.write("**Final Negative Prompt**")
+                    st.code(final_negative)
+
+                meta = {
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "mode": mode,
+                    "goal": goal,
+                    "agent": agent,
+                    "model": model_info(),
+                    "settings": {
+                        "steps": int(st.session_state["steps"]),
+                        "guidance": float(st.session_state["guidance"]),
+                        "seed": int(st.session_state["seed"]),
+                        "num_images": int(st.session_state["num_images"]),
+                        "width": int(st.session_state["width"]),
+                        "height": int(st.session_state["height"]),
+                        "token_merging": tome_ratio,
+                        "deep_cache": dict(dc_settings),
+                        "cfg": cfg_settings,
+                    }
                 }
-            }
-
-            progress.progress(55, text="Diffusion sampling (generating images)...")
-            control_preview = None
-            t0 = time.time()
-
-            if mode == "Text-to-Image":
-                images = txt2img(
-                    final_prompt, final_negative,
-                    meta["settings"]["width"], meta["settings"]["height"],
-                    meta["settings"]["steps"], meta["settings"]["guidance"],
-                    meta["settings"]["seed"], meta["settings"]["num_images"]
-                )
-
-            elif mode == "Image-to-Image":
-                if ref_img is None:
-                    st.error("Upload image for img2img.")
-                    st.stop()
-
-                strength = float(st.session_state["img2img_strength"])
-                meta["settings"]["img2img_strength"] = strength
-
-                images = img2img(
-                    final_prompt, final_negative,
-                    ref_img, strength,
-                    meta["settings"]["steps"], meta["settings"]["guidance"],
-                    meta["settings"]["seed"], meta["settings"]["num_images"]
-                )
-
-            elif mode == "ControlNet":
-                if ref_img is None:
-                    st.error("Upload image for ControlNet.")
-                    st.stop()
-
-                cn_kind = st.session_state["cn_kind"]
-                cn_strength = float(st.session_state["cn_strength"])
-                meta["settings"]["controlnet"] = {"kind": cn_kind, "strength": cn_strength}
-
-                images, control_preview = controlnet_generate(
-                    cn_kind,
-                    final_prompt, final_negative,
-                    ref_img,
-                    meta["settings"]["width"], meta["settings"]["height"],
-                    meta["settings"]["steps"], meta["settings"]["guidance"],
-                    meta["settings"]["seed"], meta["settings"]["num_images"],
-                    control_strength=cn_strength
-                )
-
-            else:  # Inpainting
-                if ref_img is None or mask_img is None:
-                    st.error("Upload base + mask image for inpainting.")
-                    st.stop()
-
-                strength = float(st.session_state["inpaint_strength"])
-                meta["settings"]["inpaint_strength"] = strength
-
-                images = inpaint(
-                    final_prompt, final_negative,
-                    ref_img, mask_img,
-                    meta["settings"]["steps"], meta["settings"]["guidance"],
-                    meta["settings"]["seed"],
-                    strength=strength
-                )
-
-            meta["runtime_seconds"] = time.time() - t0
-
-            progress.progress(85, text="Saving run...")
-            run_id = new_run_id()
-            meta["run_id"] = run_id
-            run_dir = save_run(run_id, meta, images, control_preview=control_preview)
-
-            progress.progress(100, text="Done ✅")
-
-            st.success(f"Done in {meta['runtime_seconds']:.2f}s ✅")
-            st.caption(f"Saved to disk: `{run_dir}`")
-
-            st.session_state["latest_images"] = images
-            st.session_state["latest_meta"] = meta
-            st.session_state["latest_control_preview"] = control_preview
-
-        finally:
-            st.session_state["is_generating"] = False
-
-    # ----------------- SHOW LATEST -----------------
-    meta = st.session_state.get("latest_meta", {})
-    images = st.session_state.get("latest_images", [])
-    control_preview = st.session_state.get("latest_control_preview")
-
-    if meta:
-        st.markdown("### 🧾 Run Summary")
-        st.markdown(
-            f"- **Mode:** `{meta.get('mode')}`  \n"
-            f"- **Style:** `{meta.get('agent', {}).get('style')}`  \n"
-            f"- **Run ID:** `{meta.get('run_id')}`  \n"
-            f"- **Runtime:** `{meta.get('runtime_seconds', 0):.2f}s`"
-        )
 
-    if control_preview is not None:
-        st.markdown("### 🧩 Control Preview")
-        st.image(control_preview, use_container_width=True)
+                progress.progress(55, text="Diffusion sampling (generating images)...")
+                control_preview = variants_preview = None
+
+                run_id = new_run_id()
+                meta["run_id"] = run_id
+
+                profiling = st.session_state["profile_enabled"]
+                if profiling:
+                    meta["settings"]["profile"] = {
+                        "steps": list(st.session_state["profile_steps"]),
+                        "cprofile": bool(st.session_state["profile_cprofile"]),
+                    }
+                    profile_ctx = profile_run(
+                        os.path.join(OUTPUT_DIR, run_id),
+                        steps=st.session_state["profile_steps"],
+                        use_cprofile=st.session_state["profile_cprofile"],
+                    )
+                else:
+                    profile_ctx = nullcontext()
+
+                sweep_cells = None
+                if mode == "Text-to-Image" and st.session_state["sweep_enabled"]:
+                    try:
+                        x_axis = (st.session_state["sweep_x"],
+                                  parse_axis(st.session_state["sweep_x"], st.session_state["sweep_x_values"]))
+                        y_axis = None
+                        if st.session_state["sweep_y"] != "none":
+                            y_axis = (st.session_state["sweep_y"],
+                                      parse_axis(st.session_state["sweep_y"], st.session_state["sweep_y_values"]))
+                        sweep_cells = plan_cells(goal, final_prompt, final_negative, agent,
+                                                 meta["settings"], x_axis, y_axis)
+                    except ValueError as e:
+                        st.error(str(e))
+                        st.stop()
+                    meta["sweep"] = {"x": list(x_axis), "y": list(y_axis) if y_axis else None}
+
+                priority = st.session_state["priority"]
+                if priority == "auto":
+                    cost = [meta["settings"][k] for k in ("steps", "num_images", "width", "height")]
+                    priority = "batch" if sweep_cells else classify(*cost)
+                meta["settings"]["priority"] = priority
+
+                variants = None
+                if mode == "Text-to-Image" and not sweep_cells and st.session_state["fanout_enabled"]:
+                    base = dict(agent, final_prompt=final_prompt, final_negative_prompt=final_negative)
+                    variants = agent_variants(goal, int(st.session_state["fanout_k"]), base=base)
+
+                use_engine = (ENGINE_ENABLED and not sweep_cells and not variants and not profiling
+                              and mode in ("Text-to-Image", "Image-to-Image"))
+                if use_engine:
+                    # queued behind other sessions' jobs; their decode/save and our encode overlap the denoiser
+                    if mode == "Image-to-Image":
+                        if ref_img is None:
+                            st.error("Upload image for img2img.")
+                            st.stop()
+                        strength = float(st.session_state["img2img_strength"])
+                        meta["settings"]["img2img_strength"] = strength
+                        job = EngineJob(run_id, meta, mode="img2img", prompt=final_prompt, negative=final_negative,
+                                        init_image=ref_img, strength=strength, priority=priority)
+                    else:
+                        job = EngineJob(run_id, meta, mode="txt2img", prompt=final_prompt, negative=final_negative,
+                                        priority=priority)
+                    fut = get_engine().submit(job)
+                    while not fut.done():
+                        progress.progress(55 if job.stage != "finish" else 85, text=f"Engine: {job.stage}...")
+                        time.sleep(0.25)
+                    run_dir = fut.result()
+                else:
+                    admission = get_controller()
+                    queue_note = st.empty()
+
+                    def _on_wait(pos, eta):
+                        queue_note.info(f"⏳ Waiting for a free GPU slot — position {pos + 1} in queue, ~{eta:.0f}s")
+
+                    # direct pipeline calls upcast the shared VAE internally; keep the engine's decode off it meanwhile.
+                    # A run holding that lock must not wait for the device again, so it is not preemptible then.
+                    with admission.admit(on_wait=_on_wait, priority=priority) as ticket, \
+                            (VAE_LOCK if ENGINE_ENABLED else nullcontext()):
+                        queue_note.empty()
+                        t0 = time.time()
+                        preempt_ctx = preemptible(ticket) if not ENGINE_ENABLED else nullcontext({"priority": priority})
+                        with profile_ctx as profile_info, preempt_ctx as scheduling:
+                            if sweep_cells:
+                                render_cells(sweep_cells, meta["settings"]["width"], meta["settings"]["height"])
+                                images = [make_grid(sweep_cells, x_axis, y_axis)]
+
+                            elif variants:
+                                fan = fan_out(
+                                    variants,
+                                    meta["settings"]["width"], meta["settings"]["height"],
+                                    meta["settings"]["steps"], meta["settings"]["guidance"],
+                                    meta["settings"]["seed"], meta["settings"]["num_images"],
+                                    goal=goal, scorer=st.session_state["fanout_scorer"],
+                                )
+                                images = fan.images
+                                variants_preview = preview_sheet(fan, variants)
+                                meta["agent"] = variants[fan.winner]
+                                meta["fanout"] = fan.as_dict(variants)
+
+                            elif mode == "Text-to-Image":
+                                images = txt2img(
+                                    final_prompt, final_negative,
+                                    meta["settings"]["width"], meta["settings"]["height"],
+                                    meta["settings"]["steps"], meta["settings"]["guidance"],
+                                    meta["settings"]["seed"], meta["settings"]["num_images"]
+                                )
+
+                            elif mode == "Image-to-Image":
+                                if ref_img is None:
+                                    st.error("Upload image for img2img.")
+                                    st.stop()
+
+                                strength = float(st.session_state["img2img_strength"])
+                                meta["settings"]["img2img_strength"] = strength
+
+                                images = img2img(
+                                    final_prompt, final_negative,
+                                    ref_img, strength,
+                                    meta["settings"]["steps"], meta["settings"]["guidance"],
+                                    meta["settings"]["seed"], meta["settings"]["num_images"]
+                                )
+
+                            elif mode == "ControlNet":
+                                if ref_img is None:
+                                    st.error("Upload image for ControlNet.")
+                                    st.stop()
+
+                                if not st.session_state["cn_kinds"]:
+                                    st.error("Pick at least one control type.")
+                                    st.stop()
+
+                                controls = []
+                                for k in st.session_state["cn_kinds"]:
+                                    start, end = st.session_state[f"cn_range_{k}"]
+                                    controls.append({"kind": k, "scale": float(st.session_state[f"cn_strength_{k}"]),
+                                                     "start": float(start), "end": float(end)})
+                                meta["settings"]["controlnet"] = [
+                                    {"kind": c["kind"], "strength": c["scale"], "start": c["start"], "end": c["end"]}
+                                    for c in controls
+                                ]
+
+                                images, control_preview = controlnet_generate(
+                                    controls,
+                                    final_prompt, final_negative,
+                                    ref_img,
+                                    meta["settings"]["width"], meta["settings"]["height"],
+                                    meta["settings"]["steps"], meta["settings"]["guidance"],
+                                    meta["settings"]["seed"], meta["settings"]["num_images"],
+                                )
+
+                            else:  # Inpainting
+                                if ref_img is None or not mask_imgs:
+                                    st.error("Upload base + mask image for inpainting.")
+                                    st.stop()
+
+                                strength = float(st.session_state["inpaint_strength"])
+                                meta["settings"]["inpaint_strength"] = strength
+                                # one batched call for every (mask, variant); images are saved mask-major
+                                meta["settings"]["inpaint_masks"] = len(mask_imgs)
+
+                                images = inpaint(
+                                    final_prompt, final_negative,
+                                    ref_img, mask_imgs,
+                                    meta["settings"]["steps"], meta["settings"]["guidance"],
+                                    meta["settings"]["seed"],
+                                    strength=strength,
+                                    num_images=meta["settings"]["num_images"],
+                                )
+
+                        if profiling:
+                            meta["profile"] = profile_info
+                        meta["scheduling"] = scheduling
+
+                        meta["runtime_seconds"] = time.time() - t0
+
+                    progress.progress(85, text="Saving run...")
+                    if sweep_cells:
+                        run_dir = save_sweep(run_id, meta, images[0], [
+                            {"image": c.image, "settings": c.settings(meta["settings"]), "agent": c.agent,
+                             "cell": {x_axis[0]: x_axis[1][c.x], **({y_axis[0]: y_axis[1][c.y]} if y_axis else {})}}
+                            for c in sweep_cells
+                        ])
+                        del sweep_cells
+                    else:
+                        run_dir = save_run(run_id, meta, images, control_preview=control_preview,
+                                           variants_preview=variants_preview)
+                    del images, control_preview, variants_preview  # from here on the run is served from disk
+                meta = load_run_meta(run_id) or meta  # as stored, timings included
+                metrics.write_prometheus()
+
+                progress.progress(100, text="Done ✅")
+
+                st.success(f"Done in {meta['runtime_seconds']:.2f}s ✅")
+                st.caption(f"Saved to disk: `{run_dir}`")
+                if meta.get("profile", {}).get("chrome_trace"):
+                    st.caption(f"Profile trace: `{meta['profile']['chrome_trace']}`")
+
+                st.session_state["latest_meta"] = meta
+                st.session_state["selected_idx"] = 0
+
+            finally:
+                st.session_state["is_generating"] = False
 
-    if images:
-        responsive_gallery(images, meta)
+    # ----------------- SHOW LATEST -----------------
+    @fragment
+    def render_results():
+        meta = st.session_state.get("latest_meta", {})
+        image_paths = meta.get("image_paths") or []
+        control_preview = get_image(meta.get("control_preview_path"))
+        variants_preview = get_image(meta.get("variants_preview_path"))
+
+        if meta:
+            st.markdown("### 🧾 Run Summary")
+            st.markdown(
+                f"- **Mode:** `{meta.get('mode')}`  \n"
+                f"- **Style:** `{meta.get('agent', {}).get('style')}`  \n"
+                f"- **Run ID:** `{meta.get('run_id')}`  \n"
+                f"- **Runtime:** `{meta.get('runtime_seconds', 0):.2f}s`"
+            )
+            stages = meta.get("timings", {}).get("stages")
+            if stages:
+                with st.expander("⏱️ Stage timings", expanded=False):
+                    st.table({"stage": list(stages), "seconds": [f"{v:.3f}" for v in stages.values()]})
+                    if meta["timings"].get("unet_step_mean"):
+                        st.caption(f"UNet: {len(meta['timings']['unet_steps'])} calls · "
+                                   f"{meta['timings']['unet_step_mean']:.3f}s mean per step")
+
+        if control_preview is not None:
+            st.markdown("### 🧩 Control Preview")
+            st.image(control_preview, use_container_width=True)
+
+        if variants_preview is not None:
+            fan = meta.get("fanout") or {}
+            st.markdown("### 🗳️ Variant previews")
+            st.image(variants_preview, use_container_width=True)
+            if fan:
+                st.caption(f"{fan['k']} variants · {fan['preview_steps']} steps at "
+                           f"{fan['preview_size'][0]}×{fan['preview_size'][1]} · scorer `{fan['scorer']}` · "
+                           f"{100 * fan['compute_vs_full_render_of_all']:.0f}% of the compute of rendering all at full quality")
+
+        if image_paths:
+            responsive_gallery(image_paths, meta)
+
+            st.markdown("### ⬇️ Downloads")
+            st.download_button(
+                "⬇️ Download ALL (ZIP)",
+                data=_zip_outputs(tuple(image_paths), _files_sig(image_paths)),
+                file_name=f"{meta.get('run_id','run')}_outputs.zip",
+                mime="application/zip",
+                use_container_width=True,
+            )
+            st.download_button(
+                "⬇️ Download Metadata JSON",
+                data=json.dumps(meta, indent=2),
+                file_name=f"{meta.get('run_id','run')}_meta.json",
+                mime="application/json",
+                use_container_width=True,
+            )
+
+            if SIMILARITY_INDEX and meta.get("run_id"):
+                with st.expander("🔎 Similar runs", expanded=False):
+                    similar = get_similarity_index().similar_to_run(meta["run_id"], k=6)
+                    if not similar:
+                        st.caption("Nothing similar indexed yet.")
+                    cols = st.columns(3)
+                    for i, hit in enumerate(similar):
+                        other = load_run_meta(hit["run_id"])
+                        if not other or not other.get("image_paths"):
+                            continue
+                        paths = other["image_paths"]
+                        with cols[i % 3]:
+                            thumb = get_thumbnail(paths[min(hit["image"], len(paths)) - 1])
+                            if thumb is not None:
+                                st.image(thumb, use_container_width=True)
+                            st.caption(f"{hit['distance']} bits · `{hit['run_id']}`")
+                            if st.button("Load", key=f"similar_{hit['run_id']}", use_container_width=True):
+                                st.session_state["latest_meta"] = other
+                                st.rerun()
+        else:
+            st.info("Generate something to see outputs here ✅")
 
-        st.markdown("### ⬇️ Downloads")
-        st.download_button(
-            "⬇️ Download ALL (ZIP)",
-            data=zip_images(images),
-            file_name=f"{meta.get('run_id','run')}_outputs.zip",
-            mime="application/zip",
-            use_container_width=True,
-        )
-        st.download_button(
-            "⬇️ Download Metadata JSON",
-            data=json.dumps(meta, indent=2),
-            file_name=f"{meta.get('run_id','run')}_meta.json",
-            mime="application/json",
-            use_container_width=True,
-        )
-    else:
-        st.info("Generate something to see outputs here ✅")
+    render_results()
@@ -0,0 +1,84 @@
+"""
+Guidance scheduling: wall time saved by dropping the unconditional branch after
+a fraction of the steps (and by guidance ramps), and similarity to full CFG,
+on fixed seeds.
+
+    python -m benchmarks.bench_cfg --cutoffs 1.0 0.8 0.6 0.5 0.4 --steps 30 --size 1024
+
+Each cutoff runs with a constant guidance scale; --ramps adds rows for the
+ramps (to --ramp-end at the last step) with no cutoff.
+"""
+import argparse, json, os, tempfile, time
+
+import numpy as np
+
+from benchmarks.bench_tome import ssim, psnr, _luma
+from src import metrics
+from src.guidance import guidance_schedule
+from src.pipeline_sdxl import txt2img
+
+PROMPT = "portrait of an old fisherman, natural light, 85mm, detailed skin"
+NEGATIVE = "blurry, lowres, deformed hands, extra fingers, watermark"  # refiner-style negative prompt
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cutoffs", type=float, nargs="+", default=[1.0, 0.8, 0.6, 0.5, 0.4])
+    ap.add_argument("--ramps", nargs="*", default=["linear", "cosine"])
+    ap.add_argument("--ramp-end", type=float, default=3.0)
+    ap.add_argument("--guidance", type=float, default=6.5)
+    ap.add_argument("--steps", type=int, default=30)
+    ap.add_argument("--size", type=int, default=1024)
+    ap.add_argument("--seeds", type=int, nargs="+", default=[1, 2, 3])
+    ap.add_argument("--out", default=None, help="keep the images here (default: a temp dir)")
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    metrics.ENABLED = True
+    args.out = args.out or tempfile.mkdtemp(prefix="bench_cfg_")
+    os.makedirs(args.out, exist_ok=True)
+    configs = [(c, "constant") for c in sorted(set([1.0] + args.cutoffs), reverse=True)]
+    configs += [(1.0, r) for r in args.ramps]
+    txt2img(PROMPT, NEGATIVE, 512, 512, 2, args.guidance, 0, 1)  # warm-up: kernels, allocator
+
+    baseline, rows = {}, []
+    for cutoff, ramp in configs:
+        secs, steps, sims, psnrs = [], [], [], []
+        for seed in args.seeds:
+            t0 = time.perf_counter()
+            with guidance_schedule(cutoff, ramp, args.ramp_end), metrics.run_timings() as rt:
+                img = txt2img(PROMPT, NEGATIVE, args.size, args.size, args.steps, args.guidance, seed, 1)[0]
+            secs.append(time.perf_counter() - t0)
+            steps.append(rt.unet_steps)
+            img.save(os.path.join(args.out, f"cfg{cutoff:.2f}_{ramp}_seed{seed}.png"))
+            y = _luma(img)
+            if (cutoff, ramp) == (1.0, "constant"):
+                baseline[seed] = y
+            sims.append(ssim(baseline[seed], y))
+            psnrs.append(psnr(baseline[seed], y))
+        split = max(1, int(np.ceil(cutoff * args.steps)))
+        guided = [t for s in steps for t in s[1:split]]
+        unguided = [t for s in steps for t in s[split:]]
+        rows.append({"cutoff": cutoff, "ramp": ramp, "seconds_per_image": float(np.mean(secs)),
+                     "guided_step_seconds": float(np.mean(guided)) if guided else None,
+                     "unguided_step_seconds": float(np.mean(unguided)) if unguided else None,
+                     "ssim_mean": float(np.mean(sims)), "ssim_min": float(np.min(sims)),
+                     "psnr_db": float(np.mean(psnrs))})
+
+    base = rows[0]["seconds_per_image"]
+    print(f"{'cutoff':>6} {'ramp':<9} {'s/img':>7} {'saved':>7} {'cfg step':>9} {'cond step':>10} {'SSIM':>6} {'PSNR':>7}")
+    for row in rows:
+        row["wall_saving"] = 1.0 - row["seconds_per_image"] / base
+        g, u = row["guided_step_seconds"], row["unguided_step_seconds"]
+        print(f"{row['cutoff']:>6.2f} {row['ramp']:<9} {row['seconds_per_image']:>7.2f} {100 * row['wall_saving']:>6.1f}% "
+              f"{(f'{g:.3f}s' if g else '-'):>9} {(f'{u:.3f}s' if u else '-'):>10} "
+              f"{row['ssim_mean']:>6.3f} {row['psnr_db']:>6.1f}dB")
+    print(f"images: {args.out}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"size": args.size, "steps": args.steps, "guidance": args.guidance, "seeds": args.seeds,
+                       "rows": rows, "images": args.out}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Encode time and size per output codec setting, on real saved outputs.
+
+    python -m benchmarks.bench_codecs                 # every image under outputs/
+    python -m benchmarks.bench_codecs some/dir a.png --limit 20 --json codecs.json
+
+Lossy settings also report PSNR against the decoded original.
+"""
+import argparse, glob, io, json, os, time
+
+import numpy as np
+from PIL import Image
+
+from src.config import OUTPUT_DIR
+from src.image_codecs import OutputFormat, encode
+
+SETTINGS = {
+    "png-1": OutputFormat("png", png_compress_level=1),
+    "png-6": OutputFormat("png", png_compress_level=6),
+    "png-9": OutputFormat("png", png_compress_level=9),
+    "webp_lossless-m0": OutputFormat("webp_lossless", effort=0),
+    "webp_lossless-m4": OutputFormat("webp_lossless", effort=4),
+    "webp_lossless-m6": OutputFormat("webp_lossless", effort=6),
+    "webp-q95": OutputFormat("webp", quality=95),
+    "webp-q90": OutputFormat("webp", quality=90),
+    "jpeg-q95": OutputFormat("jpeg", quality=95),
+    "jpeg-q90": OutputFormat("jpeg", quality=90),
+}
+BASELINE = "png-6"  # what save_run wrote before output formats were configurable
+
+
+def _collect(paths, limit):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for ext in ("png", "webp", "jpg"):
+                files += glob.glob(os.path.join(p, "**", f"image_*.{ext}"), recursive=True)
+        else:
+            files.append(p)
+    return sorted(files)[:limit]
+
+
+def _psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def run(files, repeats=1):
+    images = []
+    for f in files:
+        with Image.open(f) as im:
+            images.append(im.convert("RGB"))
+    params = {"prompt": "benchmark", "settings": {"steps": 30, "guidance": 6.5, "seed": 1}}
+
+    results = {}
+    for name, fmt in SETTINGS.items():
+        secs, sizes, psnrs = [], [], []
+        for img in images:
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                data = encode(img, fmt, params)
+            secs.append((time.perf_counter() - t0) / repeats)
+            sizes.append(len(data))
+            if fmt.codec in ("webp", "jpeg"):
+                with Image.open(io.BytesIO(data)) as dec:
+                    psnrs.append(_psnr(np.asarray(img), np.asarray(dec.convert("RGB"))))
+        results[name] = {
+            "encode_ms": 1000 * float(np.mean(secs)),
+            "kb_per_image": float(np.mean(sizes)) / 1024,
+            "psnr_db": float(np.mean(psnrs)) if psnrs else None,
+        }
+
+    base = results[BASELINE]["kb_per_image"]
+    for r in results.values():
+        r["size_vs_png6"] = r["kb_per_image"] / base
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", default=[OUTPUT_DIR])
+    ap.add_argument("--limit", type=int, default=50)
+    ap.add_argument("--repeats", type=int, default=1)
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    files = _collect(args.paths, args.limit)
+    if not files:
+        raise SystemExit("No images found. Generate something first, or pass image paths.")
+
+    results = run(files, args.repeats)
+    print(f"{len(files)} images\n")
+    print(f"{'setting':<20}{'encode ms':>11}{'KB/image':>11}{'vs png-6':>10}{'PSNR dB':>10}")
+    for name, r in results.items():
+        psnr = f"{r['psnr_db']:.1f}" if r["psnr_db"] is not None else "lossless"
+        print(f"{name:<20}{r['encode_ms']:>11.1f}{r['kb_per_image']:>11.1f}{r['size_vs_png6']:>10.2f}{psnr:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": len(files), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
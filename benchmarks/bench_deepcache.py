@@ -0,0 +1,103 @@
+"""
+Cross-step feature caching: wall time per image and similarity to the uncached
+image for each pipeline mode and cache interval, on fixed seeds.
+
+    python -m benchmarks.bench_deepcache --intervals 1 2 3 4 --modes txt2img img2img inpaint controlnet
+
+img2img / inpaint / ControlNet start from the uncached txt2img image of the
+same seed (inpaint repaints its centre square, ControlNet uses its Canny edges).
+"""
+import argparse, json, os, tempfile, time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.bench_tome import ssim, psnr, _luma
+from src import metrics
+from src.deep_cache import deep_cache
+from src.pipeline_sdxl import txt2img, img2img
+from src.pipeline_inpaint import inpaint
+from src.pipeline_controlnet import controlnet_generate
+
+PROMPT = "a lighthouse on a cliff at dusk, volumetric fog, highly detailed"
+NEGATIVE = "blurry, lowres"
+GUIDANCE = 6.5
+
+
+def _mask(size: int) -> Image.Image:
+    m = Image.new("L", (size, size), 0)
+    m.paste(255, (size // 4, size // 4, 3 * size // 4, 3 * size // 4))
+    return m
+
+
+def _run(mode: str, ref: Image.Image, args, seed: int) -> Image.Image:
+    if mode == "txt2img":
+        return txt2img(PROMPT, NEGATIVE, args.size, args.size, args.steps, GUIDANCE, seed, 1)[0]
+    if mode == "img2img":
+        return img2img(PROMPT, NEGATIVE, ref, 0.65, args.steps, GUIDANCE, seed, 1)[0]
+    if mode == "inpaint":
+        return inpaint(PROMPT, NEGATIVE, ref, _mask(ref.width), args.steps, GUIDANCE, seed, strength=0.75)[0]
+    images, _ = controlnet_generate("Canny", PROMPT, NEGATIVE, ref, args.size, args.size,
+                                    args.steps, GUIDANCE, seed, 1)
+    return images[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 3, 4])
+    ap.add_argument("--modes", nargs="+", default=["txt2img", "img2img", "inpaint", "controlnet"],
+                    choices=["txt2img", "img2img", "inpaint", "controlnet"])
+    ap.add_argument("--start", type=float, default=0.1, help="cache from this fraction of the steps")
+    ap.add_argument("--end", type=float, default=0.9, help="... up to this one")
+    ap.add_argument("--steps", type=int, default=30)
+    ap.add_argument("--size", type=int, default=1024)
+    ap.add_argument("--seeds", type=int, nargs="+", default=[1, 2])
+    ap.add_argument("--out", default=None, help="keep the images here (default: a temp dir)")
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    metrics.ENABLED = True
+    args.out = args.out or tempfile.mkdtemp(prefix="bench_deepcache_")
+    os.makedirs(args.out, exist_ok=True)
+    intervals = sorted(set([1] + args.intervals))
+    txt2img(PROMPT, NEGATIVE, 512, 512, 2, GUIDANCE, 0, 1)  # warm-up: kernels, allocator
+    refs = {s: txt2img(PROMPT, NEGATIVE, args.size, args.size, args.steps, GUIDANCE, s, 1)[0] for s in args.seeds}
+
+    rows = []
+    for mode in args.modes:
+        baseline = {}
+        for k in intervals:
+            secs, sims, psnrs, cached = [], [], [], 0
+            for seed in args.seeds:
+                t0 = time.perf_counter()
+                with deep_cache(k, args.start, args.end) as dc:
+                    img = _run(mode, refs[seed], args, seed)
+                secs.append(time.perf_counter() - t0)
+                cached += dc.get("cached_steps", 0)
+                img.save(os.path.join(args.out, f"{mode}_k{k}_seed{seed}.png"))
+                y = _luma(img)
+                if k == 1:
+                    baseline[seed] = y
+                sims.append(ssim(baseline[seed], y))
+                psnrs.append(psnr(baseline[seed], y))
+            rows.append({"mode": mode, "interval": k, "seconds_per_image": float(np.mean(secs)),
+                         "cached_steps_per_image": cached / len(args.seeds),
+                         "ssim_mean": float(np.mean(sims)), "ssim_min": float(np.min(sims)),
+                         "psnr_db": float(np.mean(psnrs))})
+
+    print(f"{'mode':<11} {'K':>2} {'s/img':>7} {'speedup':>8} {'cached':>7} {'SSIM':>6} {'min':>6} {'PSNR':>7}")
+    for row in rows:
+        base = next(r for r in rows if r["mode"] == row["mode"] and r["interval"] == 1)
+        row["speedup"] = base["seconds_per_image"] / row["seconds_per_image"]
+        print(f"{row['mode']:<11} {row['interval']:>2} {row['seconds_per_image']:>7.2f} {row['speedup']:>7.2f}x "
+              f"{row['cached_steps_per_image']:>7.1f} {row['ssim_mean']:>6.3f} {row['ssim_min']:>6.3f} "
+              f"{row['psnr_db']:>6.1f}dB")
+    print(f"images: {args.out}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"size": args.size, "steps": args.steps, "seeds": args.seeds, "start": args.start,
+                       "end": args.end, "rows": rows, "images": args.out}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Sustained images/minute: jobs run back to back on the direct path vs. through
+the stage-overlapped engine, plus the engine's per-stage utilisation.
+
+    python -m benchmarks.bench_engine --jobs 8 --steps 20 --size 768
+
+Both runs save to outputs/ like the app does (tagged "bench" in the goal).
+"""
+import argparse, json, time
+
+from src import metrics
+from src.engine import EngineJob, get_engine
+from src.pipeline_sdxl import txt2img, get_txt2img
+from src.storage import new_run_id, save_run
+
+PROMPTS = [
+    "a lighthouse on a cliff at dusk, volumetric fog",
+    "a red fox in fresh snow, telephoto",
+    "an art deco train station interior, warm light",
+    "a bowl of ramen, overhead shot, steam",
+]
+
+
+def _meta(i, args):
+    return {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "mode": "Text-to-Image",
+        "goal": f"bench {i}",
+        "agent": {"style": "bench", "final_prompt": PROMPTS[i % len(PROMPTS)], "final_negative_prompt": "blurry"},
+        "settings": {"steps": args.steps, "guidance": 6.5, "seed": i, "num_images": 1,
+                     "width": args.size, "height": args.size},
+    }
+
+
+def run_direct(args):
+    t0 = time.perf_counter()
+    for i in range(args.jobs):
+        m = _meta(i, args)
+        s = m["settings"]
+        images = txt2img(m["agent"]["final_prompt"], "blurry", s["width"], s["height"],
+                         s["steps"], s["guidance"], s["seed"], 1)
+        save_run(new_run_id(), m, images)
+    return time.perf_counter() - t0
+
+
+def run_engine(args):
+    engine = get_engine()
+    t0 = time.perf_counter()
+    futures = []
+    for i in range(args.jobs):
+        m = _meta(i, args)
+        futures.append(engine.submit(EngineJob(new_run_id(), m, prompt=m["agent"]["final_prompt"], negative="blurry")))
+    for f in futures:
+        f.result()
+    return time.perf_counter() - t0, engine.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--jobs", type=int, default=8)
+    ap.add_argument("--steps", type=int, default=20)
+    ap.add_argument("--size", type=int, default=768)
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    metrics.ENABLED = True
+    get_txt2img()
+    txt2img(PROMPTS[0], "", 512, 512, 2, 5.0, 0, 1)  # warm-up: kernels, allocator
+
+    direct = run_direct(args)
+    engine, stats = run_engine(args)
+    res = {
+        "jobs": args.jobs,
+        "direct_images_per_minute": 60.0 * args.jobs / direct,
+        "engine_images_per_minute": 60.0 * args.jobs / engine,
+        "speedup": direct / engine,
+        "engine_utilisation": stats["utilisation"],
+    }
+    print(f"direct: {res['direct_images_per_minute']:.2f} img/min   engine: {res['engine_images_per_minute']:.2f} img/min"
+          f"   x{res['speedup']:.2f}")
+    for stage, u in stats["utilisation"].items():
+        print(f"  {stage:<8} {100 * u:5.1f}% busy")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
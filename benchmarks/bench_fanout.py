@@ -0,0 +1,79 @@
+"""
+Best-of-K prompt variants: fan-out (cheap previews + the winner at full quality)
+vs. rendering every variant at full quality and picking the best.
+
+    python -m benchmarks.bench_fanout --k 4 --steps 30 --size 1024 --preview-steps 8
+
+For each goal both strategies use the same variants and seed. Reports wall time
+per goal, the UNet-work ratio, and how often the preview pass picks the variant
+that the scorer prefers among the full-quality renders (and the score it gets).
+"""
+import argparse, json, time
+
+import numpy as np
+
+from src import metrics
+from src.agent_loop import agent_variants
+from src.fanout import SCORERS, fan_out
+from src.pipeline_sdxl import txt2img
+
+GOALS = [
+    "a lighthouse on a cliff at dusk",
+    "portrait of an old fisherman",
+    "a dragon over a mountain village",
+    "a bowl of ramen on a wooden table",
+]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--steps", type=int, default=30)
+    ap.add_argument("--size", type=int, default=1024)
+    ap.add_argument("--preview-steps", type=int, default=8)
+    ap.add_argument("--preview-side", type=int, default=512)
+    ap.add_argument("--scorer", default="heuristic", choices=list(SCORERS))
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    metrics.ENABLED = True
+    txt2img(GOALS[0], "", 512, 512, 2, 6.5, 0, 1)  # warm-up: kernels, allocator
+    score = SCORERS[args.scorer]
+
+    rows = []
+    for goal in GOALS:
+        variants = agent_variants(goal, args.k)
+        t0 = time.perf_counter()
+        full = [txt2img(v["final_prompt"], v["final_negative_prompt"], args.size, args.size, args.steps, 6.5,
+                        args.seed, 1)[0] for v in variants]
+        full_scores = score(full, goal)
+        t_full = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        fan = fan_out(variants, args.size, args.size, args.steps, 6.5, args.seed, goal=goal, scorer=args.scorer,
+                      preview_steps=args.preview_steps, preview_side=args.preview_side)
+        t_fan = time.perf_counter() - t0
+
+        best = int(np.argmax(full_scores))
+        rows.append({"goal": goal, "full_seconds": t_full, "fanout_seconds": t_fan,
+                     "unet_work_ratio": fan.cost_ratio, "fanout_pick": fan.winner, "full_pick": best,
+                     # rank of fan-out's pick among the full renders, 0 = the best one
+                     "pick_rank": int(sorted(range(len(full_scores)), key=lambda i: -full_scores[i]).index(fan.winner))})
+
+    print(f"{'goal':<36} {'all full':>9} {'fan-out':>8} {'wall':>6} {'work':>6} {'pick':>5} {'best':>5} {'rank':>5}")
+    for r in rows:
+        print(f"{r['goal'][:36]:<36} {r['full_seconds']:>8.1f}s {r['fanout_seconds']:>7.1f}s "
+              f"{r['fanout_seconds'] / r['full_seconds']:>6.2f} {r['unet_work_ratio']:>6.2f} "
+              f"{r['fanout_pick']:>5} {r['full_pick']:>5} {r['pick_rank']:>5}")
+    agree = np.mean([r["fanout_pick"] == r["full_pick"] for r in rows])
+    print(f"preview pass picked the full-quality favourite in {100 * agree:.0f}% of goals "
+          f"(mean rank {np.mean([r['pick_rank'] for r in rows]):.2f} of {args.k})")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "steps": args.steps, "size": args.size, "preview_steps": args.preview_steps,
+                       "preview_side": args.preview_side, "scorer": args.scorer, "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+float32 vs. int8 dynamic quantization on CPU: seconds per UNet step, peak RSS
+and output drift on fixed seeds.
+
+    python -m benchmarks.bench_quant --steps 10 --size 512 --seeds 1 2 3
+
+Each mode runs in its own subprocess (AIG_QUANTIZE is read at import, and
+peak RSS must not mix the two). Images are kept in --out for inspection.
+"""
+import argparse, json, os, resource, subprocess, sys, tempfile, time
+
+import numpy as np
+from PIL import Image
+
+PROMPT = "a lighthouse on a cliff at dusk, volumetric fog, highly detailed"
+NEGATIVE = "blurry, lowres"
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / (1024 * 1024) if sys.platform == "darwin" else r / 1024
+
+
+def worker(args):
+    from src import metrics
+    from src.model_loader import load_components, model_info
+    from src.pipeline_sdxl import txt2img
+
+    metrics.ENABLED = True
+    t0 = time.perf_counter()
+    load_components()
+    load_s = time.perf_counter() - t0
+
+    step_times = []
+    for seed in args.seeds:
+        with metrics.run_timings() as rt:
+            images = txt2img(PROMPT, NEGATIVE, args.size, args.size, args.steps, 6.5, seed, 1)
+        step_times += rt.unet_steps[1:]  # first step includes one-off allocations
+        images[0].save(os.path.join(args.out, f"{args.mode}_seed{seed}.png"))
+
+    res = {"mode": args.mode, "model": model_info(), "load_seconds": load_s,
+           "seconds_per_step": float(np.mean(step_times)), "peak_rss_mb": _peak_rss_mb()}
+    with open(os.path.join(args.out, f"{args.mode}.json"), "w", encoding="utf-8") as f:
+        json.dump(res, f, indent=2)
+
+
+def _drift(a_path: str, b_path: str) -> dict:
+    a = np.asarray(Image.open(a_path).convert("RGB"), dtype=np.float32)
+    b = np.asarray(Image.open(b_path).convert("RGB"), dtype=np.float32)
+    mse = float(np.mean((a - b) ** 2))
+    return {"mean_abs_diff": float(np.mean(np.abs(a - b))),
+            "psnr_db": float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--steps", type=int, default=10)
+    ap.add_argument("--size", type=int, default=512)
+    ap.add_argument("--seeds", type=int, nargs="+", default=[1, 2, 3])
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--json", help="also write the summary here")
+    ap.add_argument("--worker", dest="mode", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.mode:
+        return worker(args)
+
+    args.out = args.out or tempfile.mkdtemp(prefix="bench_quant_")
+    os.makedirs(args.out, exist_ok=True)
+    results = {}
+    for mode in ("none", "int8"):
+        env = dict(os.environ, AIG_QUANTIZE=mode, CUDA_VISIBLE_DEVICES="")  # the int8 kernels are CPU-only
+        cmd = [sys.executable, "-m", "benchmarks.bench_quant", "--worker", mode, "--out", args.out,
+               "--steps", str(args.steps), "--size", str(args.size), "--seeds", *map(str, args.seeds)]
+        subprocess.run(cmd, env=env, check=True)
+        with open(os.path.join(args.out, f"{mode}.json"), encoding="utf-8") as f:
+            results[mode] = json.load(f)
+
+    drift = [_drift(os.path.join(args.out, f"none_seed{s}.png"), os.path.join(args.out, f"int8_seed{s}.png"))
+             for s in args.seeds]
+    summary = {
+        "float32": results["none"],
+        "int8": results["int8"],
+        "speedup": results["none"]["seconds_per_step"] / results["int8"]["seconds_per_step"],
+        "rss_ratio": results["int8"]["peak_rss_mb"] / results["none"]["peak_rss_mb"],
+        "drift": {"mean_abs_diff": float(np.mean([d["mean_abs_diff"] for d in drift])),
+                  "psnr_db": float(np.mean([d["psnr_db"] for d in drift]))},
+        "images": args.out,
+    }
+    for mode, r in (("float32", results["none"]), ("int8", results["int8"])):
+        print(f"{mode:<8} {r['seconds_per_step']:.3f} s/step   peak RSS {r['peak_rss_mb']:.0f} MB")
+    print(f"speedup x{summary['speedup']:.2f}   RSS x{summary['rss_ratio']:.2f}   "
+          f"drift: {summary['drift']['mean_abs_diff']:.2f} mean |Δ| (0-255), {summary['drift']['psnr_db']:.1f} dB PSNR")
+    print(f"images: {args.out}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
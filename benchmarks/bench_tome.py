@@ -0,0 +1,100 @@
+"""
+Token merging: seconds per UNet step vs. similarity to the unmerged image, on
+fixed seeds, for a range of merge ratios.
+
+    python -m benchmarks.bench_tome --ratios 0 0.2 0.3 0.4 0.5 0.6 --steps 20 --size 1024
+
+Similarity is SSIM (8x8 windows on luma) and PSNR against ratio 0 with the same
+seed. The suggested ratio is the largest one whose worst-seed SSIM stays above
+--min-ssim; set AIG_TOME_FAST_RATIO to it for the "Fast" preset.
+"""
+import argparse, json, os, tempfile
+
+import numpy as np
+
+from src import metrics
+from src.pipeline_sdxl import txt2img
+from src.token_merge import token_merging
+
+PROMPTS = [
+    "a lighthouse on a cliff at dusk, volumetric fog, highly detailed",
+    "portrait of an old fisherman, natural light, 85mm",
+    "an art deco train station interior, warm light",
+]
+NEGATIVE = "blurry, lowres"
+
+
+def _luma(img) -> np.ndarray:
+    return np.asarray(img.convert("L"), dtype=np.float64)
+
+
+def ssim(a: np.ndarray, b: np.ndarray, win: int = 8) -> float:
+    h, w = (a.shape[0] // win) * win, (a.shape[1] // win) * win
+    a = a[:h, :w].reshape(h // win, win, w // win, win)
+    b = b[:h, :w].reshape(h // win, win, w // win, win)
+    mu_a, mu_b = a.mean(axis=(1, 3)), b.mean(axis=(1, 3))
+    va, vb = a.var(axis=(1, 3)), b.var(axis=(1, 3))
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    s = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (va + vb + c2))
+    return float(s.mean())
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = float(np.mean((a - b) ** 2))
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--ratios", type=float, nargs="+", default=[0.0, 0.2, 0.3, 0.4, 0.5, 0.6])
+    ap.add_argument("--steps", type=int, default=20)
+    ap.add_argument("--size", type=int, default=1024)
+    ap.add_argument("--seeds", type=int, nargs="+", default=[1, 2, 3])
+    ap.add_argument("--min-ssim", type=float, default=0.80)
+    ap.add_argument("--out", default=None, help="keep the images here (default: a temp dir)")
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    metrics.ENABLED = True
+    args.out = args.out or tempfile.mkdtemp(prefix="bench_tome_")
+    os.makedirs(args.out, exist_ok=True)
+    ratios = sorted(set([0.0] + args.ratios))
+    txt2img(PROMPTS[0], NEGATIVE, 512, 512, 2, 6.5, 0, 1)  # warm-up: kernels, allocator
+
+    reference, rows = {}, []
+    for r in ratios:
+        step_times, sims, psnrs = [], [], []
+        for i, seed in enumerate(args.seeds):
+            with token_merging(r), metrics.run_timings() as rt:
+                img = txt2img(PROMPTS[i % len(PROMPTS)], NEGATIVE, args.size, args.size, args.steps, 6.5, seed, 1)[0]
+            step_times += rt.unet_steps[1:]
+            img.save(os.path.join(args.out, f"tome{r:.2f}_seed{seed}.png"))
+            y = _luma(img)
+            if r == 0.0:
+                reference[seed] = y
+            sims.append(ssim(reference[seed], y))
+            psnrs.append(psnr(reference[seed], y))
+        rows.append({"ratio": r, "seconds_per_step": float(np.mean(step_times)),
+                     "ssim_mean": float(np.mean(sims)), "ssim_min": float(np.min(sims)),
+                     "psnr_db": float(np.mean(psnrs))})
+
+    base = rows[0]["seconds_per_step"]
+    safe = 0.0
+    print(f"{'ratio':>6} {'s/step':>8} {'speedup':>8} {'SSIM':>6} {'min':>6} {'PSNR':>7}")
+    for row in rows:
+        row["speedup"] = base / row["seconds_per_step"]
+        if row["ssim_min"] >= args.min_ssim:
+            safe = max(safe, row["ratio"])
+        print(f"{row['ratio']:>6.2f} {row['seconds_per_step']:>8.3f} {row['speedup']:>7.2f}x "
+              f"{row['ssim_mean']:>6.3f} {row['ssim_min']:>6.3f} {row['psnr_db']:>6.1f}dB")
+    print(f"suggested AIG_TOME_FAST_RATIO={safe:.2f} (worst-seed SSIM >= {args.min_ssim})")
+    print(f"images: {args.out}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"size": args.size, "steps": args.steps, "seeds": args.seeds, "rows": rows,
+                       "suggested_ratio": safe, "images": args.out}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
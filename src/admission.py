@@ -0,0 +1,262 @@
+import os, time, threading, itertools
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from . import metrics
+from .config import (
+    OUTPUT_DIR, MAX_CONCURRENT_JOBS, ADMISSION_SHARED, PREEMPTION, PRIORITY_BATCH_COST, LATENCY_WINDOW,
+)
+from .locks import try_lock, unlock
+
+LOCK_DIR = os.path.join(OUTPUT_DIR, ".locks")
+
+# scheduling classes, most urgent first; a job may be suspended for any class before its own
+PRIORITIES = ("interactive", "batch")
+
+
+def classify(steps: int, num_images: int = 1, width: int = 1024, height: int = 1024) -> str:
+    """
+    Default class for a run from its cost in megapixel-steps (a 20-step 1024² preview is 20).
+    """
+    cost = int(steps) * max(1, int(num_images)) * (int(width) * int(height)) / float(1024 * 1024)
+    return "batch" if cost > PRIORITY_BATCH_COST else "interactive"
+
+
+class Ticket:
+    __slots__ = ("id", "priority", "rank", "enqueued_at", "admitted_at", "first_admitted_at", "run_seconds",
+                 "suspended_seconds", "preemptions", "slot")
+
+    def __init__(self, tid: int, priority: str = "interactive"):
+        self.id = tid
+        self.priority = priority if priority in PRIORITIES else PRIORITIES[0]
+        self.rank = PRIORITIES.index(self.priority)
+        self.enqueued_at = time.time()
+        self.admitted_at: Optional[float] = None
+        self.first_admitted_at: Optional[float] = None
+        self.run_seconds = 0.0        # time holding a slot, over all admissions
+        self.suspended_seconds = 0.0  # time given up to more urgent jobs
+        self.preemptions = 0
+        self.slot = None  # held cross-process slot lock file
+
+
+class AdmissionController:
+    """
+    Process-wide gate in front of the diffusion device.
+
+    At most `limit` jobs run at once; the rest wait by priority class, FIFO
+    within a class. A running job of a less urgent class can give its slot up
+    at a step boundary (see preemption.py) and is re-queued ahead of the jobs
+    of its class that arrived after it. With shared=True the limit is also
+    enforced across processes on the node via one lock file per slot (ordering
+    and preemption then hold per process, not globally).
+    """
+
+    def __init__(self, limit: int = 1, shared: bool = False, lock_dir: str = LOCK_DIR,
+                 preemption: bool = True, latency_window: int = 1000):
+        self.limit = max(1, int(limit))
+        self.shared = shared
+        self.lock_dir = lock_dir
+        self.preemption = preemption
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._active: List[Ticket] = []
+        self._ids = itertools.count(1)
+        self._avg_seconds = 30.0  # EWMA of job duration, seeds the first estimate
+        # recent (latency, wait) per class, for percentiles
+        self._latency: Dict[str, deque] = {p: deque(maxlen=max(1, latency_window)) for p in PRIORITIES}
+
+    # ----------------- queue state -----------------
+    def position(self, ticket: Ticket) -> int:
+        """
+        0 = next to be admitted.
+        """
+        with self._cond:
+            try:
+                return self._queue.index(ticket)
+            except ValueError:
+                return 0
+
+    def estimated_wait(self, ticket: Ticket) -> float:
+        with self._cond:
+            pos = self._queue.index(ticket) if ticket in self._queue else 0
+            now = time.time()
+            remaining = sorted(max(0.0, self._avg_seconds - (now - t.admitted_at)) for t in self._active)
+        if len(remaining) < self.limit:
+            remaining += [0.0] * (self.limit - len(remaining))
+        # each slot frees after its current job, then serves every `limit`-th queued job
+        return remaining[pos % self.limit] + (pos // self.limit) * self._avg_seconds
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def latency_stats(self) -> Dict[str, Dict]:
+        """
+        Per class: completed jobs in the window and p50/p90/p99 of end-to-end latency
+        (enqueue to release) and of the initial queue wait, in seconds.
+        """
+        with self._cond:
+            samples = {p: list(d) for p, d in self._latency.items()}
+        out = {}
+        for p, rows in samples.items():
+            lat = sorted(r[0] for r in rows)
+            wait = sorted(r[1] for r in rows)
+            out[p] = {"count": len(rows), **{f"p{q}": _percentile(lat, q) for q in (50, 90, 99)},
+                      **{f"wait_p{q}": _percentile(wait, q) for q in (50, 90, 99)}}
+        return out
+
+    # ----------------- acquire / release -----------------
+    def _try_slot(self):
+        for i in range(self.limit):
+            f = try_lock(os.path.join(self.lock_dir, f"slot_{i}.lock"))
+            if f is not None:
+                return f
+        return None
+
+    def _try_admit(self, ticket: Ticket) -> bool:
+        # caller holds self._cond
+        if not self._queue or self._queue[0] is not ticket or len(self._active) >= self.limit:
+            return False
+        if self.shared:
+            ticket.slot = self._try_slot()
+            if ticket.slot is None:
+                return False
+        self._queue.popleft()
+        ticket.admitted_at = time.time()
+        if ticket.first_admitted_at is None:
+            ticket.first_admitted_at = ticket.admitted_at
+        self._active.append(ticket)
+        metrics.set_gauge("aig_admission_queue_depth", len(self._queue))
+        metrics.set_gauge("aig_admission_active", len(self._active))
+        self._cond.notify_all()
+        return True
+
+    def _insert(self, ticket: Ticket):
+        # caller holds self._cond; ordered by (class, arrival), so a resumed job goes back ahead of later ones
+        i = len(self._queue)
+        while i > 0 and (self._queue[i - 1].rank, self._queue[i - 1].id) > (ticket.rank, ticket.id):
+            i -= 1
+        self._queue.insert(i, ticket)
+        metrics.set_gauge("aig_admission_queue_depth", len(self._queue))
+        self._cond.notify_all()
+
+    def enqueue(self, priority: str = "interactive") -> Ticket:
+        with self._cond:
+            t = Ticket(next(self._ids), priority)
+            self._insert(t)
+            return t
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._try_admit(ticket):
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    return False
+                wait_for = left
+                if self.shared:
+                    # cross-process slots free up without notifying us, so poll them
+                    wait_for = 0.25 if left is None else min(0.25, left)
+                self._cond.wait(wait_for)
+            return True
+
+    def _vacate(self, ticket: Ticket):
+        # caller holds self._cond
+        self._active.remove(ticket)
+        ticket.run_seconds += time.time() - ticket.admitted_at
+        if ticket.slot is not None:
+            unlock(ticket.slot)
+            ticket.slot = None
+
+    def release(self, ticket: Ticket):
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+            if ticket in self._active:
+                self._vacate(ticket)
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * ticket.run_seconds
+                latency = time.time() - ticket.enqueued_at
+                wait = ticket.first_admitted_at - ticket.enqueued_at
+                self._latency[ticket.priority].append((latency, wait))
+                metrics.observe("aig_job_latency_seconds", latency, priority=ticket.priority)
+                metrics.observe("aig_job_wait_seconds", wait, priority=ticket.priority)
+            if ticket.slot is not None:
+                unlock(ticket.slot)
+                ticket.slot = None
+            metrics.set_gauge("aig_admission_queue_depth", len(self._queue))
+            metrics.set_gauge("aig_admission_active", len(self._active))
+            self._cond.notify_all()
+
+    # ----------------- preemption -----------------
+    def preemptible(self, ticket: Ticket) -> bool:
+        """
+        True if some class is more urgent than this ticket's (so it may be asked to yield).
+        """
+        return self.preemption and ticket.rank > 0
+
+    def should_yield(self, ticket: Ticket) -> bool:
+        """
+        True if a more urgent job is waiting and no slot is free for it. Called at every
+        step boundary of a preemptible job, so it only peeks at the queue head.
+        """
+        if not self.preemption or not self._queue:
+            return False
+        with self._cond:
+            return (bool(self._queue) and self._queue[0].rank < ticket.rank
+                    and len(self._active) >= self.limit and ticket in self._active)
+
+    def suspend(self, ticket: Ticket) -> float:
+        """
+        Give the slot to the waiting job(s) and block until this one is admitted again.
+        The caller has checkpointed its state. Returns the seconds spent suspended.
+        """
+        t0 = time.time()
+        with self._cond:
+            self._vacate(ticket)
+            ticket.preemptions += 1
+            self._insert(ticket)
+            metrics.set_gauge("aig_admission_active", len(self._active))
+        metrics.inc("aig_preemptions_total", priority=ticket.priority)
+        self.wait(ticket)
+        dt = time.time() - t0
+        ticket.suspended_seconds += dt
+        metrics.observe("aig_preempted_seconds", dt, priority=ticket.priority)
+        return dt
+
+    @contextmanager
+    def admit(self, on_wait: Optional[Callable[[int, float], None]] = None, poll: float = 1.0,
+              priority: str = "interactive"):
+        """
+        Block until this job may use the device. on_wait(position, eta_seconds)
+        is called about every `poll` seconds while queued (e.g. to update the UI).
+        """
+        ticket = self.enqueue(priority)
+        try:
+            with metrics.span("admission_wait"):
+                while not self.wait(ticket, timeout=poll):
+                    if on_wait is not None:
+                        on_wait(self.position(ticket), self.estimated_wait(ticket))
+            yield ticket
+        finally:
+            self.release(ticket)
+
+
+_CONTROLLER: Optional[AdmissionController] = None
+_CONTROLLER_LOCK = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    global _CONTROLLER
+    with _CONTROLLER_LOCK:
+        if _CONTROLLER is None:
+            _CONTROLLER = AdmissionController(MAX_CONCURRENT_JOBS, shared=ADMISSION_SHARED,
+                                              preemption=PREEMPTION, latency_window=LATENCY_WINDOW)
+        return _CONTROLLER
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[i]
@@ -1,6 +1,10 @@
+import json, re
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 from .presets import STYLE_PRESETS
+from .metrics import span
+from .llm import get_client, LLMError
+from .config import LLM_TIMEOUT_PLANNER, LLM_TIMEOUT_CRITIC, LLM_TIMEOUT_REFINER
 
 @dataclass
 class AgentStep:
@@ -45,32 +49,122 @@ def critic(prompt: str, negative_prompt: str) -> Dict:
         "recommendations": tips
     }
 
-def refiner(prompt: str, negative_prompt: str, critique: Dict) -> Dict:
+# what the rule refiner appends for the critic's recommendations; prompt variants try the alternatives
+CRITIC_ADDITIONS = (
+    ("cinematic lighting", "volumetric light", "rule of thirds", "sharp focus", "highly detailed"),
+    ("soft rim light", "centered composition", "sharp focus", "texture-rich"),
+    ("golden hour lighting", "wide angle", "highly detailed", "depth of field"),
+)
+
+def refiner(prompt: str, negative_prompt: str, critique: Dict, additions=CRITIC_ADDITIONS[0]) -> Dict:
     refined_prompt = prompt
     if critique["recommendations"]:
-        refined_prompt += ", " + ", ".join([
-            "cinematic lighting",
-            "volumetric light",
-            "rule of thirds",
-            "sharp focus",
-            "highly detailed"
-        ])
+        refined_prompt += ", " + ", ".join(additions)
     refined_negative = negative_prompt + ", deformed, bad anatomy, blurry, oversaturated"
     return {"final_prompt": refined_prompt, "final_negative_prompt": refined_negative}
 
-def run_agent_loop(goal: str) -> Dict:
+# ----------------- LLM stages -----------------
+# Same inputs/outputs as the rule functions above. Each one is bounded by its
+# stage timeout; on timeout, HTTP error or an unusable answer the rule runs instead.
+
+_SYSTEM = {
+    "planner": (
+        "You plan images for Stable Diffusion XL. Reply with JSON only: "
+        '{"goal": "<the goal as one vivid sentence>", "style": "<one of: %s>"}'
+    ) % ", ".join(STYLE_PRESETS),
+    "critic": (
+        "You review Stable Diffusion XL prompts. Reply with JSON only: "
+        '{"critique": "<one short paragraph>", "recommendations": ["<short fix>", ...]}'
+    ),
+    "refiner": (
+        "You rewrite Stable Diffusion XL prompts using a critique. Keep the subject and style. "
+        'Reply with JSON only: {"final_prompt": "...", "final_negative_prompt": "..."}'
+    ),
+}
+
+_STAGE_TIMEOUTS = {"planner": LLM_TIMEOUT_PLANNER, "critic": LLM_TIMEOUT_CRITIC, "refiner": LLM_TIMEOUT_REFINER}
+
+
+def _parse_json(text: str) -> Optional[Dict]:
+    m = re.search(r"\{.*\}", text or "", re.S)  # tolerate ```json fences / chatter around the object
+    try:
+        return json.loads(m.group(0)) if m else None
+    except ValueError:
+        return None
+
+
+def _llm_stage(stage: str, user: str, validate: Callable[[Dict], Optional[Dict]]) -> Optional[Dict]:
+    client = get_client()
+    if client is None:
+        return None
+    messages = [{"role": "system", "content": _SYSTEM[stage]}, {"role": "user", "content": user}]
+    try:
+        out = _parse_json(client.complete(messages, timeout=_STAGE_TIMEOUTS[stage], stage=stage))
+    except (TimeoutError, LLMError):
+        return None
+    return validate(out) if isinstance(out, dict) else None
+
+
+def llm_planner(goal: str) -> Optional[Dict]:
+    def _ok(out):
+        styles = {s.lower(): s for s in STYLE_PRESETS}
+        style = styles.get(str(out.get("style", "")).strip().lower())
+        g = str(out.get("goal", "")).strip()
+        return {"goal": g, "style": style} if g and style else None
+    return _llm_stage("planner", goal, _ok)
+
+
+def llm_critic(prompt: str, negative_prompt: str) -> Optional[Dict]:
+    def _ok(out):
+        recs = out.get("recommendations")
+        if not isinstance(out.get("critique"), str) or not isinstance(recs, list):
+            return None
+        return {"critique": out["critique"], "recommendations": [str(r) for r in recs]}
+    return _llm_stage("critic", f"Prompt: {prompt}\nNegative prompt: {negative_prompt}", _ok)
+
+
+def llm_refiner(prompt: str, negative_prompt: str, critique: Dict) -> Optional[Dict]:
+    def _ok(out):
+        fp, fn = out.get("final_prompt"), out.get("final_negative_prompt")
+        if not (isinstance(fp, str) and fp.strip() and isinstance(fn, str)):
+            return None
+        return {"final_prompt": fp.strip(), "final_negative_prompt": fn.strip()}
+    user = (f"Prompt: {prompt}\nNegative prompt: {negative_prompt}\n"
+            f"Critique: {critique['critique']}\nRecommendations: {'; '.join(critique['recommendations'])}")
+    return _llm_stage("refiner", user, _ok)
+
+
+def _run_stage(llm_fn, rule_fn, *args):
+    out = llm_fn(*args)
+    if out is not None:
+        return out, "llm"
+    return rule_fn(*args), "rules"
+
+
+def run_agent_loop(goal: str, style: str = None) -> Dict:
     steps: List[AgentStep] = []
+    sources = {}
 
-    plan = planner(goal)
+    with span("agent.planner"):
+        if (goal or "").strip():
+            plan, sources["planner"] = _run_stage(llm_planner, planner, goal)
+        else:
+            plan, sources["planner"] = planner(goal), "rules"  # default goal, nothing to ask
+        if style in STYLE_PRESETS:
+            plan["style"] = style  # caller-forced style (e.g. a sweep axis)
     steps.append(AgentStep("Planner", plan))
 
-    engineered = prompt_engineer(plan)
+    with span("agent.prompt_engineer"):
+        engineered = prompt_engineer(plan)
     steps.append(AgentStep("Prompt Engineer", engineered))
 
-    crit = critic(engineered["prompt"], engineered["negative_prompt"])
+    with span("agent.critic"):
+        crit, sources["critic"] = _run_stage(llm_critic, critic, engineered["prompt"], engineered["negative_prompt"])
     steps.append(AgentStep("Critic", crit))
 
-    final = refiner(engineered["prompt"], engineered["negative_prompt"], crit)
+    with span("agent.refiner"):
+        final, sources["refiner"] = _run_stage(llm_refiner, refiner, engineered["prompt"],
+                                               engineered["negative_prompt"], crit)
     steps.append(AgentStep("Refiner", final))
 
     return {
@@ -81,5 +175,36 @@ def run_agent_loop(goal: str) -> Dict:
         "critique": crit,
         "final_prompt": final["final_prompt"],
         "final_negative_prompt": final["final_negative_prompt"],
-        "steps": [{"name": s.name, "output": s.output} for s in steps]
+        "steps": [{"name": s.name, "output": s.output} for s in steps],
+        "sources": sources,
     }
+
+
+def agent_variants(goal: str, k: int, base: Optional[Dict] = None) -> List[Dict]:
+    """
+    K prompt variants for best-of selection. Variant 0 is the regular agent result
+    (`base` if given, so the LLM is not asked again); the others combine the other
+    style presets with the alternative critic additions, using the rule stages.
+    """
+    base = base or run_agent_loop(goal)
+    variants = [dict(base, variant={"style": base["style"], "additions": "agent"})]
+    styles = [base["style"]] + [s for s in STYLE_PRESETS if s != base["style"]]
+    combos = [(st, ai) for ai in range(len(CRITIC_ADDITIONS)) for st in styles][1:]  # (base style, default) is base
+    for style, ai in combos[:max(0, k - 1)]:
+        engineered = prompt_engineer({"goal": base["goal"], "style": style})
+        crit = critic(engineered["prompt"], engineered["negative_prompt"])
+        final = refiner(engineered["prompt"], engineered["negative_prompt"], crit, CRITIC_ADDITIONS[ai])
+        variants.append({
+            "goal": base["goal"],
+            "style": style,
+            "prompt": engineered["prompt"],
+            "negative_prompt": engineered["negative_prompt"],
+            "critique": crit,
+            **final,
+            "steps": [{"name": "Prompt Engineer", "output": engineered}, {"name": "Critic", "output": crit},
+                      {"name": "Refiner", "output": final}],
+            "sources": {"planner": base.get("sources", {}).get("planner", "rules"), "critic": "rules",
+                        "refiner": "rules"},
+            "variant": {"style": style, "additions": ", ".join(CRITIC_ADDITIONS[ai])},
+        })
+    return variants
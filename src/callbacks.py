@@ -0,0 +1,41 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable
+
+# Step-end callbacks registered for the pipeline calls made in the current context.
+# Each entry: (fn(pipe, step_index, timestep, callback_kwargs) -> callback_kwargs, tensor_inputs)
+_ACTIVE: contextvars.ContextVar = contextvars.ContextVar("step_callbacks", default=())
+
+
+@contextmanager
+def on_step_end(fn: Callable, tensor_inputs: Iterable[str] = ()):
+    """
+    Run fn at the end of every denoising step of pipelines called inside this block.
+    fn may modify and must return callback_kwargs (diffusers callback_on_step_end contract).
+    """
+    token = _ACTIVE.set(_ACTIVE.get() + ((fn, tuple(tensor_inputs)),))
+    try:
+        yield
+    finally:
+        _ACTIVE.reset(token)
+
+
+def step_kwargs(pipe) -> Dict:
+    """
+    kwargs to splat into a diffusers pipeline call so the registered callbacks run.
+    """
+    cbs = _ACTIVE.get()
+    if not cbs:
+        return {}
+
+    allowed = set(getattr(pipe, "_callback_tensor_inputs", ()))
+    inputs = sorted({t for _, ts in cbs for t in ts if t in allowed})
+
+    def _chain(p, step_index, timestep, callback_kwargs):
+        for fn, _ in cbs:
+            out = fn(p, step_index, timestep, callback_kwargs)
+            if out is not None:
+                callback_kwargs = out
+        return callback_kwargs
+
+    return {"callback_on_step_end": _chain, "callback_on_step_end_tensor_inputs": inputs}
@@ -0,0 +1,174 @@
+import os
+
+# Per-deployment settings. Everything is read from environment variables so a
+# node can be tuned without touching code (e.g. AIG_METRICS=0 streamlit run app.py).
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
+
+
+def env_str(name: str, default: str = "") -> str:
+    return os.environ.get(name, default).strip()
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    v = os.environ.get(name)
+    if v is None or not v.strip():
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_bytes(name: str, default: int = 0) -> int:
+    """
+    Byte sizes with an optional K/M/G/T suffix, e.g. AIG_RETENTION_MAX_BYTES=50G.
+    """
+    v = os.environ.get(name, "").strip().upper().rstrip("B")
+    if not v:
+        return default
+    mult = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}.get(v[-1], 1)
+    try:
+        return int(float(v[:-1] if mult > 1 else v) * mult)
+    except ValueError:
+        return default
+
+
+# ----------------- MODELS -----------------
+MODEL_ID = env_str("AIG_MODEL_ID", "stabilityai/stable-diffusion-xl-base-1.0")
+MODEL_DIR = env_str("AIG_MODEL_DIR")              # local snapshot of MODEL_ID (no network lookups)
+MODEL_CACHE_DIR = env_str("AIG_MODEL_CACHE_DIR")  # pre-converted, dtype-matched single-file cache
+CONTROLNET_DIR = env_str("AIG_CONTROLNET_DIR")    # local ControlNet snapshots, one dir per repo name
+LOAD_WORKERS = env_int("AIG_LOAD_WORKERS", 4)
+QUANTIZE = env_str("AIG_QUANTIZE", "none").lower()  # "int8": dynamic int8 Linear layers (CPU nodes)
+
+# model memory budget (0 = unlimited), on top of the pinned SDXL base. Over the device budget,
+# least recently used models are demoted to host RAM; over the CPU budget, they are dropped and reloaded on next use.
+MODEL_DEVICE_BUDGET = env_bytes("AIG_MODEL_DEVICE_BUDGET", 0)
+MODEL_CPU_BUDGET = env_bytes("AIG_MODEL_CPU_BUDGET", 0)
+
+
+# ----------------- METRICS -----------------
+METRICS_ENABLED = env_bool("AIG_METRICS", True)
+METRICS_FILE = env_str("AIG_METRICS_FILE", os.path.join(OUTPUT_DIR, "metrics.prom"))
+METRICS_PORT = env_int("AIG_METRICS_PORT", 0)  # 0 = no HTTP endpoint, file only
+
+
+# ----------------- RETENTION -----------------
+RETENTION_MAX_BYTES = env_bytes("AIG_RETENTION_MAX_BYTES", 0)     # 0 = no size cap
+RETENTION_MAX_AGE_DAYS = env_float("AIG_RETENTION_MAX_AGE_DAYS", 0)  # 0 = keep forever
+RETENTION_KEEP_LAST = env_int("AIG_RETENTION_KEEP_LAST", 20)
+RETENTION_KEEP_STARRED = env_bool("AIG_RETENTION_KEEP_STARRED", True)
+RETENTION_INTERVAL = env_float("AIG_RETENTION_INTERVAL", 300.0)   # seconds between background passes
+RETENTION_BATCH = env_int("AIG_RETENTION_BATCH", 25)              # max runs removed per pass
+
+
+# ----------------- ADMISSION -----------------
+MAX_CONCURRENT_JOBS = env_int("AIG_MAX_CONCURRENT_JOBS", 1)  # diffusion jobs allowed on the device at once
+ADMISSION_SHARED = env_bool("AIG_ADMISSION_SHARED", False)   # enforce the limit across processes (file locks)
+# batch-class jobs give the device up at step boundaries while an interactive job waits
+PREEMPTION = env_bool("AIG_PREEMPTION", True)
+PRIORITY_BATCH_COST = env_float("AIG_PRIORITY_BATCH_COST", 100.0)  # megapixel-steps above which a run is "batch"
+LATENCY_WINDOW = env_int("AIG_LATENCY_WINDOW", 1000)              # completed jobs per class kept for percentiles
+
+
+# ----------------- IMAGE CACHE -----------------
+IMAGE_CACHE_BYTES = env_bytes("AIG_IMAGE_CACHE_BYTES", 256 << 20)  # decoded output images, shared by all sessions
+LATENT_CACHE_BYTES = env_bytes("AIG_LATENT_CACHE_BYTES", 64 << 20)  # VAE-encoded img2img/inpaint references
+THUMB_CACHE_BYTES = env_bytes("AIG_THUMB_CACHE_BYTES", 32 << 20)    # encoded gallery thumbnails
+UPLOAD_CACHE_BYTES = env_bytes("AIG_UPLOAD_CACHE_BYTES", 256 << 20)  # decoded uploads (references, bases, masks)
+UPLOAD_MAX_SIDE = env_int("AIG_UPLOAD_MAX_SIDE", 2048)              # uploads are downscaled to this (0 = keep)
+UPLOAD_PREVIEW_SIDE = env_int("AIG_UPLOAD_PREVIEW_SIDE", 512)       # what the browser is sent for display
+CONTROL_CACHE_BYTES = env_bytes("AIG_CONTROL_CACHE_BYTES", 64 << 20)  # preprocessed ControlNet inputs per upload
+
+
+# ----------------- SIMILARITY -----------------
+# perceptual hash of every saved image in outputs/similarity.bin ("similar runs", near-duplicate reports)
+SIMILARITY_INDEX = env_bool("AIG_SIMILARITY_INDEX", True)
+SIMILARITY_DUP_DISTANCE = env_int("AIG_SIMILARITY_DUP_DISTANCE", 4)  # max differing bits of 64 for a near-duplicate
+
+
+# ----------------- SWEEP -----------------
+SWEEP_MAX_CELLS = env_int("AIG_SWEEP_MAX_CELLS", 16)
+SWEEP_MAX_BATCH = env_int("AIG_SWEEP_MAX_BATCH", 4)  # cells denoised together in one pipeline call
+
+
+# ----------------- FAN-OUT -----------------
+# best-of-K prompt variants: cheap previews of every variant, full render of the best-scored one
+FANOUT_K = env_int("AIG_FANOUT_K", 4)
+FANOUT_PREVIEW_STEPS = env_int("AIG_FANOUT_PREVIEW_STEPS", 8)
+FANOUT_PREVIEW_SIDE = env_int("AIG_FANOUT_PREVIEW_SIDE", 512)      # long side of the previews
+FANOUT_SCORER = env_str("AIG_FANOUT_SCORER", "heuristic")          # heuristic | clip | any registered scorer
+FANOUT_CLIP_MODEL = env_str("AIG_FANOUT_CLIP_MODEL", "openai/clip-vit-base-patch32")
+
+
+# ----------------- INPAINT -----------------
+INPAINT_MAX_BATCH = env_int("AIG_INPAINT_MAX_BATCH", 8)  # (mask, variant) images denoised in one pipeline call
+
+
+# ----------------- OUTPUT FORMAT -----------------
+OUTPUT_CODEC = env_str("AIG_OUTPUT_CODEC", "png")         # png | webp_lossless | webp | jpeg
+OUTPUT_QUALITY = env_int("AIG_OUTPUT_QUALITY", 95)        # lossy webp / jpeg
+OUTPUT_EFFORT = env_int("AIG_OUTPUT_EFFORT", 4)           # webp method 0..6; jpeg optimize if > 0
+PNG_COMPRESS_LEVEL = env_int("AIG_PNG_COMPRESS_LEVEL", 6)  # 0 (fast) .. 9 (small)
+EMBED_METADATA = env_bool("AIG_EMBED_METADATA", True)     # prompt/settings inside each file (PNG text / XMP+EXIF)
+
+
+# ----------------- STORAGE -----------------
+# outputs/ is always written first; "s3" mirrors runs to an S3-compatible store in the
+# background and reads other nodes' runs through on demand. Credentials: the usual
+# AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY / AWS_PROFILE.
+STORAGE_BACKEND = env_str("AIG_STORAGE_BACKEND", "local")  # local | s3
+S3_BUCKET = env_str("AIG_S3_BUCKET")
+S3_PREFIX = env_str("AIG_S3_PREFIX", "")
+S3_ENDPOINT = env_str("AIG_S3_ENDPOINT")                    # MinIO / Ceph / moto, e.g. http://127.0.0.1:9000
+S3_REGION = env_str("AIG_S3_REGION")
+STORAGE_UPLOAD_CONCURRENCY = env_int("AIG_STORAGE_UPLOAD_CONCURRENCY", 8)  # parallel files / multipart parts
+STORAGE_PART_SIZE = env_bytes("AIG_STORAGE_PART_SIZE", 8 << 20)            # multipart threshold and part size
+STORAGE_SYNC_INTERVAL = env_float("AIG_STORAGE_SYNC_INTERVAL", 30.0)       # seconds between index pulls (0 = off)
+STORAGE_SYNC_LAG = env_float("AIG_STORAGE_SYNC_LAG", 600.0)                # re-list this far behind the newest row seen
+
+
+# ----------------- AGENT LLM -----------------
+# Planner / critic / refiner through an OpenAI-compatible /v1/chat/completions endpoint.
+# Unset URL = the built-in keyword rules only.
+LLM_URL = env_str("AIG_LLM_URL")                      # e.g. http://127.0.0.1:8000/v1
+LLM_MODEL = env_str("AIG_LLM_MODEL", "gpt-4o-mini")
+LLM_API_KEY = env_str("AIG_LLM_API_KEY")
+LLM_TIMEOUT_PLANNER = env_float("AIG_LLM_TIMEOUT_PLANNER", 1.5)  # seconds before falling back to the rules
+LLM_TIMEOUT_CRITIC = env_float("AIG_LLM_TIMEOUT_CRITIC", 1.5)
+LLM_TIMEOUT_REFINER = env_float("AIG_LLM_TIMEOUT_REFINER", 2.0)
+LLM_REQUEST_TIMEOUT = env_float("AIG_LLM_REQUEST_TIMEOUT", 30.0)  # late answers still fill the cache
+LLM_MAX_CONCURRENCY = env_int("AIG_LLM_MAX_CONCURRENCY", 8)
+LLM_BATCH_WINDOW_MS = env_int("AIG_LLM_BATCH_WINDOW_MS", 5)
+LLM_CACHE_FILE = env_str("AIG_LLM_CACHE_FILE", os.path.join(OUTPUT_DIR, "llm_cache.jsonl"))
+
+
+# ----------------- ENGINE -----------------
+# txt2img / img2img through the stage-overlapped engine (prepare | denoise | finish workers)
+ENGINE_ENABLED = env_bool("AIG_ENGINE", False)
+ENGINE_QUEUE_DEPTH = env_int("AIG_ENGINE_QUEUE_DEPTH", 2)  # jobs buffered in front of each stage
+
+
+# ----------------- SPEED -----------------
+# token merging ratio applied by the "Fast" preset (0 = off); see benchmarks/bench_tome.py
+TOME_FAST_RATIO = env_float("AIG_TOME_FAST_RATIO", 0.4)
+# fraction of the steps after which the "Fast" preset drops the unconditional branch (1 = never)
+CFG_FAST_CUTOFF = env_float("AIG_CFG_FAST_CUTOFF", 0.6)
+
+
+# ----------------- UI -----------------
+# parsed meta.json files kept in memory for the gallery / history panels
+META_CACHE_ENTRIES = env_int("AIG_META_CACHE_ENTRIES", 1024)
@@ -0,0 +1,196 @@
+import contextvars, threading, types
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import torch
+
+from .callbacks import on_step_end
+
+# Cross-step UNet feature caching (DeepCache, Ma et al. 2023). The deep part of
+# the UNet (down_blocks[1:], mid_block, up_blocks[:-1]) changes slowly between
+# adjacent steps, so on a full step its output (the input of the last up block)
+# is kept, and on the next interval-1 steps only the shallow path runs:
+#
+#   conv_in -> down_blocks[0] -> up_blocks[-1](cached deep features, skips) -> conv_out
+#
+# Like token merging, the patch is installed once on the shared UNet and only acts
+# for pipeline calls inside `deep_cache(...)`; every pipeline here shares that UNet,
+# so txt2img, img2img, inpaint, ControlNet, sweeps and engine jobs all get it.
+
+
+@dataclass
+class _Run:
+    interval: int
+    start: float
+    end: float
+    step: int = 0                     # denoising step index of the next UNet call
+    total: Optional[int] = None       # steps in the current pipeline call (known after step 0)
+    last_t: Optional[float] = None
+    features: Optional[torch.Tensor] = None
+    capture: bool = False
+    full: int = 0
+    cached: int = 0
+
+
+_RUN: contextvars.ContextVar = contextvars.ContextVar("deep_cache_run", default=None)
+_PATCH_LOCK = threading.Lock()
+
+
+def _timestep_value(timestep) -> float:
+    return float(timestep.flatten()[0]) if torch.is_tensor(timestep) else float(timestep)
+
+
+def _use_cache(run: _Run, sample: torch.Tensor) -> bool:
+    if run.features is None or run.total is None or run.features.shape[0] != sample.shape[0]:
+        return False
+    if not (run.start * run.total <= run.step < run.end * run.total):
+        return False  # warmup / cooldown: always full
+    return (run.step - int(run.start * run.total)) % run.interval != 0
+
+
+def _supported(unet) -> bool:
+    return (getattr(unet, "class_embedding", None) is None and getattr(unet, "encoder_hid_proj", None) is None
+            and len(unet.down_blocks) > 1 and hasattr(unet, "get_time_embed") and hasattr(unet, "get_aug_embed"))
+
+
+def _shallow_forward(unet, sample, timestep, encoder_hidden_states, features, timestep_cond=None,
+                     attention_mask=None, cross_attention_kwargs=None, added_cond_kwargs=None,
+                     down_block_additional_residuals=None, encoder_attention_mask=None, return_dict=True, **_):
+    """
+    The UNet forward with the deep blocks replaced by `features` (mirrors UNet2DConditionModel.forward).
+    """
+    if unet.config.center_input_sample:
+        sample = 2 * sample - 1.0
+    emb = unet.time_embedding(unet.get_time_embed(sample=sample, timestep=timestep), timestep_cond)
+    aug = unet.get_aug_embed(emb=emb, encoder_hidden_states=encoder_hidden_states,
+                             added_cond_kwargs=added_cond_kwargs or {})
+    if aug is not None:
+        emb = emb + aug
+    if unet.time_embed_act is not None:
+        emb = unet.time_embed_act(emb)
+
+    sample = unet.conv_in(sample)
+    down = unet.down_blocks[0]
+    if getattr(down, "has_cross_attention", False):
+        _, res = down(hidden_states=sample, temb=emb, encoder_hidden_states=encoder_hidden_states,
+                      attention_mask=attention_mask, cross_attention_kwargs=cross_attention_kwargs,
+                      encoder_attention_mask=encoder_attention_mask)
+    else:
+        _, res = down(hidden_states=sample, temb=emb)
+
+    up = unet.up_blocks[-1]
+    skips = ((sample,) + tuple(res))[:len(up.resnets)]  # the last up block only reads the first skips
+    if down_block_additional_residuals is not None:     # ControlNet
+        skips = tuple(s + r for s, r in zip(skips, down_block_additional_residuals))
+    if getattr(up, "has_cross_attention", False):
+        sample = up(hidden_states=features, temb=emb, res_hidden_states_tuple=skips,
+                    encoder_hidden_states=encoder_hidden_states, cross_attention_kwargs=cross_attention_kwargs,
+                    attention_mask=attention_mask, encoder_attention_mask=encoder_attention_mask)
+    else:
+        sample = up(hidden_states=features, temb=emb, res_hidden_states_tuple=skips)
+
+    if unet.conv_norm_out is not None:
+        sample = unet.conv_act(unet.conv_norm_out(sample))
+    sample = unet.conv_out(sample)
+    if not return_dict:
+        return (sample,)
+    try:
+        from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+    except ImportError:
+        from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+    return UNet2DConditionOutput(sample=sample)
+
+
+def _patched_forward(self, sample, timestep, encoder_hidden_states=None, *args, **kwargs):
+    original = type(self).forward
+    run: Optional[_Run] = _RUN.get()
+    if run is None or args:
+        return original(self, sample, timestep, encoder_hidden_states, *args, **kwargs)
+
+    t = _timestep_value(timestep)
+    if run.last_t is not None and t > run.last_t:  # timesteps only decrease within one pipeline call
+        run.step, run.total, run.features = 0, None, None
+    run.last_t = t
+
+    if _use_cache(run, sample):
+        run.cached += 1
+        return _shallow_forward(self, sample, timestep, encoder_hidden_states, run.features, **kwargs)
+
+    run.full += 1
+    run.capture = True
+    try:
+        return original(self, sample, timestep, encoder_hidden_states, **kwargs)
+    finally:
+        run.capture = False
+
+
+def _capture_hook(module, args, kwargs):
+    run = _RUN.get()
+    if run is not None and run.capture:
+        run.features = kwargs["hidden_states"] if "hidden_states" in kwargs else args[0]
+
+
+def apply_patch(unet) -> bool:
+    """
+    Install feature caching on `unet`. Idempotent; False if the UNet layout is not supported.
+    """
+    with _PATCH_LOCK:
+        if getattr(unet, "_aig_deep_cache_hook", None) is not None:
+            return True
+        if not _supported(unet):
+            return False
+        unet._aig_deep_cache_hook = unet.up_blocks[-1].register_forward_pre_hook(_capture_hook, with_kwargs=True)
+        unet.forward = types.MethodType(_patched_forward, unet)
+        return True
+
+
+def remove_patch(unet) -> bool:
+    """
+    Undo apply_patch.
+    """
+    with _PATCH_LOCK:
+        hook = getattr(unet, "_aig_deep_cache_hook", None)
+        if hook is None:
+            return False
+        hook.remove()
+        del unet._aig_deep_cache_hook
+        unet.__dict__.pop("forward", None)
+        return True
+
+
+@contextmanager
+def deep_cache(interval: int, start: float = 0.0, end: float = 1.0):
+    """
+    For pipeline calls inside this block, run the full UNet every `interval` steps
+    and the shallow path in between, but only within the [start, end) fraction
+    of the steps; steps outside it (warmup / cooldown) are always full.
+    interval <= 1 = off. Yields a dict that receives the full / cached step counts.
+    """
+    interval = int(interval or 1)
+    stats: Dict = {"interval": interval, "start": float(start), "end": float(end)}
+    if interval <= 1:
+        yield stats
+        return
+
+    from .model_loader import load_components
+    if not apply_patch(load_components()["unet"]):
+        stats["unsupported"] = True
+        yield stats
+        return
+
+    run = _Run(interval, float(start), float(end))
+
+    def _on_step(pipe, i, t, callback_kwargs):
+        run.step = i + 1
+        run.total = getattr(pipe, "num_timesteps", None)
+        return callback_kwargs
+
+    token = _RUN.set(run)
+    try:
+        with on_step_end(_on_step):
+            yield stats
+    finally:
+        _RUN.reset(token)
+        run.features = None
+        stats.update(full_steps=run.full, cached_steps=run.cached)
@@ -0,0 +1,208 @@
+import contextvars, itertools, queue, threading, time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
+
+import torch
+from PIL import Image
+
+from . import metrics
+from .admission import PRIORITIES, get_controller
+from .agent_loop import run_agent_loop
+from .callbacks import step_kwargs
+from .config import ENGINE_QUEUE_DEPTH, PREEMPTION
+from .latent_cache import encode_image, decode_latents
+from .pipeline_sdxl import get_txt2img, get_img2img, _seed_gen
+from .preemption import preemptible
+from .storage import save_run
+from .uploads import Upload, resolve
+
+STAGES = ("prepare", "denoise", "finish")
+
+
+@dataclass
+class EngineJob:
+    """
+    One txt2img / img2img run flowing through the engine.
+    If `prompt` is None the agent loop runs on `goal` in the prepare stage.
+    """
+    run_id: str
+    meta: Dict
+    mode: str = "txt2img"                 # "txt2img" | "img2img"
+    prompt: Optional[str] = None
+    negative: Optional[str] = None
+    goal: Optional[str] = None
+    init_image: Optional[Union[Image.Image, Upload]] = None
+    strength: float = 0.65
+    priority: str = "interactive"         # admission.PRIORITIES
+
+    stage: str = "queued"
+    future: Future = field(default_factory=Future, repr=False)
+    _ctx: Optional[contextvars.Context] = field(default=None, repr=False)
+    _embeds: Optional[tuple] = field(default=None, repr=False)
+    _init_latents: Optional[torch.Tensor] = field(default=None, repr=False)
+    _latents: Optional[torch.Tensor] = field(default=None, repr=False)
+    _t0: float = 0.0
+    _suspended: float = 0.0
+
+
+class StagedEngine:
+    """
+    Jobs flow through three stage workers connected by bounded queues:
+
+      prepare  agent loop (if needed), text encoding, img2img reference encoding
+      denoise  UNet loop only (output_type="latent"), holding the device admission slot
+      finish   VAE decode + save_run
+
+    so job N+1 is prepared and job N-1 decoded/saved while job N denoises.
+    The bounded queues give back-pressure: a slow finish stage stalls denoise
+    instead of piling decoded images up in memory. Each queue serves interactive
+    jobs before batch ones; with preemption a second denoise worker picks up an
+    interactive job while a batch job is suspended between steps.
+    """
+
+    def __init__(self, queue_depth: int = 2):
+        self._queues = {s: queue.PriorityQueue(maxsize=max(1, queue_depth)) for s in STAGES}
+        self._seq = itertools.count()  # FIFO within a priority class
+        self._lock = threading.Lock()
+        self._busy = {s: 0.0 for s in STAGES}
+        self._started = None
+        self._images = 0
+        self._jobs = 0
+        for i, s in enumerate(STAGES):
+            nxt = STAGES[i + 1] if i + 1 < len(STAGES) else None
+            for w in range(2 if s == "denoise" and PREEMPTION else 1):
+                threading.Thread(target=self._worker, args=(s, nxt), daemon=True, name=f"engine-{s}-{w}").start()
+
+    # ----------------- public -----------------
+    def submit(self, job: EngineJob) -> Future:
+        """
+        Queue a job (blocks while the prepare queue is full). The future resolves to the run dir.
+        """
+        job._ctx = contextvars.copy_context()  # run timings / step callbacks of the submitter
+        job._t0 = time.time()
+        with self._lock:
+            if self._started is None:
+                self._started = time.time()
+        self._put("prepare", job)
+        metrics.set_gauge("aig_engine_queue_depth", self._queues["prepare"].qsize(), stage="prepare")
+        return job.future
+
+    def stats(self) -> Dict:
+        """
+        Utilisation per stage (busy time / time since the first job) and sustained throughput.
+        """
+        with self._lock:
+            wall = max(1e-9, time.time() - self._started) if self._started else 0.0
+            return {
+                "utilisation": {s: (b / wall if wall else 0.0) for s, b in self._busy.items()},
+                "queued": {s: q.qsize() for s, q in self._queues.items()},
+                "jobs": self._jobs,
+                "images": self._images,
+                "images_per_minute": 60.0 * self._images / wall if wall else 0.0,
+            }
+
+    # ----------------- workers -----------------
+    def _put(self, stage: str, job: EngineJob):
+        rank = PRIORITIES.index(job.priority) if job.priority in PRIORITIES else 0
+        self._queues[stage].put((rank, next(self._seq), job))
+
+    def _worker(self, stage: str, nxt: Optional[str]):
+        q = self._queues[stage]
+        fn = getattr(self, f"_{stage}")
+        while True:
+            job: EngineJob = q.get()[-1]
+            metrics.set_gauge("aig_engine_queue_depth", q.qsize(), stage=stage)
+            if job.future.cancelled():
+                continue
+            job.stage = stage
+            t0 = time.perf_counter()
+            try:
+                job._ctx.run(self._run_stage, stage, fn, job)
+            except Exception as e:
+                job.stage = "failed"
+                job.future.set_exception(e)
+                continue
+            finally:
+                busy = time.perf_counter() - t0
+                if stage == "denoise":
+                    busy -= job._suspended  # suspended jobs leave the device to the other worker
+                with self._lock:
+                    self._busy[stage] += busy
+                metrics.inc("aig_engine_busy_seconds_total", busy, stage=stage)
+            if nxt is not None:
+                self._put(nxt, job)  # blocks while the next stage is saturated
+                metrics.set_gauge("aig_engine_queue_depth", self._queues[nxt].qsize(), stage=nxt)
+
+    @staticmethod
+    def _run_stage(stage: str, fn, job: EngineJob):
+        with metrics.span(f"engine.{stage}"):
+            fn(job)
+
+    def _prepare(self, job: EngineJob):
+        if job.prompt is None:
+            agent = run_agent_loop(job.goal)
+            job.meta["agent"] = agent
+            job.prompt, job.negative = agent["final_prompt"], agent["final_negative_prompt"]
+        pipe = get_txt2img()  # text encoders are shared by every SDXL pipeline
+        with torch.no_grad():
+            job._embeds = pipe.encode_prompt(
+                prompt=job.prompt,
+                device=pipe._execution_device,
+                num_images_per_prompt=int(job.meta["settings"].get("num_images", 1)),
+                do_classifier_free_guidance=True,
+                negative_prompt=job.negative,
+            )
+        if job.mode == "img2img":
+            img, key = resolve(job.init_image)
+            job._init_latents = encode_image(get_img2img(), img.convert("RGB"), key=key)
+
+    def _denoise(self, job: EngineJob):
+        s = job.meta["settings"]
+        pe, npe, ppe, nppe = job._embeds
+        job._embeds = None
+        common = dict(
+            prompt_embeds=pe, negative_prompt_embeds=npe,
+            pooled_prompt_embeds=ppe, negative_pooled_prompt_embeds=nppe,
+            num_inference_steps=int(s["steps"]), guidance_scale=float(s["guidance"]),
+            generator=_seed_gen(int(s["seed"])), output_type="latent",
+        )
+        with get_controller().admit(priority=job.priority) as ticket, preemptible(ticket) as scheduling:
+            if job.mode == "img2img":
+                pipe = get_img2img()
+                # embeds already carry num_images; the pipeline repeats the reference latents to match
+                out = pipe(image=job._init_latents, strength=float(job.strength), **common, **step_kwargs(pipe))
+            else:
+                pipe = get_txt2img()
+                out = pipe(width=int(s["width"]), height=int(s["height"]), **common, **step_kwargs(pipe))
+        job._init_latents = None
+        job._latents = out.images
+        job._suspended = scheduling["suspended_seconds"]
+        job.meta["scheduling"] = scheduling
+
+    def _finish(self, job: EngineJob):
+        images = decode_latents(get_txt2img(), job._latents)
+        job._latents = None
+        job.meta["runtime_seconds"] = time.time() - job._t0
+        run_dir = save_run(job.run_id, job.meta, images)
+        with self._lock:
+            self._jobs += 1
+            self._images += len(images)
+            wall = max(1e-9, time.time() - self._started)
+            ipm = 60.0 * self._images / wall
+        metrics.inc("aig_engine_images_total", len(images))
+        metrics.set_gauge("aig_engine_images_per_minute", ipm)
+        job.stage = "done"
+        job.future.set_result(run_dir)
+
+
+_ENGINE: Optional[StagedEngine] = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine() -> StagedEngine:
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = StagedEngine(ENGINE_QUEUE_DEPTH)
+        return _ENGINE
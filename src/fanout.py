@@ -0,0 +1,205 @@
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw, ImageFont
+
+from .callbacks import step_kwargs
+from .config import FANOUT_PREVIEW_STEPS, FANOUT_PREVIEW_SIDE, FANOUT_SCORER, FANOUT_CLIP_MODEL, SWEEP_MAX_BATCH
+from .metrics import span
+from .pipeline_sdxl import get_txt2img, txt2img, _seed_gen
+from .sweep import _encode
+
+# Best-of-K prompt variants: every variant is rendered once in a cheap pass (few
+# steps, low resolution, batched, same seed so only the prompt differs), a local
+# scorer ranks the previews, and only the winner is rendered at full settings.
+# For K=4 at 30 steps / 1024² with 8-step 512² previews that is about a third of
+# the UNet work of rendering all four at full quality.
+
+# name -> fn(images, goal) -> one score per image, higher is better
+SCORERS: Dict[str, Callable[[List[Image.Image], str], List[float]]] = {}
+
+
+def register_scorer(name: str):
+    """
+    Decorator: make fn(images, goal) -> [score, ...] selectable as AIG_FANOUT_SCORER / in the UI.
+    """
+    def _wrap(fn):
+        SCORERS[name] = fn
+        return fn
+    return _wrap
+
+
+def _zscore(x: np.ndarray) -> np.ndarray:
+    sd = x.std()
+    return (x - x.mean()) / sd if sd > 1e-9 else np.zeros_like(x)
+
+
+@register_scorer("heuristic")
+def heuristic_score(images: List[Image.Image], goal: str = "") -> List[float]:
+    """
+    Model-free image quality, relative within the set: detail (variance of the
+    Laplacian), colourfulness (Hasler & Süsstrunk) and contrast, minus clipped
+    highlights/shadows. Ignores the goal.
+    """
+    feats = []
+    for im in images:
+        im = im.convert("RGB")
+        im.thumbnail((256, 256))
+        rgb = np.asarray(im, dtype=np.float32) / 255.0
+        y = rgb @ np.float32([0.299, 0.587, 0.114])
+        lap = (-4 * y[1:-1, 1:-1] + y[:-2, 1:-1] + y[2:, 1:-1] + y[1:-1, :-2] + y[1:-1, 2:])
+        rg = rgb[..., 0] - rgb[..., 1]
+        yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+        colour = np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean())
+        clipped = float(np.mean((y < 0.02) | (y > 0.98)))
+        feats.append((np.log1p(1e3 * lap.var()), colour, y.std(), clipped))
+    f = np.asarray(feats, dtype=np.float64)
+    score = _zscore(f[:, 0]) + _zscore(f[:, 1]) + 0.5 * _zscore(f[:, 2]) - 4.0 * f[:, 3]
+    return [float(v) for v in score]
+
+
+_CLIP = {}
+
+
+@register_scorer("clip")
+def clip_score(images: List[Image.Image], goal: str = "") -> List[float]:
+    """
+    Cosine similarity between each image and the user's goal (not the variant's own
+    prompt, so every variant is judged against the same intent). Loads
+    AIG_FANOUT_CLIP_MODEL through transformers on first use.
+    """
+    from transformers import CLIPModel, CLIPProcessor
+    if "model" not in _CLIP:
+        _CLIP["model"] = CLIPModel.from_pretrained(FANOUT_CLIP_MODEL).eval()
+        _CLIP["processor"] = CLIPProcessor.from_pretrained(FANOUT_CLIP_MODEL)
+    model, proc = _CLIP["model"], _CLIP["processor"]
+    inputs = proc(text=[goal], images=[im.convert("RGB") for im in images], return_tensors="pt",
+                  padding=True, truncation=True)
+    with torch.no_grad():
+        img = model.get_image_features(pixel_values=inputs["pixel_values"])
+        txt = model.get_text_features(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+    img = img / img.norm(dim=-1, keepdim=True)
+    txt = txt / txt.norm(dim=-1, keepdim=True)
+    return [float(v) for v in (img @ txt.T).squeeze(-1)]
+
+
+def preview_size(width: int, height: int, side: int = FANOUT_PREVIEW_SIDE):
+    """
+    (w, h) with the long side at most `side`, same aspect, multiples of 8 (the VAE factor).
+    """
+    scale = min(1.0, side / float(max(width, height)))
+    return max(64, int(width * scale) // 8 * 8), max(64, int(height * scale) // 8 * 8)
+
+
+@dataclass
+class FanoutResult:
+    images: List[Image.Image] = field(repr=False)    # the winner at full settings
+    winner: int
+    scores: List[float]
+    previews: List[Image.Image] = field(repr=False)  # one per variant
+    seed: int
+    scorer: str
+    preview_steps: int
+    preview_size: Tuple[int, int]
+    cost_ratio: float                                # UNet work vs. rendering every variant at full settings
+
+    def as_dict(self, variants: List[Dict]) -> Dict:
+        """
+        What meta.json records about the selection.
+        """
+        return {
+            "k": len(variants),
+            "scorer": self.scorer,
+            "seed": self.seed,
+            "preview_steps": self.preview_steps,
+            "preview_size": list(self.preview_size),
+            "winner": self.winner,
+            "variants": [{**v.get("variant", {}), "final_prompt": v["final_prompt"], "score": round(sc, 4)}
+                         for v, sc in zip(variants, self.scores)],
+            "compute_vs_full_render_of_all": round(self.cost_ratio, 3),
+        }
+
+
+def render_previews(variants: List[Dict], width: int, height: int, steps: int, guidance: float,
+                    seed: int) -> List[Image.Image]:
+    """
+    All variants in as few batched calls as possible, one generator per image with the same seed.
+    """
+    pipe = get_txt2img()
+    with span("fanout.encode"):
+        embeds = [_encode(pipe, v["final_prompt"], v["final_negative_prompt"]) for v in variants]
+    previews = []
+    for i in range(0, len(variants), SWEEP_MAX_BATCH):
+        chunk = embeds[i:i + SWEEP_MAX_BATCH]
+        pe, npe, ppe, nppe = (torch.cat([e[j] for e in chunk]) for j in range(4))
+        with span("pipeline.fanout_preview"):
+            out = pipe(
+                prompt_embeds=pe,
+                negative_prompt_embeds=npe,
+                pooled_prompt_embeds=ppe,
+                negative_pooled_prompt_embeds=nppe,
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                generator=[_seed_gen(seed) for _ in chunk],
+                **step_kwargs(pipe),
+            )
+        previews.extend(out.images)
+    return previews
+
+
+def fan_out(variants: List[Dict], width: int, height: int, steps: int, guidance: float, seed: int,
+            num_images: int = 1, goal: str = "", scorer: Optional[str] = None,
+            preview_steps: int = FANOUT_PREVIEW_STEPS, preview_side: int = FANOUT_PREVIEW_SIDE) -> FanoutResult:
+    """
+    Render every variant cheaply, score the previews, render the winner at full settings.
+    """
+    scorer = scorer or FANOUT_SCORER
+    if scorer not in SCORERS:
+        raise ValueError(f"Unknown scorer '{scorer}'. Choose from: {', '.join(SCORERS)}")
+    if seed is None or seed < 0:
+        seed = random.randrange(2 ** 31)  # shared by previews and the final render
+
+    pw, ph = preview_size(width, height, preview_side)
+    previews = render_previews(variants, pw, ph, preview_steps, guidance, seed)
+    with span("fanout.score"):
+        scores = SCORERS[scorer](previews, goal)
+    winner = int(np.argmax(scores))
+    v = variants[winner]
+    images = txt2img(v["final_prompt"], v["final_negative_prompt"], width, height, steps, guidance, seed, num_images)
+    ratio = cost_ratio(len(variants), width, height, steps, num_images, preview_steps, (pw, ph))
+    return FanoutResult(images, winner, list(scores), previews, seed, scorer, preview_steps, (pw, ph), ratio)
+
+
+def preview_sheet(result: FanoutResult, variants: List[Dict], cell_size: int = 256) -> Image.Image:
+    """
+    The previews side by side, labelled with style and score; the winner is framed.
+    """
+    font = ImageFont.load_default()
+    top = 28
+    w0, h0 = result.previews[0].size
+    scale = cell_size / max(w0, h0)
+    cw, ch = int(w0 * scale), int(h0 * scale)
+    sheet = Image.new("RGB", (len(result.previews) * cw, top + ch), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (im, v, sc) in enumerate(zip(result.previews, variants, result.scores)):
+        sheet.paste(im.resize((cw, ch), Image.LANCZOS), (i * cw, top))
+        mark = "★ " if i == result.winner else ""
+        draw.text((i * cw + 6, 8), f"{mark}{v.get('style')} {sc:+.2f}", fill="black", font=font)
+        if i == result.winner:
+            draw.rectangle([i * cw, top, (i + 1) * cw - 1, top + ch - 1], outline=(255, 170, 0), width=4)
+    return sheet
+
+
+def cost_ratio(k: int, width: int, height: int, steps: int, num_images: int, preview_steps: int,
+               preview_wh) -> float:
+    """
+    UNet work of fan-out (K previews + the winner) relative to rendering all K at full settings.
+    """
+    full = steps * num_images * width * height
+    preview = preview_steps * preview_wh[0] * preview_wh[1]
+    return (k * preview + full) / float(k * full)
@@ -0,0 +1,87 @@
+import math
+from contextlib import contextmanager
+from typing import Dict
+
+import torch
+
+from .callbacks import on_step_end
+
+# Guidance scheduling for SDXL pipelines, applied from the step-end callback chain:
+#
+#   ramp    the guidance scale moves from the requested value at step 0 to `end`
+#           at the last step ("linear" or "cosine"); "constant" keeps it
+#   cutoff  after this fraction of the steps the unconditional (negative prompt)
+#           branch is dropped: the CFG-doubled tensors are cut to their conditional
+#           half and the UNet runs on half the batch for the remaining steps
+#
+# The negative prompt still shapes the guided steps; late steps mostly refine
+# detail, where guidance adds little.
+
+RAMPS = ("constant", "linear", "cosine")
+
+# tensors the pipelines concatenate as [uncond, cond] when CFG is on
+_DOUBLED = ("prompt_embeds", "add_text_embeds", "add_time_ids", "mask", "masked_image_latents", "image")
+
+
+def ramp_value(ramp: str, start: float, end: float, progress: float) -> float:
+    """
+    Guidance scale at `progress` (0..1) through the schedule.
+    """
+    if ramp == "linear":
+        return start + (end - start) * progress
+    if ramp == "cosine":
+        return end + (start - end) * 0.5 * (1 + math.cos(math.pi * progress))
+    return start
+
+
+def _cond_half(x):
+    if isinstance(x, (list, tuple)):  # MultiControlNet: one control image per net
+        return type(x)(_cond_half(t) for t in x)
+    return x.chunk(2)[-1] if torch.is_tensor(x) else x
+
+
+def _truncate(pipe, callback_kwargs: Dict) -> bool:
+    # ControlNet pipelines also double the control image; if this diffusers version
+    # does not hand it to callbacks the batch cannot be cut safely, so keep CFG on
+    if "prompt_embeds" not in callback_kwargs or (hasattr(pipe, "controlnet") and "image" not in callback_kwargs):
+        return False
+    for k in _DOUBLED:
+        if k in callback_kwargs:
+            callback_kwargs[k] = _cond_half(callback_kwargs[k])
+    pipe._guidance_scale = 1.0  # do_classifier_free_guidance is guidance_scale > 1
+    return True
+
+
+@contextmanager
+def guidance_schedule(cutoff: float = 1.0, ramp: str = "constant", end: float = None):
+    """
+    Apply a CFG cutoff (fraction of steps, 1.0 = never) and/or a guidance ramp to
+    pipeline calls made inside this block. Yields the settings for meta.json.
+    """
+    cutoff = max(0.0, min(1.0, float(cutoff)))
+    ramp = ramp if ramp in RAMPS else "constant"
+    settings = {"cutoff": cutoff, "ramp": ramp, "end": None if ramp == "constant" else float(end)}
+    if cutoff >= 1.0 and ramp == "constant":
+        yield settings
+        return
+
+    call = {}
+
+    def _on_step(pipe, i, t, callback_kwargs):
+        if i == 0:
+            call["base"] = float(pipe.guidance_scale)
+        if not pipe.do_classifier_free_guidance:
+            return callback_kwargs  # already cut (or CFG was never on)
+        total = pipe.num_timesteps
+        nxt = i + 1
+        if nxt >= total:
+            return callback_kwargs
+        scale = ramp_value(ramp, call["base"], settings["end"] or call["base"], nxt / max(1, total - 1))
+        if nxt >= cutoff * total or scale <= 1.0:
+            _truncate(pipe, callback_kwargs)
+        else:
+            pipe._guidance_scale = scale
+        return callback_kwargs
+
+    with on_step_end(_on_step, _DOUBLED):
+        yield settings
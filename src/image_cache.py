@@ -0,0 +1,75 @@
+import io, os
+from typing import Optional
+from PIL import Image
+
+from .config import IMAGE_CACHE_BYTES, THUMB_CACHE_BYTES
+from .lru import ByteLRU
+from .storage.backends import get_backend
+
+
+def _image_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+# Decoded images shared by every session in the process. Sessions only keep
+# paths; pixels live here (bounded) or on disk.
+_CACHE = ByteLRU(IMAGE_CACHE_BYTES, _image_bytes)
+
+# small encoded JPEGs for gallery grids; re-sending full PNGs on every rerun dominates panel time
+_THUMBS = ByteLRU(THUMB_CACHE_BYTES, len)
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        pass
+    # not on this node (another node's run, or evicted locally): read through shared storage
+    return os.stat(path) if get_backend().fetch(path) else None
+
+
+def get_image(path: Optional[str]) -> Optional[Image.Image]:
+    """
+    Decoded image for a saved output, loaded lazily. None if the file is gone
+    (e.g. evicted by retention and not in shared storage).
+    """
+    if not path:
+        return None
+    st = _stat(path)
+    if st is None:
+        return None
+
+    def _load():
+        im = Image.open(path)
+        im.load()  # decodes and closes the file
+        return im
+
+    # mtime/size in the key so a rewritten file is never served stale
+    return _CACHE.get_or_create((path, st.st_mtime_ns, st.st_size), _load)
+
+
+def get_thumbnail(path: Optional[str], max_side: int = 320) -> Optional[bytes]:
+    """
+    JPEG bytes of a downscaled output, for grids. None if the file is gone.
+    """
+    if not path:
+        return None
+    st = _stat(path)
+    if st is None:
+        return None
+
+    def _make():
+        im = Image.open(path)
+        im.draft("RGB", (max_side, max_side))  # cheap partial decode for JPEG sources
+        im = im.convert("RGB")
+        im.thumbnail((max_side, max_side))
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=85)
+        return buf.getvalue()
+
+    return _THUMBS.get_or_create((path, st.st_mtime_ns, st.st_size, max_side), _make)
+
+
+def cache_stats() -> dict:
+    return {"entries": len(_CACHE), "bytes": _CACHE.bytes, "max_bytes": _CACHE.max_bytes,
+            "hits": _CACHE.hits, "misses": _CACHE.misses}
@@ -0,0 +1,139 @@
+import io, json, os
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+from xml.sax.saxutils import escape
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from .config import OUTPUT_CODEC, OUTPUT_QUALITY, OUTPUT_EFFORT, PNG_COMPRESS_LEVEL, EMBED_METADATA
+
+CODECS = ("png", "webp_lossless", "webp", "jpeg")
+EXTENSIONS = {"png": ".png", "webp_lossless": ".webp", "webp": ".webp", "jpeg": ".jpg"}
+
+_EXIF_DESCRIPTION = 0x010E  # ImageDescription
+_XMP_NS = "https://github.com/hackingsage/Agentic-Image-Gen/ns/1.0/"
+
+
+@dataclass
+class OutputFormat:
+    """
+    How saved images are encoded.
+      png            lossless, compress_level 0 (fast, big) .. 9 (slow, small)
+      webp_lossless  lossless, usually ~25-35% smaller than PNG; effort = WebP method 0..6
+      webp / jpeg    lossy at `quality`; effort = WebP method 0..6 / JPEG optimize (effort > 0)
+    """
+    codec: str = "png"
+    quality: int = 95
+    effort: int = 4
+    png_compress_level: int = 6
+    embed_metadata: bool = True
+
+    def __post_init__(self):
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown output codec '{self.codec}'. Choose from: {', '.join(CODECS)}")
+
+    @property
+    def ext(self) -> str:
+        return EXTENSIONS[self.codec]
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def default_format() -> OutputFormat:
+    return OutputFormat(codec=OUTPUT_CODEC.lower(), quality=OUTPUT_QUALITY, effort=OUTPUT_EFFORT,
+                        png_compress_level=PNG_COMPRESS_LEVEL, embed_metadata=EMBED_METADATA)
+
+
+def parameters_text(params: Dict) -> str:
+    """
+    Human-readable summary, in the "parameters" style other SD tools show.
+    """
+    s = params.get("settings", {})
+    lines = [params.get("prompt") or ""]
+    if params.get("negative_prompt"):
+        lines.append(f"Negative prompt: {params['negative_prompt']}")
+    fields = [("Steps", s.get("steps")), ("CFG scale", s.get("guidance")), ("Seed", s.get("seed")),
+              ("Size", f"{s['width']}x{s['height']}" if "width" in s and "height" in s else None),
+              ("Mode", params.get("mode")), ("Style", params.get("style")), ("Run", params.get("run_id"))]
+    lines.append(", ".join(f"{k}: {v}" for k, v in fields if v is not None))
+    return "\n".join(lines)
+
+
+def _xmp(params: Dict) -> bytes:
+    desc = escape(parameters_text(params))
+    blob = escape(json.dumps(params, ensure_ascii=False))
+    return (
+        '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        f'<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:aig="{_XMP_NS}">'
+        f'<dc:description><rdf:Alt><rdf:li xml:lang="x-default">{desc}</rdf:li></rdf:Alt></dc:description>'
+        f'<aig:parameters>{blob}</aig:parameters>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta><?xpacket end="w"?>'
+    ).encode("utf-8")
+
+
+def _save_kwargs(img: Image.Image, fmt: OutputFormat, params: Optional[Dict]) -> Dict:
+    embed = fmt.embed_metadata and params
+    if fmt.codec == "png":
+        kw = {"format": "PNG", "compress_level": fmt.png_compress_level}
+        if embed:
+            info = PngInfo()
+            info.add_text("parameters", parameters_text(params))
+            info.add_itxt("aig", json.dumps(params, ensure_ascii=False))
+            kw["pnginfo"] = info
+        return kw
+
+    if fmt.codec in ("webp", "webp_lossless"):
+        kw = {"format": "WEBP", "method": max(0, min(6, fmt.effort))}
+        if fmt.codec == "webp_lossless":
+            kw.update(lossless=True, quality=100)  # quality = compression effort in lossless mode
+        else:
+            kw.update(quality=fmt.quality)
+    else:
+        kw = {"format": "JPEG", "quality": fmt.quality, "optimize": fmt.effort > 0,
+              # no chroma subsampling at high quality: keeps thin coloured edges clean
+              "subsampling": 0 if fmt.quality >= 90 else 2}
+
+    if embed:
+        exif = Image.Exif()
+        exif[_EXIF_DESCRIPTION] = json.dumps(params)  # EXIF text is ASCII
+        kw["exif"] = exif.tobytes()
+        kw["xmp"] = _xmp(params)  # written by Pillow >= 11 for JPEG, all versions for WebP
+    return kw
+
+
+def encode(img: Image.Image, fmt: OutputFormat, params: Optional[Dict] = None) -> bytes:
+    if fmt.codec == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, **_save_kwargs(img, fmt, params))
+    return buf.getvalue()
+
+
+def save_image(img: Image.Image, path_stem: str, fmt: OutputFormat, params: Optional[Dict] = None) -> str:
+    """
+    Encode `img` to path_stem + the codec's extension. Returns the full path.
+    """
+    path = path_stem + fmt.ext
+    data = encode(img, fmt, params)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def read_parameters(path: str) -> Optional[Dict]:
+    """
+    Generation parameters embedded by save_image, or None.
+    """
+    if not os.path.exists(path):
+        return None
+    with Image.open(path) as im:
+        raw = getattr(im, "text", {}).get("aig") if im.format == "PNG" else None
+        if raw is None:
+            raw = im.getexif().get(_EXIF_DESCRIPTION)
+    try:
+        return json.loads(raw) if raw else None
+    except ValueError:
+        return None
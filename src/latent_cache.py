@@ -0,0 +1,135 @@
+import hashlib, threading
+from typing import List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from . import metrics
+from .config import LATENT_CACHE_BYTES
+from .lru import ByteLRU
+
+# Encoded reference latents, keyed by (image content, size, VAE, dtype).
+# Users iterate on one reference while changing prompt/strength/seed, so the
+# VAE encoder only has to run the first time.
+_CACHE = ByteLRU(LATENT_CACHE_BYTES, lambda t: t.element_size() * t.nelement())
+
+# The fp16 SDXL VAE is temporarily upcast around encode/decode (here and inside
+# the diffusers pipelines). With the staged engine, encode, decode and other
+# pipeline calls can run on different threads, and those upcasts must not interleave.
+VAE_LOCK = threading.RLock()
+
+
+def image_key(img: Image.Image) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}:{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def _vae_id(vae) -> str:
+    return f"{getattr(vae.config, '_name_or_path', '')}@{id(vae)}"
+
+
+@torch.no_grad()
+def _encode(pipe, x: torch.Tensor) -> torch.Tensor:
+    vae = pipe.vae
+    dtype = vae.dtype
+    # the SDXL VAE overflows in fp16; pipelines upcast it for encoding too
+    upcast = dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+    with VAE_LOCK:
+        if upcast:
+            vae.to(torch.float32)
+        try:
+            x = x.to(device=vae.device, dtype=vae.dtype)
+            # distribution mean instead of a sample: deterministic, so it can be reused
+            lat = vae.encode(x).latent_dist.mode()
+        finally:
+            if upcast:
+                vae.to(dtype)
+
+    cfg = vae.config
+    mean, std = getattr(cfg, "latents_mean", None), getattr(cfg, "latents_std", None)
+    if mean is not None and std is not None:
+        mean = torch.tensor(mean).view(1, -1, 1, 1).to(lat)
+        std = torch.tensor(std).view(1, -1, 1, 1).to(lat)
+        lat = (lat - mean) * cfg.scaling_factor / std
+    else:
+        lat = lat * cfg.scaling_factor
+    return lat.to(dtype)
+
+
+def _cached(key: Tuple, make) -> torch.Tensor:
+    lat = _CACHE.get(key)
+    if lat is not None:
+        metrics.inc("aig_latent_cache_hits_total")
+        return lat
+    metrics.inc("aig_latent_cache_misses_total")
+    lat = make()
+    _CACHE.put(key, lat)
+    return lat
+
+
+def encode_image(pipe, image: Image.Image, width: Optional[int] = None, height: Optional[int] = None,
+                 key: Optional[str] = None) -> torch.Tensor:
+    """
+    Scaled VAE latents for `image`, ready to pass as `image=` to the SDXL
+    img2img / inpaint pipelines (they skip their own encoder for 4-channel input).
+    width/height None keeps the image's own size, as the pipelines do.
+    """
+    image = image.convert("RGB")
+    key = (key or image_key(image), image.size, width, height, _vae_id(pipe.vae), str(pipe.vae.dtype))
+    return _cached(key, lambda: _encode(pipe, pipe.image_processor.preprocess(image, height=height, width=width)))
+
+
+def encode_masked_image(pipe, image: Image.Image, mask: Image.Image, width: int, height: int,
+                        key: Optional[str] = None, mask_key: Optional[str] = None) -> torch.Tensor:
+    """
+    Latents of the image with the masked region blanked, for 9-channel inpainting UNets
+    (`masked_image_latents=`).
+    """
+    image, mask = image.convert("RGB"), mask.convert("L")
+    key = ("masked", key or image_key(image), mask_key or image_key(mask), width, height,
+           _vae_id(pipe.vae), str(pipe.vae.dtype))
+
+    def _make():
+        init = pipe.image_processor.preprocess(image, height=height, width=width)
+        m = pipe.mask_processor.preprocess(mask, height=height, width=width)
+        return _encode(pipe, init * (m < 0.5))
+
+    return _cached(key, _make)
+
+
+@torch.no_grad()
+def decode_latents(pipe, latents: torch.Tensor) -> List[Image.Image]:
+    """
+    Inverse of the encoder path: what an SDXL pipeline does after denoising
+    when output_type != "latent" (unscale, VAE decode, watermark, to PIL).
+    """
+    vae = pipe.vae
+    dtype = vae.dtype
+    upcast = dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+    cfg = vae.config
+    mean, std = getattr(cfg, "latents_mean", None), getattr(cfg, "latents_std", None)
+    with VAE_LOCK:
+        if upcast:
+            vae.to(torch.float32)
+        try:
+            lat = latents.to(device=vae.device, dtype=vae.dtype)
+            if mean is not None and std is not None:
+                mean = torch.tensor(mean).view(1, -1, 1, 1).to(lat)
+                std = torch.tensor(std).view(1, -1, 1, 1).to(lat)
+                lat = lat * std / cfg.scaling_factor + mean
+            else:
+                lat = lat / cfg.scaling_factor
+            image = vae.decode(lat, return_dict=False)[0]
+        finally:
+            if upcast:
+                vae.to(dtype)
+    if getattr(pipe, "watermark", None) is not None:
+        image = pipe.watermark.apply_watermark(image)
+    return pipe.image_processor.postprocess(image, output_type="pil")
+
+
+def cache_stats() -> dict:
+    return {"entries": len(_CACHE), "bytes": _CACHE.bytes, "max_bytes": _CACHE.max_bytes,
+            "hits": _CACHE.hits, "misses": _CACHE.misses}
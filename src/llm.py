@@ -0,0 +1,250 @@
+import asyncio, concurrent.futures, hashlib, json, os, ssl, threading
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from . import metrics
+from .locks import file_lock
+from .config import (LLM_URL, LLM_MODEL, LLM_API_KEY, LLM_REQUEST_TIMEOUT, LLM_MAX_CONCURRENCY,
+                     LLM_BATCH_WINDOW_MS, LLM_CACHE_FILE)
+
+
+class LLMError(RuntimeError):
+    pass
+
+
+class ResponseCache:
+    """
+    prompt -> response, persisted as an append-only JSONL file so answers
+    survive restarts and are shared by every app process on the node.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._data: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                        self._data[row["key"]] = row["response"]
+                    except (ValueError, KeyError):
+                        pass
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            if self._data.get(key) == response:
+                return
+            self._data[key] = response
+        if self.path:
+            line = json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n"
+            with file_lock(self.path + ".lock"):
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+    def __len__(self):
+        return len(self._data)
+
+
+async def _read_body(reader: asyncio.StreamReader, hdrs: Dict[str, str]) -> bytes:
+    # framed by the headers, so a server that keeps the connection open anyway cannot stall us
+    if hdrs.get("transfer-encoding", "").lower() == "chunked":
+        out = bytearray()
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass  # trailers
+                return bytes(out)
+            out += await reader.readexactly(size)
+            await reader.readexactly(2)
+    if "content-length" in hdrs:
+        return await reader.readexactly(int(hdrs["content-length"]))
+    return await reader.read()  # unframed: the body ends with the connection
+
+
+async def _post_json(url: str, payload: Dict, headers: Dict[str, str]) -> Dict:
+    # minimal HTTP/1.1 POST on asyncio streams (no extra client dependency)
+    u = urlsplit(url)
+    ctx = ssl.create_default_context() if u.scheme == "https" else None
+    reader, writer = await asyncio.open_connection(u.hostname, u.port or (443 if ctx else 80), ssl=ctx)
+    try:
+        body = json.dumps(payload).encode("utf-8")
+        lines = [f"POST {u.path or '/'}{'?' + u.query if u.query else ''} HTTP/1.1", f"Host: {u.netloc}",
+                 "Content-Type: application/json", f"Content-Length: {len(body)}", "Connection: close"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head[:-4].decode("latin-1").split("\r\n")
+        status = int(status_line.split()[1])
+        hdrs = {k.strip().lower(): v.strip() for k, v in (h.split(":", 1) for h in header_lines if ":" in h)}
+        data = await _read_body(reader, hdrs)
+    finally:
+        writer.close()
+
+    if status != 200:
+        raise LLMError(f"HTTP {status}: {data[:200]!r}")
+    return json.loads(data)
+
+
+class LLMClient:
+    """
+    Chat completions against an OpenAI-compatible endpoint, shared by every
+    session in the process.
+
+    Calls from any thread are handed to one asyncio loop on a background thread.
+    Requests that arrive within the batch window are issued together (bounded
+    by max_concurrency), and identical in-flight prompts share one request.
+    A caller that gives up (timeout) does not cancel the request: its answer
+    still lands in the cache for the next identical prompt.
+    """
+
+    def __init__(self, base_url: str, model: str, api_key: str = "", cache: Optional[ResponseCache] = None,
+                 max_concurrency: int = 8, batch_window: float = 0.005, request_timeout: float = 30.0):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.cache = cache if cache is not None else ResponseCache(None)
+        self.batch_window = batch_window
+        self.request_timeout = request_timeout
+        self.max_concurrency = max_concurrency
+
+        self._loop = asyncio.new_event_loop()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._batch: List = []
+        self._tasks: set = set()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name="llm-client")
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def close(self, timeout: float = 5.0):
+        """
+        Fail what is still queued or in flight, stop the loop and join its thread.
+        """
+        if self._loop.is_closed():
+            return
+
+        async def _shutdown():
+            batch, self._batch = self._batch, []
+            for _, _, fut in batch:
+                fut.set_exception(LLMError("client closed"))
+            for t in self._tasks:
+                t.cancel()
+            # then let the callers' waits (failed by the cancelled requests) finish too
+            others = asyncio.all_tasks() - {asyncio.current_task()}
+            await asyncio.gather(*others, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(_shutdown(), self._loop)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._loop.close()
+
+    def key(self, messages: List[Dict], temperature: float) -> str:
+        blob = json.dumps([self.model, temperature, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def complete(self, messages: List[Dict], timeout: float, temperature: float = 0.0,
+                 stage: str = "llm") -> str:
+        """
+        Response text, or raises TimeoutError / LLMError. Blocks at most `timeout` seconds.
+        """
+        key = self.key(messages, temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.inc("aig_llm_requests_total", stage=stage, outcome="cache")
+            return cached
+
+        payload = {"model": self.model, "messages": messages, "temperature": temperature}
+        fut = asyncio.run_coroutine_threadsafe(self._submit(key, payload), self._loop)
+        try:
+            text = fut.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()  # only the wait; the shared request keeps running
+            metrics.inc("aig_llm_requests_total", stage=stage, outcome="timeout")
+            raise TimeoutError(f"{stage}: no LLM answer within {timeout:.2f}s")
+        except Exception:
+            metrics.inc("aig_llm_requests_total", stage=stage, outcome="error")
+            raise
+        metrics.inc("aig_llm_requests_total", stage=stage, outcome="ok")
+        return text
+
+    async def _submit(self, key: str, payload: Dict) -> str:
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._loop.create_future()
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())  # no "never retrieved" noise
+            self._inflight[key] = fut
+            self._batch.append((key, payload, fut))
+            if len(self._batch) == 1:
+                self._loop.call_later(self.batch_window, self._flush)
+        return await asyncio.shield(fut)
+
+    def _flush(self):
+        batch, self._batch = self._batch, []
+        metrics.observe("aig_llm_batch_size", len(batch))
+        for key, payload, fut in batch:
+            task = self._loop.create_task(self._request(key, payload, fut))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _request(self, key: str, payload: Dict, fut: asyncio.Future):
+        try:
+            async with self._sem:
+                with metrics.span("llm_request"):
+                    resp = await asyncio.wait_for(_post_json(self.url, payload, self.headers), self.request_timeout)
+            text = resp["choices"][0]["message"]["content"]
+            self.cache.put(key, text)
+            fut.set_result(text)
+        except asyncio.CancelledError:
+            # the loop is shutting down: callers sharing this request get an answer, not a hang
+            if not fut.done():
+                fut.set_exception(LLMError("request cancelled"))
+            raise
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e if isinstance(e, LLMError) else LLMError(repr(e)))
+        finally:
+            self._inflight.pop(key, None)
+
+
+_CLIENT: Optional[LLMClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> Optional[LLMClient]:
+    """
+    Process-wide client, or None when AIG_LLM_URL is not set.
+    """
+    global _CLIENT
+    if not LLM_URL:
+        return None
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = LLMClient(LLM_URL, LLM_MODEL, LLM_API_KEY, ResponseCache(LLM_CACHE_FILE or None),
+                                max_concurrency=LLM_MAX_CONCURRENCY, batch_window=LLM_BATCH_WINDOW_MS / 1000,
+                                request_timeout=LLM_REQUEST_TIMEOUT)
+        return _CLIENT
+
+
+def reset_client():
+    """
+    Close the process-wide client; the next get_client() builds a new one.
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        old, _CLIENT = _CLIENT, None
+    if old is not None:
+        old.close()
@@ -0,0 +1,110 @@
+"""
+Local stand-in for an OpenAI-compatible /v1/chat/completions endpoint, for
+exercising the LLM agent stages (caching, batching, timeouts) without a model.
+
+    python -m src.llm_stub --port 8089 --delay 0.2
+    AIG_LLM_URL=http://127.0.0.1:8089/v1 streamlit run app.py
+
+Answers are deterministic, picked by which stage's system prompt is in the request.
+--delay larger than the stage timeouts exercises the rule-based fallback;
+--fail-every N returns HTTP 500 on every Nth request; --chunked answers with
+Transfer-Encoding: chunked and --keep-alive holds the connection open even
+when the client asks to close it.
+"""
+import argparse, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _answer(messages):
+    system = messages[0]["content"] if messages else ""
+    user = messages[-1]["content"] if messages else ""
+    if "plan images" in system:
+        return {"goal": f"{user.strip()}, dramatic and detailed", "style": "Cinematic"}
+    if "review" in system:
+        return {"critique": "Needs lighting and composition cues.",
+                "recommendations": ["add rim lighting", "rule of thirds"]}
+    prompt = user.split("\n", 1)[0].replace("Prompt: ", "")
+    negative = user.split("\n")[1].replace("Negative prompt: ", "") if "\n" in user else ""
+    return {"final_prompt": f"{prompt}, rim lighting, rule of thirds",
+            "final_negative_prompt": f"{negative}, blurry"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    delay = 0.0
+    fail_every = 0
+    chunked = False
+    keep_alive = False
+    count = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with _Handler.lock:
+            _Handler.count += 1
+            n = _Handler.count
+        time.sleep(self.delay)
+        if self.keep_alive:
+            self.close_connection = False  # ignore "Connection: close"
+        if self.fail_every and n % self.fail_every == 0:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content = json.dumps(_answer(body.get("messages", [])))
+        out = json.dumps({"id": f"stub-{n}", "object": "chat.completion", "model": body.get("model"),
+                          "choices": [{"index": 0, "finish_reason": "stop",
+                                       "message": {"role": "assistant", "content": content}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(out), 64):
+                part = out[i:i + 64]
+                self.wfile.write(f"{len(part):x}\r\n".encode() + part + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = 8089, delay: float = 0.0, fail_every: int = 0, background: bool = False,
+          chunked: bool = False, keep_alive: bool = False):
+    """
+    Start the stub (port 0 picks a free one). background=True returns the server
+    (call .shutdown() to stop).
+    """
+    _Handler.delay, _Handler.fail_every = delay, fail_every
+    _Handler.chunked, _Handler.keep_alive = chunked, keep_alive
+    _Handler.protocol_version = "HTTP/1.1" if chunked or keep_alive else "HTTP/1.0"
+    with _Handler.lock:
+        _Handler.count = 0
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True, name="llm-stub").start()
+        return server
+    print(f"LLM stub on http://127.0.0.1:{server.server_address[1]}/v1 (delay={delay}s)")
+    server.serve_forever()
+
+
+def request_count() -> int:
+    """
+    Requests answered since the last serve() (cache hits never reach the stub).
+    """
+    with _Handler.lock:
+        return _Handler.count
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--delay", type=float, default=0.0)
+    ap.add_argument("--fail-every", type=int, default=0)
+    ap.add_argument("--chunked", action="store_true")
+    ap.add_argument("--keep-alive", action="store_true")
+    args = ap.parse_args()
+    serve(args.port, args.delay, args.fail_every, chunked=args.chunked, keep_alive=args.keep_alive)
@@ -0,0 +1,314 @@
+import os, time, threading, contextvars, functools
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from .config import METRICS_ENABLED, METRICS_FILE, METRICS_PORT
+
+ENABLED = METRICS_ENABLED
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_HELP = {
+    "aig_stage_seconds": "Duration of a generation stage in seconds.",
+    "aig_unet_step_seconds": "Duration of one UNet forward (one denoising step).",
+    "aig_retention_remove_seconds": "Time to delete one evicted run directory.",
+    "aig_retention_removed_runs_total": "Runs evicted by the retention policy.",
+    "aig_retention_reclaimed_bytes_total": "Bytes reclaimed by the retention policy.",
+    "aig_outputs_bytes": "Total size of outputs/ at the last retention pass.",
+    "aig_admission_queue_depth": "Generation jobs waiting for a device slot.",
+    "aig_admission_active": "Generation jobs currently holding a device slot.",
+    "aig_job_latency_seconds": "Enqueue to release of a device job, by priority class.",
+    "aig_job_wait_seconds": "Queue wait before a device job first starts, by priority class.",
+    "aig_preemptions_total": "Times a running job gave its slot up to a more urgent one, by its class.",
+    "aig_preempted_seconds": "Time a preempted job spent suspended before resuming, by its class.",
+    "aig_latent_cache_hits_total": "Reference encodes served from the latent cache.",
+    "aig_latent_cache_misses_total": "Reference encodes that ran the VAE encoder.",
+    "aig_llm_requests_total": "Agent LLM calls by stage and outcome (ok, cache, timeout, error).",
+    "aig_llm_batch_size": "Distinct LLM requests issued together in one batch window.",
+    "aig_model_cache_events_total": "Model cache events (hits, loads, swap_ins, demotions, evictions).",
+    "aig_model_cache_bytes": "Model weights held per tier (device, cpu).",
+    "aig_model_cache_write_errors_total": "Components that could not be written to AIG_MODEL_CACHE_DIR.",
+    "aig_model_swap_seconds": "Time to bring a cold model back (kind = loads from disk, swap_ins from host RAM).",
+    "aig_engine_busy_seconds_total": "Time each engine stage worker spent working (rate() = utilisation).",
+    "aig_engine_queue_depth": "Jobs waiting in front of an engine stage.",
+    "aig_engine_images_total": "Images completed by the staged engine.",
+    "aig_engine_images_per_minute": "Sustained engine throughput since its first job.",
+    "aig_storage_uploads_total": "Runs mirrored to shared storage, by outcome (ok, failed).",
+    "aig_storage_upload_seconds": "Time to mirror one run (files, then its index row).",
+    "aig_storage_pending_runs": "Runs saved locally and not yet mirrored to shared storage.",
+    "aig_storage_fetch_seconds": "Read-through download of one file from shared storage.",
+    "aig_storage_fetch_errors_total": "Read-through downloads that failed (store unreachable).",
+    "aig_storage_sync_errors_total": "Failed passes pulling other nodes' index rows.",
+    "aig_bundle_bytes_total": "Run file bytes streamed into (export) or merged from (import) run bundles.",
+}
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        for i, b in enumerate(BUCKETS):
+            if v <= b:
+                self.counts[i] += 1
+        self.sum += v
+        self.count += 1
+
+
+_LOCK = threading.Lock()
+_HISTS: Dict[Tuple[str, Tuple], _Histogram] = {}
+_COUNTERS: Dict[Tuple[str, Tuple], float] = {}
+_GAUGES: Dict[Tuple[str, Tuple], float] = {}
+
+
+def observe(metric: str, value: float, **labels):
+    if not ENABLED:
+        return
+    key = (metric, tuple(sorted(labels.items())))
+    with _LOCK:
+        h = _HISTS.get(key)
+        if h is None:
+            h = _HISTS[key] = _Histogram()
+        h.observe(value)
+
+
+def inc(metric: str, value: float = 1.0, **labels):
+    if not ENABLED:
+        return
+    key = (metric, tuple(sorted(labels.items())))
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0.0) + value
+
+
+def set_gauge(metric: str, value: float, **labels):
+    if not ENABLED:
+        return
+    key = (metric, tuple(sorted(labels.items())))
+    with _LOCK:
+        _GAUGES[key] = float(value)
+
+
+# ----------------- PER-RUN TIMINGS -----------------
+class RunTimings:
+    """
+    Stage durations for one generation run. Stages that run several times
+    (e.g. text encoding for prompt + negative) are accumulated.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.unet_steps: List[float] = []
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict:
+        steps = self.unet_steps
+        return {
+            "stages": {k: round(v, 4) for k, v in self.stages.items()},
+            "unet_steps": [round(s, 4) for s in steps],
+            "unet_step_mean": round(sum(steps) / len(steps), 4) if steps else None,
+        }
+
+
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar("run_timings", default=None)
+
+
+@contextmanager
+def run_timings():
+    """
+    Collect every span recorded in this context into one RunTimings.
+    """
+    t = RunTimings()
+    token = _CURRENT.set(t)
+    try:
+        yield t
+    finally:
+        _CURRENT.reset(token)
+
+
+def current() -> Optional[RunTimings]:
+    return _CURRENT.get()
+
+
+def record(stage: str, seconds: float):
+    if not ENABLED:
+        return
+    t = _CURRENT.get()
+    if t is not None:
+        t.add(stage, seconds)
+    observe("aig_stage_seconds", seconds, stage=stage)
+
+
+def record_unet_step(seconds: float):
+    if not ENABLED:
+        return
+    t = _CURRENT.get()
+    if t is not None:
+        t.unet_steps.append(seconds)
+        t.add("unet", seconds)
+    observe("aig_unet_step_seconds", seconds)
+
+
+@contextmanager
+def _span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+def span(stage: str):
+    return _span(stage) if ENABLED else nullcontext()
+
+
+# ----------------- MODEL HOOKS -----------------
+def _sync():
+    # CUDA kernels are async; without a sync the time lands in whatever stage waits next.
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _hook_module(module, on_done):
+    local = threading.local()
+
+    def pre(mod, args):
+        _sync()
+        stack = getattr(local, "stack", None)
+        if stack is None:
+            stack = local.stack = []
+        stack.append(time.perf_counter())
+
+    def post(mod, args, out):
+        _sync()
+        on_done(time.perf_counter() - local.stack.pop())
+
+    module.register_forward_pre_hook(pre)
+    module.register_forward_hook(post)
+
+
+def _wrap_method(obj, name: str, stage: str):
+    fn = getattr(obj, name)
+
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        _sync()
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        _sync()
+        record(stage, time.perf_counter() - t0)
+        return out
+
+    setattr(obj, name, timed)
+
+
+def instrument_pipe(pipe):
+    """
+    Attach timing hooks to the components of a diffusers pipeline
+    (text encoders, UNet, ControlNet, VAE). No-op when metrics are off.
+    """
+    if not ENABLED or getattr(pipe, "_aig_instrumented", False):
+        return pipe
+
+    for name in ("text_encoder", "text_encoder_2"):
+        m = getattr(pipe, name, None)
+        if m is not None and not getattr(m, "_aig_instrumented", False):
+            _hook_module(m, lambda s: record("text_encode", s))
+            m._aig_instrumented = True
+
+    unet = getattr(pipe, "unet", None)
+    if unet is not None and not getattr(unet, "_aig_instrumented", False):
+        _hook_module(unet, record_unet_step)
+        unet._aig_instrumented = True
+
+    cn = getattr(pipe, "controlnet", None)
+    if cn is not None and not getattr(cn, "_aig_instrumented", False):
+        _hook_module(cn, lambda s: record("controlnet", s))
+        cn._aig_instrumented = True
+
+    vae = getattr(pipe, "vae", None)
+    if vae is not None and not getattr(vae, "_aig_instrumented", False):
+        _wrap_method(vae, "encode", "vae_encode")
+        _wrap_method(vae, "decode", "vae_decode")
+        vae._aig_instrumented = True
+
+    pipe._aig_instrumented = True
+    return pipe
+
+
+# ----------------- PROMETHEUS EXPORT -----------------
+def _fmt_labels(labels: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    with _LOCK:
+        snap = {k: (list(h.counts), h.sum, h.count) for k, h in _HISTS.items()}
+        scalars = [(k, v, "counter") for k, v in _COUNTERS.items()] + [(k, v, "gauge") for k, v in _GAUGES.items()]
+
+    lines = []
+    seen = set()
+    for (metric, labels), value, kind in sorted(scalars):
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} {kind}")
+        lines.append(f"{metric}{_fmt_labels(labels)} {value:g}")
+    for (metric, labels), (counts, total, count) in sorted(snap.items()):
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+        for b, c in zip(BUCKETS, counts):
+            lines.append(f"{metric}_bucket{_fmt_labels(labels, (('le', b),))} {c}")
+        lines.append(f"{metric}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {count}")
+        lines.append(f"{metric}_sum{_fmt_labels(labels)} {total:.6f}")
+        lines.append(f"{metric}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = METRICS_FILE):
+    """
+    Atomically write the histograms for a node_exporter textfile collector.
+    """
+    if not ENABLED:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics on localhost in a daemon thread. Call once per process.
+    """
+    if not ENABLED or not port:
+        return None
+    server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
@@ -0,0 +1,188 @@
+import gc, threading, time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+from . import metrics
+from .config import MODEL_DEVICE_BUDGET, MODEL_CPU_BUDGET
+
+TIERS = ("device", "cpu", "evicted")
+
+
+def module_bytes(module) -> int:
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+@dataclass
+class _Entry:
+    name: str
+    loader: Optional[Callable]
+    module: object = None
+    tier: str = "evicted"
+    bytes: int = 0
+    last_used: float = 0.0
+    refs: int = 0
+    pinned: bool = False
+
+
+class ModelCache:
+    """
+    Models by name, kept within a device memory budget with an LRU policy and
+    three tiers:
+
+      device   ready to run
+      cpu      demoted: weights in host RAM, swap-in is a device copy (~0.1-1 s)
+      evicted  dropped: the next use reloads through the registered loader
+
+    Cold models are demoted before anything is evicted, and only when the CPU
+    budget is exceeded too. Models in use (see `use`) are never moved but count
+    against the budget. Pinned models (the shared SDXL base components) are never
+    moved and do not count: the device budget is what the other models share on
+    top of them, so a budget smaller than the base cannot make them thrash.
+    A budget of 0 means unlimited.
+    """
+
+    def __init__(self, device_budget: int = 0, cpu_budget: int = 0, device: Optional[str] = None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.device_budget = int(device_budget)
+        self.cpu_budget = int(cpu_budget)
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "loads": 0, "swap_ins": 0, "demotions": 0, "evictions": 0,
+                       "load_seconds": 0.0, "swap_in_seconds": 0.0}
+
+    # ----------------- registration -----------------
+    def register(self, name: str, loader: Callable, pinned: bool = False):
+        """
+        Declare how to (re)load a model. Idempotent; nothing is loaded until first use.
+        """
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = _Entry(name, loader, pinned=pinned)
+
+    def put(self, name: str, module, loader: Optional[Callable] = None, pinned: bool = False):
+        """
+        Track an already-loaded model (on the device).
+        """
+        with self._lock:
+            self._entries[name] = _Entry(name, loader, module, "device", module_bytes(module), time.time(),
+                                         pinned=pinned)
+            self._enforce()
+
+    # ----------------- access -----------------
+    def get(self, name: str):
+        """
+        The model on the device, loading or swapping it in if needed.
+        """
+        with self._lock:
+            e = self._entries[name]
+            if e.tier == "device":
+                self._event("hits")
+            elif e.tier == "cpu":
+                t0 = time.perf_counter()
+                e.module.to(self.device)
+                self._event("swap_ins", time.perf_counter() - t0)
+            else:
+                if e.loader is None:
+                    raise KeyError(f"{name} was evicted and has no loader")
+                t0 = time.perf_counter()
+                e.module = e.loader()
+                e.bytes = module_bytes(e.module)
+                self._event("loads", time.perf_counter() - t0)
+            e.tier = "device"
+            e.last_used = time.time()
+            e.refs += 1  # held while making room, so the model just placed is not demoted again
+            try:
+                self._enforce()
+            finally:
+                e.refs -= 1
+            return e.module
+
+    @contextmanager
+    def use(self, *names: str):
+        """
+        Hold models on the device for the duration of the block (e.g. one pipeline call).
+        """
+        held, modules = [], []
+        try:
+            with self._lock:
+                for n in names:
+                    # hold each one as soon as it is placed, so placing the next cannot demote it
+                    modules.append(self.get(n))
+                    self._entries[n].refs += 1
+                    held.append(n)
+            yield modules
+        finally:
+            with self._lock:
+                for n in held:
+                    e = self._entries[n]
+                    e.refs -= 1
+                    e.last_used = time.time()
+
+    # ----------------- policy -----------------
+    def _bytes(self, tier: str, pinned: Optional[bool] = None) -> int:
+        return sum(e.bytes for e in self._entries.values()
+                   if e.tier == tier and (pinned is None or e.pinned == pinned))
+
+    def _movable(self, tier: str) -> List[_Entry]:
+        # least recently used first
+        return sorted((e for e in self._entries.values() if e.tier == tier and not e.pinned and e.refs == 0),
+                      key=lambda e: e.last_used)
+
+    def _enforce(self):
+        if self.device_budget:
+            for e in self._movable("device"):
+                if self._bytes("device", pinned=False) <= self.device_budget:
+                    break
+                if self.device == "cpu":
+                    self._evict(e)  # the device is host RAM; there is no lower tier to demote to
+                else:
+                    e.module.to("cpu")
+                    e.tier = "cpu"
+                    self._event("demotions")
+        if self.cpu_budget:
+            for e in self._movable("cpu"):
+                if self._bytes("cpu") <= self.cpu_budget:
+                    break
+                self._evict(e)
+        for tier in TIERS[:2]:
+            metrics.set_gauge("aig_model_cache_bytes", self._bytes(tier), tier=tier)
+
+    def _evict(self, e: _Entry):
+        e.module = None
+        e.tier = "evicted"
+        e.bytes = 0
+        self._event("evictions")
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _event(self, event: str, seconds: Optional[float] = None):
+        self._stats[event] += 1
+        metrics.inc("aig_model_cache_events_total", event=event)
+        if seconds is not None:
+            key = "load_seconds" if event == "loads" else "swap_in_seconds"
+            self._stats[key] += seconds
+            metrics.observe("aig_model_swap_seconds", seconds, kind=event)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats,
+                        device_bytes=self._bytes("device"), cpu_bytes=self._bytes("cpu"),
+                        pinned_bytes=self._bytes("device", pinned=True),
+                        device_budget=self.device_budget, cpu_budget=self.cpu_budget,
+                        models={n: e.tier for n, e in self._entries.items()})
+
+
+_CACHE: Optional[ModelCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_model_cache() -> ModelCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ModelCache(MODEL_DEVICE_BUDGET, MODEL_CPU_BUDGET)
+        return _CACHE
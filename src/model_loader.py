@@ -0,0 +1,208 @@
+import os, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import torch
+import diffusers
+from diffusers import AutoencoderKL, UNet2DConditionModel, ControlNetModel
+from transformers import CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+
+from . import metrics
+from .model_cache import get_model_cache
+from .config import MODEL_ID, MODEL_DIR, MODEL_CACHE_DIR, CONTROLNET_DIR, LOAD_WORKERS, QUANTIZE
+
+# weight-bearing components, loaded concurrently
+MODEL_COMPONENTS = {
+    "unet": UNet2DConditionModel,
+    "vae": AutoencoderKL,
+    "text_encoder": CLIPTextModel,
+    "text_encoder_2": CLIPTextModelWithProjection,
+}
+
+# components whose nn.Linear layers are int8-quantized with AIG_QUANTIZE=int8 (CPU only)
+QUANTIZED_COMPONENTS = ("unet", "text_encoder", "text_encoder_2")
+
+_LOCK = threading.Lock()
+_COMPONENTS: Optional[Dict] = None
+_LOAD_REPORT: Dict = {}
+
+
+def _device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def _dtype():
+    return torch.float16 if torch.cuda.is_available() else torch.float32
+
+def _dtype_name(dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+def _source() -> str:
+    # a local snapshot never touches the network
+    return MODEL_DIR or MODEL_ID
+
+
+def _cache_dir() -> Optional[str]:
+    if not MODEL_CACHE_DIR:
+        return None
+    slug = os.path.basename(os.path.normpath(_source()))
+    return os.path.join(MODEL_CACHE_DIR, f"{slug}-{_dtype_name(_dtype())}")
+
+
+def _cache_ready(name: str) -> bool:
+    d = _cache_dir()
+    return bool(d) and os.path.exists(os.path.join(d, name, ".complete"))
+
+
+def _from_pretrained(cls, src: str, subfolder: Optional[str], local: bool):
+    kwargs = dict(torch_dtype=_dtype(), use_safetensors=True, low_cpu_mem_usage=True, local_files_only=local)
+    if subfolder:
+        kwargs["subfolder"] = subfolder
+    if torch.cuda.is_available():
+        try:
+            return cls.from_pretrained(src, variant="fp16", **kwargs)
+        except (OSError, ValueError):
+            pass  # snapshot without fp16 files: load the full-precision ones and cast
+    return cls.from_pretrained(src, **kwargs)
+
+
+def quantization_mode() -> str:
+    """
+    "int8" when the deployment asks for it and the device supports it, else "none".
+    torch's dynamic quantization kernels are CPU-only.
+    """
+    return "int8" if QUANTIZE == "int8" and _device() == "cpu" else "none"
+
+
+def _quantize(name: str, model):
+    if quantization_mode() != "int8" or name not in QUANTIZED_COMPONENTS:
+        return model
+    # weights stored as int8, activations quantized on the fly per batch; float32 in, float32 out
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _load_component(name: str):
+    t0 = time.perf_counter()
+    cls = MODEL_COMPONENTS[name]
+    if _cache_ready(name):
+        # pre-converted single-file cache, already in the runtime dtype
+        model = cls.from_pretrained(os.path.join(_cache_dir(), name), torch_dtype=_dtype(),
+                                    use_safetensors=True, low_cpu_mem_usage=True, local_files_only=True)
+        source = "cache"
+    else:
+        model = _from_pretrained(cls, _source(), name, local=bool(MODEL_DIR))
+        source = "snapshot" if MODEL_DIR else "hub"
+    model.to(_device())
+    model.eval()
+    model = _quantize(name, model)
+    dt = time.perf_counter() - t0
+    metrics.observe("aig_model_load_seconds", dt, component=name)
+    return model, dt, source
+
+
+def _write_cache(models: Dict):
+    d = _cache_dir()
+    for name, model in models.items():
+        if _cache_ready(name) or (quantization_mode() != "none" and name in QUANTIZED_COMPONENTS):
+            continue  # quantized modules cannot be saved with save_pretrained; the cache holds float weights
+        out = os.path.join(d, name)
+        try:
+            model.save_pretrained(out, safe_serialization=True, max_shard_size="100GB")
+            open(os.path.join(out, ".complete"), "w").close()
+        except Exception as e:
+            # not fatal: the next start loads from the snapshot again and retries the write
+            metrics.inc("aig_model_cache_write_errors_total", component=name)
+            _LOAD_REPORT.setdefault("cache_errors", {})[name] = f"{type(e).__name__}: {e}"
+
+
+def load_components() -> Dict:
+    """
+    Shared SDXL base components (UNet, VAE, both text encoders, tokenizers, a
+    template scheduler), loaded once per process. The four models load
+    concurrently from the local snapshot (AIG_MODEL_DIR) or the hub; safetensors
+    are memory-mapped.
+    Every pipeline is built on top of these, so no weights are loaded twice.
+    """
+    global _COMPONENTS
+    with _LOCK:
+        if _COMPONENTS is not None:
+            return _COMPONENTS
+
+        t0 = time.perf_counter()
+        src, local = _source(), bool(MODEL_DIR)
+        with ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix="load") as pool:
+            futures = {name: pool.submit(_load_component, name) for name in MODEL_COMPONENTS}
+            sched_cfg = diffusers.DDPMScheduler.load_config(src, subfolder="scheduler", local_files_only=local)
+            scheduler_cls = getattr(diffusers, sched_cfg.get("_class_name", "EulerDiscreteScheduler"))
+            scheduler = scheduler_cls.from_config(sched_cfg)
+            tokenizer = CLIPTokenizer.from_pretrained(src, subfolder="tokenizer", local_files_only=local)
+            tokenizer_2 = CLIPTokenizer.from_pretrained(src, subfolder="tokenizer_2", local_files_only=local)
+            loaded = {name: f.result() for name, f in futures.items()}
+
+        models = {name: r[0] for name, r in loaded.items()}
+        total = time.perf_counter() - t0
+        _LOAD_REPORT.clear()
+        _LOAD_REPORT.update({
+            "source": {name: r[2] for name, r in loaded.items()},
+            "components": {name: round(r[1], 3) for name, r in loaded.items()},
+            "total": round(total, 3),
+            "quantization": quantization_mode(),
+        })
+        metrics.observe("aig_model_load_seconds", total, component="total")
+        metrics.record("model_load", total)
+
+        if _cache_dir() and not all(_cache_ready(n) for n in models):
+            threading.Thread(target=_write_cache, args=(models,), daemon=True, name="model-cache").start()
+
+        # every pipeline uses these: pinned on the device, outside the budget the ControlNets share
+        cache = get_model_cache()
+        for name, model in models.items():
+            cache.put(name, model, pinned=True)
+
+        _COMPONENTS = dict(models, scheduler=scheduler, tokenizer=tokenizer, tokenizer_2=tokenizer_2)
+        return _COMPONENTS
+
+
+def build_pipeline(pipeline_cls, **extra):
+    """
+    Wrap the shared components in any SDXL pipeline class (txt2img, img2img,
+    inpaint, ControlNet...). Cheap: no weights are loaded or copied. Each
+    pipeline gets its own scheduler (config only, no weights): set_timesteps
+    and step mutate it, so sharing one would let concurrent jobs corrupt each
+    other's schedules.
+    """
+    comps = load_components()
+    sched = comps["scheduler"]
+    return pipeline_cls(**dict(comps, scheduler=type(sched).from_config(sched.config)), **extra)
+
+
+def load_controlnet(repo_id: str):
+    t0 = time.perf_counter()
+    local_path = os.path.join(CONTROLNET_DIR, repo_id.split("/")[-1]) if CONTROLNET_DIR else None
+    src = local_path if local_path and os.path.isdir(local_path) else repo_id
+    model = _from_pretrained(ControlNetModel, src, None, local=src != repo_id)
+    model.to(_device())
+    dt = time.perf_counter() - t0
+    metrics.observe("aig_model_load_seconds", dt, component=f"controlnet:{repo_id}")
+    _LOAD_REPORT.setdefault("components", {})[f"controlnet:{repo_id}"] = round(dt, 3)
+    return model
+
+
+def model_info() -> Dict:
+    """
+    What produced an image, for meta.json.
+    """
+    q = quantization_mode()
+    return {
+        "model_id": _source(),
+        "device": _device(),
+        "dtype": _dtype_name(_dtype()),
+        "quantization": {"mode": q, "components": list(QUANTIZED_COMPONENTS) if q != "none" else []},
+    }
+
+
+def load_report() -> Dict:
+    """
+    Per-component load times of this process (time-to-ready after a deploy).
+    """
+    return dict(_LOAD_REPORT)
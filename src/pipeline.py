@@ -2,37 +2,26 @@ import torch
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
 from PIL import Image
 import streamlit as st
-
-MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+from .metrics import span, instrument_pipe
+from .callbacks import step_kwargs
+from .model_loader import build_pipeline
 
 def _device():
     return "cuda" if torch.cuda.is_available() else "cpu"
 
 @st.cache_resource
 def get_txt2img_pipeline():
-    pipe = StableDiffusionXLPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-        variant="fp16" if torch.cuda.is_available() else None,
-        use_safetensors=True,
-    )
-    pipe.to(_device())
+    pipe = build_pipeline(StableDiffusionXLPipeline)
     if torch.cuda.is_available():
         pipe.enable_xformers_memory_efficient_attention() if hasattr(pipe, "enable_xformers_memory_efficient_attention") else None
-    return pipe
+    return instrument_pipe(pipe)
 
 @st.cache_resource
 def get_img2img_pipeline():
-    pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-        variant="fp16" if torch.cuda.is_available() else None,
-        use_safetensors=True,
-    )
-    pipe.to(_device())
+    pipe = build_pipeline(StableDiffusionXLImg2ImgPipeline)
     if torch.cuda.is_available():
         pipe.enable_xformers_memory_efficient_attention() if hasattr(pipe, "enable_xformers_memory_efficient_attention") else None
-    return pipe
+    return instrument_pipe(pipe)
 
 def _seed_generator(seed: int):
     device = _device()
@@ -56,29 +45,33 @@ def generate(
 
     if ref_image is None:
         pipe = get_txt2img_pipeline()
+        with span("pipeline.txt2img"):
+            out = pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                num_images_per_prompt=num_images,
+                generator=generator,
+                **step_kwargs(pipe),
+            )
+        return out.images
+
+    # img2img
+    pipe = get_img2img_pipeline()
+    ref_image = ref_image.convert("RGB")
+    with span("pipeline.img2img"):
         out = pipe(
             prompt=prompt,
             negative_prompt=negative_prompt,
-            width=width,
-            height=height,
+            image=ref_image,
+            strength=strength,
             num_inference_steps=steps,
             guidance_scale=guidance,
             num_images_per_prompt=num_images,
             generator=generator,
+            **step_kwargs(pipe),
         )
-        return out.images
-
-    # img2img
-    pipe = get_img2img_pipeline()
-    ref_image = ref_image.convert("RGB")
-    out = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        image=ref_image,
-        strength=strength,
-        num_inference_steps=steps,
-        guidance_scale=guidance,
-        num_images_per_prompt=num_images,
-        generator=generator,
-    )
     return out.images
@@ -1,11 +1,19 @@
 import torch
-import streamlit as st
 import numpy as np
 import cv2
 from PIL import Image
-from diffusers import ControlNetModel, StableDiffusionXLControlNetPipeline
-
-SDXL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+from diffusers import StableDiffusionXLControlNetPipeline
+try:
+    from diffusers.models.controlnets.multicontrolnet import MultiControlNetModel
+except ImportError:  # diffusers < 0.32
+    from diffusers.pipelines.controlnet.multicontrolnet import MultiControlNetModel
+from .metrics import span, instrument_pipe
+from .callbacks import step_kwargs
+from .model_loader import build_pipeline, load_controlnet
+from .model_cache import get_model_cache
+from .lru import ByteLRU
+from .config import CONTROL_CACHE_BYTES
+from .uploads import resolve
 
 CONTROLNETS = {
     "Canny": "diffusers/controlnet-canny-sdxl-1.0",
@@ -29,38 +37,136 @@ def _to_canny(img: Image.Image):
     edges = np.stack([edges, edges, edges], axis=-1)
     return Image.fromarray(edges)
 
-@st.cache_resource
-def get_controlnet_pipe(kind: str):
-    cn_id = CONTROLNETS[kind]
-    controlnet = ControlNetModel.from_pretrained(cn_id, torch_dtype=_dtype())
-    pipe = StableDiffusionXLControlNetPipeline.from_pretrained(
-        SDXL_ID,
-        controlnet=controlnet,
-        torch_dtype=_dtype(),
-        variant="fp16" if torch.cuda.is_available() else None,
-        use_safetensors=True,
-    ).to(_device())
-    return pipe
-
-def controlnet_generate(kind, prompt, negative_prompt, ref_image: Image.Image,
+# preprocessed control images by (upload key, kind): moving a slider does not rerun Canny
+_CONTROL_CACHE = ByteLRU(CONTROL_CACHE_BYTES, lambda im: im.width * im.height * 3)
+
+def _control_image(kind: str, img: Image.Image, key: str = None) -> Image.Image:
+    def _make():
+        if kind == "Canny":
+            return _to_canny(img)
+        return img.convert("RGB")
+    if key is None:
+        return _make()
+    return _CONTROL_CACHE.get_or_create((key, kind), _make)
+
+
+class _SkippingMultiControlNet(MultiControlNetModel):
+    """
+    MultiControlNetModel that does not run a ControlNet whose conditioning
+    scale is 0 for this step. The pipeline zeroes the scale outside a control's
+    [start, end] range, so finished (or not yet started) branches cost nothing.
+    """
+
+    def forward(self, sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale,
+                class_labels=None, timestep_cond=None, attention_mask=None, added_cond_kwargs=None,
+                cross_attention_kwargs=None, guess_mode=False, return_dict=True):
+        down, mid = None, None
+        for image, scale, net in zip(controlnet_cond, conditioning_scale, self.nets):
+            if float(scale) == 0.0:
+                continue
+            d, m = net(
+                sample=sample,
+                timestep=timestep,
+                encoder_hidden_states=encoder_hidden_states,
+                controlnet_cond=image,
+                conditioning_scale=scale,
+                class_labels=class_labels,
+                timestep_cond=timestep_cond,
+                attention_mask=attention_mask,
+                added_cond_kwargs=added_cond_kwargs,
+                cross_attention_kwargs=cross_attention_kwargs,
+                guess_mode=guess_mode,
+                return_dict=False,
+            )
+            if down is None:
+                down, mid = list(d), m
+            else:
+                down = [a + b for a, b in zip(down, d)]
+                mid = mid + m
+        # (None, None) -> the UNet runs without ControlNet residuals this step
+        return down, mid
+
+
+def _model_name(kind: str) -> str:
+    return f"controlnet:{kind}"
+
+def _register(kind: str) -> str:
+    # ControlNets live in the memory-budgeted model cache: a cold one is demoted to
+    # host RAM or dropped, and swapped back in on its next use
+    name = _model_name(kind)
+    get_model_cache().register(name, lambda: load_controlnet(CONTROLNETS[kind]))
+    return name
+
+def get_controlnet_model(kind: str):
+    with span(f"model_load.controlnet_{kind.lower()}"):
+        return get_model_cache().get(_register(kind))
+
+def get_controlnet_pipe(kinds, models=None):
+    """
+    SDXL ControlNet pipeline over the shared base components with the given
+    control model(s) attached. Building it is cheap; the control models come from the model cache.
+    """
+    if isinstance(kinds, str):
+        kinds = [kinds]
+    if models is None:
+        models = [get_controlnet_model(k) for k in kinds]
+    multi = _SkippingMultiControlNet(models)
+    return instrument_pipe(build_pipeline(StableDiffusionXLControlNetPipeline, controlnet=multi))
+
+def _normalize_controls(controls, control_strength):
+    # legacy call style: a single kind name + one strength
+    if isinstance(controls, str):
+        controls = [{"kind": controls, "scale": control_strength}]
+    out = []
+    for c in controls:
+        start, end = float(c.get("start", 0.0)), float(c.get("end", 1.0))
+        out.append({"kind": c["kind"], "scale": float(c.get("scale", control_strength)),
+                    "start": start, "end": max(start, end), "image": c.get("image")})
+    return out
+
+def _side_by_side(images):
+    if len(images) == 1:
+        return images[0]
+    h = min(im.height for im in images)
+    resized = [im.resize((int(im.width * h / im.height), h)) for im in images]
+    sheet = Image.new("RGB", (sum(im.width for im in resized), h))
+    x = 0
+    for im in resized:
+        sheet.paste(im, (x, 0))
+        x += im.width
+    return sheet
+
+def controlnet_generate(controls, prompt, negative_prompt, ref_image,
                         width, height, steps, guidance, seed, num_images, control_strength=0.8):
-    pipe = get_controlnet_pipe(kind)
-
-    if kind == "Canny":
-        control_img = _to_canny(ref_image)
-    else:
-        control_img = ref_image.convert("RGB")
-
-    out = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        image=control_img,
-        controlnet_conditioning_scale=float(control_strength),
-        width=width,
-        height=height,
-        num_inference_steps=steps,
-        guidance_scale=guidance,
-        num_images_per_prompt=num_images,
-        generator=_seed_gen(seed)
-    )
-    return out.images, control_img
+    """
+    controls: a kind name ("Canny") or a list of
+      {"kind": "Canny", "scale": 0.8, "start": 0.0, "end": 1.0, "image": optional PIL override}
+    start/end are fractions of the denoising schedule during which that control is applied.
+    ref_image (and per-control images) may be PIL images or uploads.Upload handles.
+    """
+    controls = _normalize_controls(controls, control_strength)
+    kinds = [c["kind"] for c in controls]
+
+    with span("control_preprocess"):
+        control_imgs = [_control_image(c["kind"], *resolve(c["image"] or ref_image)) for c in controls]
+
+    # held on the device for the whole call; cold ones are swapped in / reloaded first
+    with get_model_cache().use(*[_register(k) for k in kinds]) as models:
+        pipe = get_controlnet_pipe(kinds, models)
+        with span("pipeline.controlnet"):
+            out = pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                image=control_imgs,
+                controlnet_conditioning_scale=[c["scale"] for c in controls],
+                control_guidance_start=[c["start"] for c in controls],
+                control_guidance_end=[c["end"] for c in controls],
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                num_images_per_prompt=num_images,
+                generator=_seed_gen(seed),
+                **step_kwargs(pipe),
+            )
+    return out.images, _side_by_side(control_imgs)
@@ -2,8 +2,12 @@ import torch
 import streamlit as st
 from PIL import Image
 from diffusers import StableDiffusionXLInpaintPipeline
-
-MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+from .metrics import span, instrument_pipe
+from .callbacks import step_kwargs
+from .model_loader import build_pipeline
+from .latent_cache import encode_image, encode_masked_image
+from .uploads import resolve
+from .config import INPAINT_MAX_BATCH
 
 def _device():
     return "cuda" if torch.cuda.is_available() else "cpu"
@@ -18,25 +22,54 @@ def _seed_gen(seed: int):
 
 @st.cache_resource
 def get_inpaint_pipe():
-    pipe = StableDiffusionXLInpaintPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=_dtype(),
-        variant="fp16" if torch.cuda.is_available() else None,
-        use_safetensors=True,
-    ).to(_device())
-    return pipe
-
-def inpaint(prompt, negative_prompt, image: Image.Image, mask: Image.Image,
-            steps, guidance, seed, strength=0.75):
+    return instrument_pipe(build_pipeline(StableDiffusionXLInpaintPipeline))
+
+def inpaint(prompt, negative_prompt, image, mask,
+            steps, guidance, seed, strength=0.75, num_images=1):
+    """
+    image: the base, a PIL image or an uploads.Upload handle.
+    mask: one mask or a list of masks (PIL or Upload; white = repaint).
+
+    Every (mask, variant) pair is denoised in one batched call (split only past
+    INPAINT_MAX_BATCH) that shares the encoded base latents. Images come back
+    mask-major: [mask1 v1..vN, mask2 v1..vN, ...]; variant v uses seed + v.
+    """
     pipe = get_inpaint_pipe()
-    out = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        image=image.convert("RGB"),
-        mask_image=mask.convert("RGB"),
-        strength=float(strength),
-        num_inference_steps=steps,
-        guidance_scale=guidance,
-        generator=_seed_gen(seed)
-    )
-    return out.images
+    image, key = resolve(image)
+    masks = [resolve(m) for m in (mask if isinstance(mask, (list, tuple)) else [mask])]
+    num_images = max(1, int(num_images))
+    # the pipeline resizes to its default canvas; encode at that size so cached latents line up
+    size = pipe.default_sample_size * pipe.vae_scale_factor
+    image_latents = encode_image(pipe, image, width=size, height=size, key=key)
+
+    masked_latents = None
+    if pipe.unet.config.in_channels == 9:  # dedicated inpainting UNet also needs the masked image
+        masked_latents = [encode_masked_image(pipe, image, m, width=size, height=size, key=key, mask_key=mk)
+                          for m, mk in masks]
+
+    # one entry per output image, mask-major
+    batch = [(i, v) for i in range(len(masks)) for v in range(num_images)]
+    seeded = seed is not None and seed >= 0
+    images = []
+    for c in range(0, len(batch), INPAINT_MAX_BATCH):
+        chunk = batch[c:c + INPAINT_MAX_BATCH]
+        with span("pipeline.inpaint"):
+            out = pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                image=image_latents,  # repeated across the batch by the pipeline
+                mask_image=[masks[i][0].convert("RGB") for i, _ in chunk],
+                masked_image_latents=(torch.cat([masked_latents[i] for i, _ in chunk])
+                                      if masked_latents is not None else None),
+                width=size,
+                height=size,
+                strength=float(strength),
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                num_images_per_prompt=len(chunk),
+                # a fresh generator per image: each matches a single-image run with seed + v
+                generator=[_seed_gen(int(seed) + v) for _, v in chunk] if seeded else None,
+                **step_kwargs(pipe),
+            )
+        images += out.images
+    return images
@@ -2,8 +2,11 @@ import torch
 import streamlit as st
 from PIL import Image
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
-
-MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+from .metrics import span, instrument_pipe
+from .callbacks import step_kwargs
+from .model_loader import build_pipeline
+from .latent_cache import encode_image
+from .uploads import resolve
 
 def _device():
     return "cuda" if torch.cuda.is_available() else "cpu"
@@ -13,23 +16,11 @@ def _dtype():
 
 @st.cache_resource
 def get_txt2img():
-    pipe = StableDiffusionXLPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=_dtype(),
-        variant="fp16" if torch.cuda.is_available() else None,
-        use_safetensors=True,
-    ).to(_device())
-    return pipe
+    return instrument_pipe(build_pipeline(StableDiffusionXLPipeline))
 
 @st.cache_resource
 def get_img2img():
-    pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=_dtype(),
-        variant="fp16" if torch.cuda.is_available() else None,
-        use_safetensors=True,
-    ).to(_device())
-    return pipe
+    return instrument_pipe(build_pipeline(StableDiffusionXLImg2ImgPipeline))
 
 def _seed_gen(seed: int):
     if seed is None or seed < 0:
@@ -38,29 +29,38 @@ def _seed_gen(seed: int):
 
 def txt2img(prompt, negative_prompt, width, height, steps, guidance, seed, num_images):
     pipe = get_txt2img()
-    out = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        width=width,
-        height=height,
-        num_inference_steps=steps,
-        guidance_scale=guidance,
-        num_images_per_prompt=num_images,
-        generator=_seed_gen(seed)
-    )
+    with span("pipeline.txt2img"):
+        out = pipe(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            num_inference_steps=steps,
+            guidance_scale=guidance,
+            num_images_per_prompt=num_images,
+            generator=_seed_gen(seed),
+            **step_kwargs(pipe),
+        )
     return out.images
 
-def img2img(prompt, negative_prompt, init_image: Image.Image, strength, steps, guidance, seed, num_images):
+def img2img(prompt, negative_prompt, init_image, strength, steps, guidance, seed, num_images):
+    """
+    init_image: a PIL image or an uploads.Upload (whose key spares hashing the pixels).
+    """
     pipe = get_img2img()
-    init_image = init_image.convert("RGB")
-    out = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        image=init_image,
-        strength=strength,
-        num_inference_steps=steps,
-        guidance_scale=guidance,
-        num_images_per_prompt=num_images,
-        generator=_seed_gen(seed)
-    )
+    init_image, key = resolve(init_image)
+    # cached VAE latents: repeat iterations on the same reference skip the encoder
+    init_latents = encode_image(pipe, init_image.convert("RGB"), key=key)
+    with span("pipeline.img2img"):
+        out = pipe(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            image=init_latents,
+            strength=strength,
+            num_inference_steps=steps,
+            guidance_scale=guidance,
+            num_images_per_prompt=num_images,
+            generator=_seed_gen(seed),
+            **step_kwargs(pipe),
+        )
     return out.images
@@ -0,0 +1,83 @@
+import copy
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import torch
+
+from .admission import AdmissionController, Ticket, get_controller
+from .callbacks import on_step_end
+
+# Step-boundary preemption for less urgent jobs. At the end of each denoising
+# step the job checks whether a more urgent one is waiting for its device slot;
+# if so it checkpoints, gives the slot up, blocks until re-admitted, restores
+# and carries on with the next step.
+#
+# A pipeline __call__ keeps its per-call state (guidance scale, step count...)
+# as attributes of the pipeline object and of its scheduler. build_pipeline gives
+# every pipeline its own scheduler, but a job that runs in between on the same
+# pipeline object would overwrite both, so the checkpoint holds:
+#
+#   scheduler  a deep copy of its state (timesteps, sigmas, step index, the
+#              multistep solvers' model outputs)
+#   pipeline   the per-call underscore attributes
+#   latents    a copy of the current latents, handed back to the loop on resume
+#
+# Everything else the loop needs (embeddings, generator) lives in the suspended
+# thread's own frame, and the contextvar-scoped speed-ups (token merging, feature
+# caching, guidance schedule) are per job. Seeded runs therefore resume bit-identical;
+# the default Euler sampler draws no noise after the first step, so random-seed runs do too.
+
+
+@dataclass
+class Checkpoint:
+    step: int
+    scheduler_state: Dict
+    pipe_state: Dict
+    latents: Optional[torch.Tensor]
+
+    @classmethod
+    def take(cls, pipe, step: int, callback_kwargs: Dict) -> "Checkpoint":
+        sched = pipe.scheduler
+        # config is a FrozenDict and never changes; everything else may be overwritten
+        state = {k: (v if k == "_internal_dict" else copy.deepcopy(v)) for k, v in vars(sched).items()}
+        call_state = {k: v for k, v in vars(pipe).items()
+                      if k.startswith("_") and not isinstance(v, torch.nn.Module)}
+        latents = callback_kwargs.get("latents")
+        return cls(step, state, call_state, latents.clone() if torch.is_tensor(latents) else None)
+
+    def restore(self, pipe, callback_kwargs: Dict):
+        sched_vars = vars(pipe.scheduler)
+        for k in [k for k in sched_vars if k not in self.scheduler_state]:
+            del sched_vars[k]
+        sched_vars.update(self.scheduler_state)
+        vars(pipe).update(self.pipe_state)
+        if self.latents is not None:
+            callback_kwargs["latents"] = self.latents  # the pipeline continues from the returned latents
+
+
+@contextmanager
+def preemptible(ticket: Ticket, controller: Optional[AdmissionController] = None):
+    """
+    Let pipeline calls made inside this block yield the ticket's device slot at
+    step boundaries to more urgent jobs. Yields stats (preemptions, suspended_seconds).
+    Enter it inside any other step-callback scopes, so it checkpoints their effects too.
+    """
+    controller = controller or get_controller()
+    stats = {"priority": ticket.priority, "preemptions": 0, "suspended_seconds": 0.0}
+    if not controller.preemptible(ticket):
+        yield stats
+        return
+
+    def _on_step(pipe, i, t, callback_kwargs):
+        if i + 1 >= pipe.num_timesteps or not controller.should_yield(ticket):
+            return callback_kwargs
+        ckpt = Checkpoint.take(pipe, i, callback_kwargs)
+        waited = controller.suspend(ticket)
+        ckpt.restore(pipe, callback_kwargs)
+        stats["preemptions"] += 1
+        stats["suspended_seconds"] = round(stats["suspended_seconds"] + waited, 3)
+        return callback_kwargs
+
+    with on_step_end(_on_step, ("latents",)):
+        yield stats
@@ -0,0 +1,88 @@
+import os, io, cProfile, pstats
+from contextlib import contextmanager, ExitStack
+from typing import Dict, Tuple
+
+import torch
+
+from .callbacks import on_step_end
+
+
+@contextmanager
+def profile_run(out_dir: str, steps: Tuple[int, int] = (2, 4), use_torch: bool = True,
+                use_cprofile: bool = False, top_n: int = 30):
+    """
+    Profile the pipeline call(s) made inside this block, limited to denoising
+    steps steps[0]..steps[1] (1-based, inclusive) to keep overhead bounded.
+
+    Writes into out_dir:
+      profile_trace.json  Chrome trace (chrome://tracing / Perfetto)
+      profile_ops.txt     top-N torch operators
+      profile_py.txt      top-N Python functions (cProfile, optional)
+
+    Yields a dict that is filled with the written paths once the block exits;
+    store it in meta["profile"].
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    first, last = max(1, int(steps[0])), max(int(steps[0]), int(steps[1]))
+    s0, e0 = first - 1, last - 1  # 0-based step indices
+    info: Dict = {"steps": [first, last]}
+
+    with ExitStack() as stack:
+        prof = None
+        if use_torch:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            def _trace_ready(p):
+                trace_path = os.path.join(out_dir, "profile_trace.json")
+                ops_path = os.path.join(out_dir, "profile_ops.txt")
+                p.export_chrome_trace(trace_path)
+                sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+                with open(ops_path, "w", encoding="utf-8") as f:
+                    f.write(p.key_averages().table(sort_by=sort_by, row_limit=top_n))
+                info["chrome_trace"] = trace_path
+                info["ops_summary"] = ops_path
+
+            # profiler step k == denoising step index k (step 0 also covers prompt encoding)
+            warmup = 1 if s0 > 0 else 0
+            prof = stack.enter_context(torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=s0 - warmup, warmup=warmup, active=e0 - s0 + 1, repeat=1),
+                on_trace_ready=_trace_ready,
+            ))
+
+        py = cProfile.Profile() if use_cprofile else None
+        py_on = [False]
+        if py is not None and s0 == 0:
+            py.enable()
+            py_on[0] = True
+
+        def _step(pipe, step_index, timestep, callback_kwargs):
+            if prof is not None:
+                prof.step()
+            if py is not None:
+                if step_index == s0 - 1:
+                    py.enable()
+                    py_on[0] = True
+                elif step_index == e0 and py_on[0]:
+                    py.disable()
+                    py_on[0] = False
+            return callback_kwargs
+
+        stack.enter_context(on_step_end(_step))
+        try:
+            yield info
+        finally:
+            if py is not None:
+                if py_on[0]:
+                    py.disable()
+                raw_path = os.path.join(out_dir, "profile_py.prof")
+                txt_path = os.path.join(out_dir, "profile_py.txt")
+                py.dump_stats(raw_path)
+                buf = io.StringIO()
+                pstats.Stats(py, stream=buf).sort_stats("cumulative").print_stats(top_n)
+                with open(txt_path, "w", encoding="utf-8") as f:
+                    f.write(buf.getvalue())
+                info["py_stats"] = raw_path
+                info["py_summary"] = txt_path
@@ -0,0 +1,234 @@
+import os, json, time, shutil, threading
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+from . import metrics
+from .config import (
+    RETENTION_MAX_BYTES, RETENTION_MAX_AGE_DAYS, RETENTION_KEEP_LAST,
+    RETENTION_KEEP_STARRED, RETENTION_INTERVAL, RETENTION_BATCH,
+)
+from .storage import OUTPUT_DIR, read_index, compact_index, load_run_meta
+from .storage.backends import get_backend
+from .similarity import get_similarity_index
+
+REPORT_FILE = os.path.join(OUTPUT_DIR, "retention.jsonl")
+
+
+@dataclass
+class RetentionPolicy:
+    max_bytes: int = 0          # 0 = no size cap
+    max_age_days: float = 0     # 0 = keep forever
+    keep_last: int = 0          # newest N runs are never evicted
+    keep_starred: bool = True
+
+    @property
+    def active(self) -> bool:
+        return self.max_bytes > 0 or self.max_age_days > 0
+
+
+def default_policy() -> RetentionPolicy:
+    return RetentionPolicy(
+        max_bytes=RETENTION_MAX_BYTES,
+        max_age_days=RETENTION_MAX_AGE_DAYS,
+        keep_last=RETENTION_KEEP_LAST,
+        keep_starred=RETENTION_KEEP_STARRED,
+    )
+
+
+@dataclass
+class RetentionReport:
+    timestamp: str
+    scanned: int = 0
+    removed: List[str] = field(default_factory=list)
+    reclaimed_bytes: int = 0
+    total_bytes: int = 0            # outputs size after the pass
+    remove_seconds: List[float] = field(default_factory=list)
+    seconds: float = 0.0
+    pending: bool = False           # more runs over policy than this pass was allowed to remove
+
+
+# run dirs are written once, so their size only needs to be measured once.
+# enforce() can run on the worker and on demand at the same time.
+_SIZES: Dict[str, int] = {}
+_SIZES_LOCK = threading.Lock()
+_LAST_REPORT: Optional[RetentionReport] = None
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def _run_bytes(run_id: str) -> int:
+    with _SIZES_LOCK:
+        size = _SIZES.get(run_id)
+    if size is None:
+        size = _dir_bytes(os.path.join(OUTPUT_DIR, run_id))  # walked outside the lock
+        with _SIZES_LOCK:
+            size = _SIZES.setdefault(run_id, size)
+    return size
+
+
+def _forget_size(run_id: str):
+    with _SIZES_LOCK:
+        _SIZES.pop(run_id, None)
+
+
+def _groups(rows: List[Dict]) -> List[List[Dict]]:
+    """
+    Rows grouped into eviction units, oldest first: a sweep parent with all its
+    cells, anything else on its own. Cells whose parent row is not in the index
+    form their own unit.
+    """
+    parents = {r["run_id"] for r in rows if not r.get("parent_run_id")}
+    children: Dict[str, List[Dict]] = {}
+    for r in rows:
+        if r.get("parent_run_id") in parents:
+            children.setdefault(r["parent_run_id"], []).append(r)
+    return [[r] + children.get(r["run_id"], []) for r in rows
+            if r.get("parent_run_id") not in parents]
+
+
+def _run_time(row: Dict) -> float:
+    try:
+        return time.mktime(time.strptime(row.get("timestamp") or "", "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        try:
+            return os.path.getmtime(os.path.join(OUTPUT_DIR, row["run_id"]))
+        except OSError:
+            return 0.0
+
+
+def _is_starred(run_id: str) -> bool:
+    meta = load_run_meta(run_id)
+    return bool(meta and meta.get("starred"))
+
+
+def enforce(policy: Optional[RetentionPolicy] = None, max_removals: Optional[int] = None) -> RetentionReport:
+    """
+    Evict the oldest runs until the outputs directory satisfies the policy,
+    removing at most max_removals runs, then compact the index atomically.
+    With a shared storage backend only the local copies are evicted: the runs
+    stay in the index and are read back through on demand.
+    """
+    global _LAST_REPORT
+    policy = policy or default_policy()
+    backend = get_backend()
+    t0 = time.perf_counter()
+    report = RetentionReport(timestamp=time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    rows = read_index()  # oldest first
+    local = {r.get("run_id") for r in rows if os.path.isdir(os.path.join(OUTPUT_DIR, r.get("run_id", "")))}
+    orphans: List[str] = []
+    units = []  # (row that dates the unit, its runs that are on disk here)
+    for group in _groups(rows):
+        if group[0]["run_id"] not in local and not backend.remote:
+            # the run is gone; a sweep's cells are only reachable through it, so they go too
+            orphans.extend(r["run_id"] for r in group)
+            for r in group[1:]:
+                if r["run_id"] in local:
+                    shutil.rmtree(os.path.join(OUTPUT_DIR, r["run_id"]), ignore_errors=True)
+                    _forget_size(r["run_id"])
+            continue
+        present = [r["run_id"] for r in group if r["run_id"] in local]  # remote: the rest is not cached here
+        if present:
+            units.append((group[0], present))
+    report.scanned = sum(len(ids) for _, ids in units)
+
+    total = sum(_run_bytes(rid) for _, ids in units for rid in ids)
+    cutoff = time.time() - policy.max_age_days * 86400 if policy.max_age_days > 0 else None
+    # a sweep and its cells are one unit: kept, protected and evicted together
+    newest = units[len(units) - policy.keep_last:] if policy.keep_last > 0 else []
+    protected = {rid for _, ids in newest for rid in ids}
+
+    for row, ids in units:
+        over_size = policy.max_bytes > 0 and total > policy.max_bytes
+        too_old = cutoff is not None and _run_time(row) < cutoff
+        if not (over_size or too_old):
+            if cutoff is None:
+                break  # oldest-first: once under the size cap nothing newer needs checking
+            continue
+        if any(rid in protected or (policy.keep_starred and _is_starred(rid)) or backend.pending(rid)
+               for rid in ids):
+            continue  # pending: the local copy is the only one until its upload finishes
+        if max_removals is not None and len(report.removed) >= max_removals:
+            report.pending = True
+            break
+
+        for rid in ids:
+            size = _run_bytes(rid)
+            t1 = time.perf_counter()
+            shutil.rmtree(os.path.join(OUTPUT_DIR, rid), ignore_errors=True)
+            dt = time.perf_counter() - t1
+            _forget_size(rid)
+
+            total -= size
+            report.removed.append(rid)
+            report.reclaimed_bytes += size
+            report.remove_seconds.append(round(dt, 4))
+            metrics.observe("aig_retention_remove_seconds", dt)
+
+    if (report.removed and not backend.remote) or orphans:
+        compact_index(report.removed + orphans)
+        get_similarity_index().compact(report.removed + orphans)
+
+    report.total_bytes = total
+    report.seconds = round(time.perf_counter() - t0, 4)
+
+    metrics.inc("aig_retention_removed_runs_total", len(report.removed))
+    metrics.inc("aig_retention_reclaimed_bytes_total", report.reclaimed_bytes)
+    metrics.set_gauge("aig_outputs_bytes", total)
+    if report.removed:
+        with open(REPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(report)) + "\n")
+
+    _LAST_REPORT = report
+    return report
+
+
+def last_report() -> Optional[RetentionReport]:
+    return _LAST_REPORT
+
+
+class RetentionWorker(threading.Thread):
+    """
+    Background enforcement in small batches so a large backlog of expired runs
+    never holds the index lock (and therefore save_run) for long.
+    """
+
+    def __init__(self, policy: RetentionPolicy, interval: float = RETENTION_INTERVAL, batch: int = RETENTION_BATCH):
+        super().__init__(daemon=True, name="retention")
+        self.policy = policy
+        self.interval = interval
+        self.batch = batch
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                report = enforce(self.policy, max_removals=self.batch)
+                delay = 1.0 if report.pending else self.interval
+            except Exception:
+                delay = self.interval
+            self._stop_event.wait(delay)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_background(policy: Optional[RetentionPolicy] = None) -> Optional[RetentionWorker]:
+    """
+    Start the retention worker if the policy has any limit configured.
+    """
+    policy = policy or default_policy()
+    if not policy.active:
+        return None
+    worker = RetentionWorker(policy)
+    worker.start()
+    return worker
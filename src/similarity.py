@@ -0,0 +1,317 @@
+import os, argparse, json, threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from . import metrics
+from .config import OUTPUT_DIR, SIMILARITY_DUP_DISTANCE
+from .locks import file_lock
+
+# Perceptual-hash index over every saved image. One fixed-size record per image
+# in outputs/similarity.bin (append-only, memory-mapped for reads):
+#
+#   run_id   S40    run the image belongs to
+#   image    u2     1-based image number within the run
+#   hash     u8     64-bit DCT perceptual hash (Hamming distance ~ visual difference)
+#   color    12xu1  mean RGB of a 2x2 grid (L2 tie-break: same layout, different palette)
+#
+# Records are never rewritten in place; retention compacts the file into a new
+# one and swaps it in, like generations.jsonl.
+
+INDEX_FILE = os.path.join(OUTPUT_DIR, "similarity.bin")
+RECORD = np.dtype([("run_id", "S40"), ("image", "<u2"), ("hash", "<u8"), ("color", "u1", (12,))])
+
+_HASH_SIZE, _LOW = 32, 8
+_k = np.arange(_HASH_SIZE)
+_DCT = np.sqrt(2.0 / _HASH_SIZE) * np.cos(np.pi * (2 * _k[None, :] + 1) * _k[:, None] / (2 * _HASH_SIZE))
+_DCT[0] /= np.sqrt(2.0)
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def image_hash(img: Image.Image) -> Tuple[int, np.ndarray]:
+    """
+    (64-bit pHash, 12-byte colour layout) of an image.
+    """
+    g = np.asarray(img.convert("L").resize((_HASH_SIZE, _HASH_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ g @ _DCT.T)[:_LOW, :_LOW].ravel()
+    bits = low > np.median(low[1:])  # DC term excluded from the threshold
+    h = int(np.packbits(bits).view(">u8")[0])
+    color = np.asarray(img.convert("RGB").resize((2, 2), Image.BOX), dtype=np.uint8).ravel()
+    return h, color
+
+
+def popcount64(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x).astype(np.int64)
+    return _POPCOUNT8[np.ascontiguousarray(x).view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+class SimilarityIndex:
+    """
+    Vectorised Hamming search over the record file. The columns are cached in
+    memory per (inode, size); appends only read the new tail, compaction
+    (new inode) reloads.
+    """
+
+    def __init__(self, path: str = INDEX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache = {"sig": None, "n": 0, "run_ids": np.empty(0, "S40"), "images": np.empty(0, "<u2"),
+                       "hashes": np.empty(0, "<u8"), "colors": np.empty((0, 12), "u1")}
+
+    # ----------------- writes -----------------
+    def add(self, run_id: str, images: Iterable[Image.Image]) -> int:
+        """
+        Hash and append a run's images (called from save_run).
+        """
+        with metrics.span("similarity_index"):
+            recs = np.array([(run_id.encode(), i, *image_hash(img)) for i, img in enumerate(images, 1)], RECORD)
+            if len(recs):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with self._lock, file_lock(self.path + ".lock"):
+                    with open(self.path, "ab") as f:
+                        f.write(recs.tobytes())  # whole records in one write; readers ignore a partial tail
+                        f.flush()
+            return len(recs)
+
+    def compact(self, drop_run_ids: Iterable[str]) -> int:
+        """
+        Atomically rewrite the file without the given runs. Returns the records kept.
+        """
+        drop = np.array([r.encode() for r in drop_run_ids], dtype="S40")
+        if not os.path.exists(self.path):
+            return 0
+        with self._lock, file_lock(self.path + ".lock"):
+            recs = self._memmap()
+            keep = recs[~np.isin(recs["run_id"], drop)] if len(drop) else recs
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(np.ascontiguousarray(keep).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            n = len(keep)
+            del recs, keep
+            os.replace(tmp, self.path)
+        return n
+
+    # ----------------- reads -----------------
+    def _memmap(self) -> np.ndarray:
+        try:
+            n = os.path.getsize(self.path) // RECORD.itemsize
+        except OSError:
+            n = 0
+        if n == 0:
+            return np.zeros(0, RECORD)
+        return np.memmap(self.path, dtype=RECORD, mode="r", shape=(n,))
+
+    def _columns(self) -> Dict:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            with self._lock:
+                return self._reset()
+        sig = (st.st_ino, st.st_size)
+        with self._lock:
+            c = self._cache
+            if c["sig"] == sig:
+                return c
+            if c["sig"] is None or c["sig"][0] != st.st_ino or st.st_size < c["sig"][1]:
+                c = self._reset()
+            recs = self._memmap()
+            tail = recs[c["n"]:]
+            if len(tail):
+                c["run_ids"] = np.concatenate([c["run_ids"], tail["run_id"]])
+                c["images"] = np.concatenate([c["images"], tail["image"]])
+                c["hashes"] = np.concatenate([c["hashes"], tail["hash"]])
+                c["colors"] = np.concatenate([c["colors"], tail["color"]])
+                c["n"] = len(recs)
+            c["sig"] = sig
+            return c
+
+    def _reset(self) -> Dict:
+        self._cache = {"sig": None, "n": 0, "run_ids": np.empty(0, "S40"), "images": np.empty(0, "<u2"),
+                       "hashes": np.empty(0, "<u8"), "colors": np.empty((0, 12), "u1")}
+        return self._cache
+
+    def __len__(self) -> int:
+        return self._columns()["n"]
+
+    def run_ids(self) -> set:
+        return {r.decode() for r in np.unique(self._columns()["run_ids"])}
+
+    def _rank(self, c: Dict, dist: np.ndarray, colors: List[np.ndarray], exclude: Optional[bytes],
+              k: int, max_distance: Optional[int]) -> List[Dict]:
+        ok = np.ones(len(dist), dtype=bool)
+        if exclude is not None:
+            ok &= c["run_ids"] != exclude
+        if max_distance is not None:
+            ok &= dist <= max_distance
+        idx = np.flatnonzero(ok)
+        if len(idx) > k:
+            # reduce to each run's best images before cutting to the k best runs, so a run
+            # with many near-identical images (inpaint masks x variants) cannot crowd others out
+            runs, inv = np.unique(c["run_ids"][idx], return_inverse=True)
+            best = np.full(len(runs), np.iinfo(np.int64).max, dtype=np.int64)
+            inv = inv.ravel()  # numpy 2.0.x shapes it like the input
+            np.minimum.at(best, inv, dist[idx])
+            keep = dist[idx] == best[inv]  # ties within a run are settled by colour below
+            if len(runs) > k:
+                keep &= best[inv] <= np.partition(best, k - 1)[k - 1]
+            idx = idx[keep]
+        # colour distance (to the closest query colour) only for the candidates
+        cand = c["colors"][idx].astype(np.float32)
+        color_d = np.min([np.linalg.norm(cand - q.astype(np.float32), axis=1) for q in colors], axis=0)
+        order = np.lexsort((color_d, dist[idx]))
+        idx, color_d = idx[order], color_d[order]
+
+        out, seen = [], set()
+        for i, cd in zip(idx, color_d):
+            rid = c["run_ids"][i].decode()
+            if rid in seen:
+                continue
+            seen.add(rid)
+            out.append({"run_id": rid, "image": int(c["images"][i]), "distance": int(dist[i]),
+                        "color_distance": float(cd)})
+            if len(out) >= k:
+                break
+        return out
+
+    def search(self, img: Image.Image, k: int = 10, max_distance: Optional[int] = None,
+               exclude_run_id: Optional[str] = None) -> List[Dict]:
+        """
+        Runs with an image closest to `img` (best match per run), nearest first.
+        """
+        h, color = image_hash(img)
+        return self.search_hash(h, color, k, max_distance, exclude_run_id)
+
+    def search_hash(self, h: int, color: np.ndarray, k: int = 10, max_distance: Optional[int] = None,
+                    exclude_run_id: Optional[str] = None) -> List[Dict]:
+        c = self._columns()
+        if not c["n"]:
+            return []
+        dist = popcount64(c["hashes"] ^ np.uint64(h))
+        return self._rank(c, dist, [color], exclude_run_id.encode() if exclude_run_id else None, k, max_distance)
+
+    def similar_to_run(self, run_id: str, k: int = 10, max_distance: Optional[int] = None) -> List[Dict]:
+        """
+        Other runs closest to any image of `run_id`, nearest first.
+        """
+        c = self._columns()
+        key = run_id.encode()
+        mine = np.flatnonzero(c["run_ids"] == key)
+        if not len(mine):
+            return []
+        dist = np.min([popcount64(c["hashes"] ^ c["hashes"][i]) for i in mine], axis=0)
+        return self._rank(c, dist, [c["colors"][i] for i in mine], key, k, max_distance)
+
+    def near_duplicates(self, max_distance: int = SIMILARITY_DUP_DISTANCE, same_run: bool = False,
+                        limit: Optional[int] = None) -> List[Dict]:
+        """
+        All image pairs within `max_distance` bits, closest first.
+        Multi-index hashing: the 64 bits are cut into max_distance+1 bands; any such
+        pair agrees exactly on at least one band, so only same-band buckets are compared.
+        """
+        c = self._columns()
+        n = c["n"]
+        if n < 2:
+            return []
+        hashes = c["hashes"]
+        found_i, found_j = [], []
+        for band in np.array_split(np.arange(64), min(64, max_distance + 1)):
+            width = np.uint64(len(band))
+            mask = np.uint64((1 << len(band)) - 1)
+            key = (hashes >> np.uint64(band[0])) & mask if width < 64 else hashes
+            order = np.argsort(key, kind="stable")
+            sk = key[order]
+            starts = np.flatnonzero(np.r_[True, sk[1:] != sk[:-1]])
+            ends = np.r_[starts[1:], n]
+            for s, e in zip(starts, ends):
+                if e - s < 2:
+                    continue
+                members = np.sort(order[s:e])
+                g = e - s
+                for r0 in range(0, g, 512):  # blocks of rows bound the memory of huge buckets (e.g. blank frames)
+                    rows = members[r0:r0 + 512]
+                    d = popcount64((hashes[rows][:, None] ^ hashes[members][None, :]).ravel()).reshape(len(rows), g)
+                    d[np.arange(g)[None, :] <= np.arange(r0, r0 + len(rows))[:, None]] = 64 + 1  # each pair once
+                    a, b = np.nonzero(d <= max_distance)
+                    found_i.append(rows[a])
+                    found_j.append(members[b])
+        if not found_i:
+            return []
+        pairs = np.unique(np.concatenate(found_i).astype(np.int64) * n + np.concatenate(found_j))
+        i, j = pairs // n, pairs % n
+        if not same_run:
+            keep = c["run_ids"][i] != c["run_ids"][j]
+            i, j = i[keep], j[keep]
+        d = popcount64(hashes[i] ^ hashes[j])
+        order = np.argsort(d, kind="stable")[:limit]
+        return [{"a": {"run_id": c["run_ids"][i[o]].decode(), "image": int(c["images"][i[o]])},
+                 "b": {"run_id": c["run_ids"][j[o]].decode(), "image": int(c["images"][j[o]])},
+                 "distance": int(d[o])} for o in order]
+
+    # ----------------- maintenance -----------------
+    def backfill(self) -> int:
+        """
+        Index runs saved before the index existed (or while it was disabled). Returns runs added.
+        """
+        from .storage import read_index, load_run_meta
+        have = self.run_ids()
+        added = 0
+        for row in read_index():
+            rid = row.get("run_id")
+            if not rid or rid in have:
+                continue
+            meta = load_run_meta(rid) or {}
+            images = []
+            for p in meta.get("image_paths") or []:
+                try:
+                    with Image.open(p) as im:
+                        images.append(im.convert("RGB"))
+                except OSError:
+                    continue
+            if images:
+                self.add(rid, images)
+                added += 1
+        return added
+
+
+_INDEX: Optional[SimilarityIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = SimilarityIndex()
+        return _INDEX
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Perceptual-hash index over outputs/")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("backfill", help="index runs that are not in the index yet")
+    p = sub.add_parser("similar", help="runs most similar to a run")
+    p.add_argument("run_id")
+    p.add_argument("-k", type=int, default=10)
+    p = sub.add_parser("duplicates", help="near-duplicate image pairs")
+    p.add_argument("--max-distance", type=int, default=SIMILARITY_DUP_DISTANCE)
+    p.add_argument("--same-run", action="store_true", help="also report pairs within one run")
+    p.add_argument("--limit", type=int, default=100)
+    args = ap.parse_args()
+
+    index = get_similarity_index()
+    if args.cmd == "backfill":
+        print(f"indexed {index.backfill()} runs ({len(index)} images)")
+    elif args.cmd == "similar":
+        for r in index.similar_to_run(args.run_id, args.k):
+            print(json.dumps(r))
+    else:
+        for r in index.near_duplicates(args.max_distance, args.same_run, args.limit):
+            print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import os, json, time, uuid, threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+from .. import metrics
+from ..locks import file_lock
+from ..lru import ByteLRU
+from ..config import BASE_DIR, OUTPUT_DIR, META_CACHE_ENTRIES, SIMILARITY_INDEX
+from ..image_codecs import OutputFormat, default_format, save_image
+from ..similarity import get_similarity_index
+from .backends import get_backend
+
+INDEX_FILE = os.path.join(OUTPUT_DIR, "generations.jsonl")
+
+# guards generations.jsonl: appends from save_run vs. rewrites from compact_index.
+# The thread lock covers this process, the lock file covers other app processes on the node
+# (it is a separate file because compaction replaces the index itself).
+_INDEX_LOCK = threading.Lock()
+_INDEX_LOCK_FILE = INDEX_FILE + ".lock"
+
+
+# Parsed index shared by every session in the process. It is reused while
+# generations.jsonl keeps the same (inode, mtime, size); when the file only grew
+# (appends), just the new tail is parsed. Compaction replaces the file, so the
+# inode changes and the next read starts over.
+_INDEX_CACHE = {"sig": None, "offset": 0, "rows": [], "top": []}
+_INDEX_CACHE_LOCK = threading.Lock()
+
+# meta.json by run_id, validated against the file's own mtime/size (starring rewrites it)
+_META_CACHE = ByteLRU(META_CACHE_ENTRIES, lambda _: 1)
+
+
+@contextmanager
+def _index_locked():
+    with _INDEX_LOCK, file_lock(_INDEX_LOCK_FILE):
+        yield
+
+def _ensure_dirs():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+def new_run_id() -> str:
+    return time.strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:8]
+
+def save_run(run_id: str, meta: Dict, images: List[Image.Image], control_preview: Optional[Image.Image] = None,
+             fmt: Optional[OutputFormat] = None, variants_preview: Optional[Image.Image] = None) -> str:
+    """
+    control_preview is the ControlNet conditioning image; variants_preview the
+    best-of-K contact sheet. Each gets its own file and meta.json path.
+    """
+    with metrics.span("save_run"):
+        run_dir, row = _save_run(run_id, meta, images, control_preview, fmt or default_format(), variants_preview)
+    # meta.json was written inside the span; store the timings again so they include save_run itself
+    timings = metrics.current()
+    if timings is not None:
+        _rewrite_meta(run_id, timings=timings.as_dict())
+    # mirror to shared storage off the request path (no-op for the local backend)
+    get_backend().submit_run(run_id, row)
+    return run_dir
+
+def _rewrite_meta(run_id: str, **updates):
+    meta_path = os.path.join(OUTPUT_DIR, run_id, "meta.json")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta.update(updates)
+    tmp = meta_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, meta_path)
+
+def _embedded_params(run_id: str, meta: Dict) -> Dict:
+    # what goes inside each image file, so it is self-describing without meta.json
+    agent = meta.get("agent", {})
+    return {
+        "run_id": run_id,
+        "mode": meta.get("mode"),
+        "style": agent.get("style"),
+        "prompt": agent.get("final_prompt"),
+        "negative_prompt": agent.get("final_negative_prompt"),
+        "settings": meta.get("settings", {}),
+    }
+
+def _save_run(run_id: str, meta: Dict, images: List[Image.Image], control_preview: Optional[Image.Image],
+              fmt: OutputFormat, variants_preview: Optional[Image.Image] = None) -> Tuple[str, Dict]:
+    _ensure_dirs()
+    run_dir = os.path.join(OUTPUT_DIR, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+
+    # save images
+    params = _embedded_params(run_id, meta)
+    with metrics.span("save_images"):
+        img_paths = []
+        for i, img in enumerate(images, 1):
+            img_paths.append(save_image(img, os.path.join(run_dir, f"image_{i}"), fmt, params))
+
+        control_path = None
+        if control_preview is not None:
+            control_path = save_image(control_preview, os.path.join(run_dir, "control_preview"), fmt)
+        variants_path = None
+        if variants_preview is not None:
+            variants_path = save_image(variants_preview, os.path.join(run_dir, "variants_preview"), fmt)
+
+    if SIMILARITY_INDEX:
+        get_similarity_index().add(run_id, images)
+
+    meta2 = dict(meta)
+    meta2["run_id"] = run_id
+    meta2["run_dir"] = run_dir
+    meta2["image_paths"] = img_paths
+    meta2["control_preview_path"] = control_path
+    if variants_path:
+        meta2["variants_preview_path"] = variants_path
+    meta2["output_format"] = fmt.as_dict()
+
+    timings = metrics.current()
+    if timings is not None:
+        meta2["timings"] = timings.as_dict()
+
+    # write meta.json inside run folder
+    with open(os.path.join(run_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta2, f, indent=2)
+
+    # append to global index
+    row = {
+        "run_id": run_id,
+        "timestamp": meta2.get("timestamp"),
+        "mode": meta2.get("mode"),
+        "style": meta2.get("agent", {}).get("style"),
+        "goal": meta2.get("agent", {}).get("goal") or meta2.get("goal"),
+        "run_dir": run_dir,
+    }
+    if meta2.get("parent_run_id"):
+        row["parent_run_id"] = meta2["parent_run_id"]
+    line = json.dumps(row, ensure_ascii=False) + "\n"
+    with _index_locked():
+        # one write() of a complete line in append mode, flushed before the lock is released
+        with open(INDEX_FILE, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+    return run_dir, row
+
+def save_sweep(run_id: str, meta: Dict, grid: Image.Image, cells: List[Dict]) -> str:
+    """
+    Save a sweep as one parent run (the labelled grid) plus one child run per cell.
+    cells: [{"image": PIL.Image, "settings": {...}, "agent": {...}, "cell": {"x": .., "y": ..}}, ...]
+    """
+    child_ids = []
+    for i, cell in enumerate(cells, 1):
+        cid = f"{run_id}_c{i:02d}"
+        child = dict(meta)
+        child.update({
+            "mode": meta.get("mode"),
+            "settings": cell["settings"],
+            "agent": cell.get("agent", meta.get("agent")),
+            "sweep_cell": cell.get("cell"),
+            "parent_run_id": run_id,
+        })
+        child.pop("sweep", None)
+        save_run(cid, child, [cell["image"]])
+        child_ids.append(cid)
+
+    parent = dict(meta)
+    parent["children"] = child_ids
+    return save_run(run_id, parent, [grid])
+
+def _parse_lines(data: bytes, rows: List[Dict]):
+    for line in data.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except:
+            pass
+
+def _refresh_index() -> Dict:
+    try:
+        st = os.stat(INDEX_FILE)
+    except FileNotFoundError:
+        st = None
+    sig = (st.st_ino, st.st_mtime_ns, st.st_size) if st else None
+
+    with _INDEX_CACHE_LOCK:
+        c = _INDEX_CACHE
+        if sig == c["sig"]:
+            return c
+        if sig is None:
+            c.update(sig=None, offset=0, rows=[], top=[])
+            return c
+
+        appended = c["sig"] is not None and c["sig"][0] == sig[0] and sig[2] >= c["offset"]
+        start = c["offset"] if appended else 0
+        rows = list(c["rows"]) if appended else []
+        with open(INDEX_FILE, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        # a line still being written by another process is picked up next time
+        end = data.rfind(b"\n") + 1
+        _parse_lines(data[:end], rows)
+
+        c.update(sig=sig, offset=start + end, rows=rows,
+                 top=[r for r in reversed(rows) if not r.get("parent_run_id")])
+        return c
+
+def append_index_rows(rows: List[Dict]):
+    """
+    Append already-stored runs (e.g. synced from shared storage) to the local index.
+    """
+    data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+    with _index_locked():
+        with open(INDEX_FILE, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+
+def read_index() -> List[Dict]:
+    """
+    All index rows, oldest first. Rows are shared with the cache: treat them as read-only.
+    """
+    _ensure_dirs()
+    return list(_refresh_index()["rows"])
+
+def load_index(limit: int = 50, include_children: bool = False) -> List[Dict]:
+    # newest first; sweep cells are reached through their parent run
+    _ensure_dirs()
+    c = _refresh_index()
+    if include_children:
+        return c["rows"][::-1][:limit]
+    return c["top"][:limit]
+
+def compact_index(drop_run_ids: Iterable[str]) -> int:
+    """
+    Atomically rewrite generations.jsonl without the given runs (and without
+    unparseable lines). Returns the number of rows kept.
+    """
+    drop = set(drop_run_ids)
+    with _index_locked():
+        rows = [r for r in read_index() if r.get("run_id") not in drop]
+        tmp = INDEX_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, INDEX_FILE)
+    return len(rows)
+
+def localize_paths(meta: Dict, run_dir: str) -> Dict:
+    """
+    Point meta.json's file paths (written on whichever node saved the run) into run_dir.
+    """
+    meta["run_dir"] = run_dir
+    meta["image_paths"] = [os.path.join(run_dir, os.path.basename(p)) for p in meta.get("image_paths") or []]
+    for key in ("control_preview_path", "variants_preview_path"):
+        if meta.get(key):
+            meta[key] = os.path.join(run_dir, os.path.basename(meta[key]))
+    return meta
+
+def run_file_paths(meta: Dict) -> List[str]:
+    """
+    Every image file meta.json points at (outputs and previews).
+    """
+    return [p for p in (meta.get("image_paths") or []) + [meta.get("control_preview_path"),
+                                                           meta.get("variants_preview_path")] if p]
+
+def load_run_meta(run_id: str) -> Optional[Dict]:
+    """
+    meta.json of a run (None if it is gone). Cached; the returned dict is a
+    shallow copy, so only replace top-level keys on it.
+    """
+    meta_path = os.path.join(OUTPUT_DIR, run_id, "meta.json")
+    try:
+        st = os.stat(meta_path)
+    except OSError:
+        # read-through: runs from other nodes (or evicted locally) come from shared storage
+        if not get_backend().fetch(meta_path):
+            return None
+        st = os.stat(meta_path)
+
+    def _load():
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # paths are node-local; point them at this node's copy (fetched on first read)
+        return localize_paths(meta, os.path.join(OUTPUT_DIR, run_id))
+
+    meta = _META_CACHE.get_or_create((run_id, st.st_mtime_ns, st.st_size), _load)
+    return dict(meta)
+
+def set_starred(run_id: str, starred: bool = True) -> bool:
+    """
+    Mark a run as starred in its meta.json (starred runs survive retention).
+    """
+    meta = load_run_meta(run_id)
+    if meta is None:
+        return False
+    meta["starred"] = bool(starred)
+    meta_path = os.path.join(OUTPUT_DIR, run_id, "meta.json")
+    tmp = meta_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, meta_path)
+    get_backend().submit_file(meta_path)
+    return True
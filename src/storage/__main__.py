@@ -0,0 +1,60 @@
+"""
+Storage maintenance.
+
+    python -m src.storage check                      # round trip against the configured S3-compatible store
+    python -m src.storage sync                       # pull other nodes' index rows once
+    python -m src.storage export out.tar [filters]   # stream runs into a bundle ("-" = stdout)
+    python -m src.storage import out.tar             # merge a bundle ("-" = stdin); re-run to resume
+"""
+import argparse, json, sys
+
+from .backends import check, get_backend
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m src.storage", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("check", help="upload, list, download and delete a probe (AIG_S3_* settings)")
+    sub.add_parser("sync", help="append index rows uploaded by other nodes to generations.jsonl")
+
+    ex = sub.add_parser("export", help="stream selected runs into a tar bundle")
+    ex.add_argument("dest", help="bundle path, or - for stdout")
+    ex.add_argument("--since", help="first day, YYYY-MM-DD (inclusive)")
+    ex.add_argument("--until", help="last day, YYYY-MM-DD (inclusive)")
+    ex.add_argument("--mode", action="append", default=[], help="e.g. Text-to-Image (repeatable)")
+    ex.add_argument("--style", action="append", default=[], help="e.g. Anime (repeatable)")
+    ex.add_argument("--run-id", action="append", default=[], help="only these runs (repeatable)")
+
+    im = sub.add_parser("import", help="merge a bundle into outputs/ and the index")
+    im.add_argument("src", help="bundle path, or - for stdin")
+    im.add_argument("--no-similarity", action="store_true", help="skip perceptual hashing of imported runs")
+    args = ap.parse_args()
+
+    if args.cmd == "check":
+        try:
+            check()
+        except RuntimeError as e:
+            sys.exit(f"check failed: {e}")
+    elif args.cmd == "sync":
+        print(f"synced {get_backend().sync_index()} rows")
+    elif args.cmd == "export":
+        from .bundles import select_runs, export_bundle
+        filters = {"since": args.since, "until": args.until, "modes": args.mode, "styles": args.style,
+                   "run_ids": args.run_id}
+        rows = select_runs(**filters)
+        if args.dest == "-":
+            summary = export_bundle(sys.stdout.buffer, rows, filters)
+        else:
+            with open(args.dest, "wb") as f:
+                summary = export_bundle(f, rows, filters)
+        print(json.dumps(summary), file=sys.stderr)  # stdout may be the bundle
+    elif args.cmd == "import":
+        from .bundles import import_bundle
+        summary = import_bundle(args.src, index_similarity=not args.no_similarity)
+        counts = {k: len(v) if isinstance(v, list) else v for k, v in summary.items()}
+        print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Where runs live beyond this node.
+
+outputs/ is always the write path and the local cache: save_run writes there
+and returns immediately. A backend then mirrors each run (files first, its
+index row last) and pulls other nodes' runs on demand:
+
+  local  outputs/ is the store; every operation is a no-op
+  s3     any S3-compatible object store (AWS, MinIO, Ceph, moto...):
+           <prefix><run_id>/<file>      run files, concurrent multipart uploads
+           <prefix>index/<run_id>.json  index rows, synced into generations.jsonl
+         meta.json and images of remote runs are fetched on first read
+
+Uploads run on background threads and are journaled in outputs/.storage/, so
+a restart resumes whatever was still pending.
+
+    python -m src.storage check   # round-trip against the configured store
+"""
+import os, json, time, shutil, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set
+
+from .. import metrics
+from ..config import (
+    OUTPUT_DIR, STORAGE_BACKEND, S3_BUCKET, S3_PREFIX, S3_ENDPOINT, S3_REGION,
+    STORAGE_UPLOAD_CONCURRENCY, STORAGE_PART_SIZE, STORAGE_SYNC_INTERVAL, STORAGE_SYNC_LAG,
+)
+from ..locks import file_lock
+
+STATE_DIR = os.path.join(OUTPUT_DIR, ".storage")
+JOURNAL_FILE = os.path.join(STATE_DIR, "uploads.jsonl")
+CURSOR_FILE = os.path.join(STATE_DIR, "index_cursor")
+INDEX_PREFIX = "index/"
+
+
+class StorageBackend:
+    """
+    Local filesystem: outputs/ is the only copy, so there is nothing to mirror or fetch.
+    """
+    remote = False
+
+    def submit_run(self, run_id: str, row: Optional[Dict] = None):
+        """
+        Mirror a run that was just written to outputs/<run_id>/ (non-blocking).
+        row is its index row, if the caller has it at hand.
+        """
+
+    def submit_file(self, path: str):
+        """
+        Mirror one rewritten file of a run (e.g. meta.json after starring).
+        """
+
+    def fetch(self, path: str) -> bool:
+        """
+        Make sure outputs/<run_id>/<file> exists locally. True if it does afterwards.
+        """
+        return os.path.exists(path)
+
+    def pending(self, run_id: str) -> bool:
+        """
+        True while the run is not fully mirrored (its local copy must not be evicted).
+        """
+        return False
+
+    def sync_index(self) -> int:
+        """
+        Pull index rows written by other nodes. Returns the number of new rows.
+        """
+        return 0
+
+    def stats(self) -> Dict:
+        return {"backend": "local"}
+
+
+def _rel(path: str) -> str:
+    return os.path.relpath(path, OUTPUT_DIR).replace(os.sep, "/")
+
+
+class S3Backend(StorageBackend):
+    remote = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, concurrency: int = 8, part_size: int = 8 << 20,
+                 sync_interval: float = 30.0, sync_lag: float = 600.0, retries: int = 3,
+                 retry_delay: float = 2.0):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("AIG_STORAGE_BACKEND=s3 needs boto3 (pip install boto3)") from e
+        if not bucket:
+            raise RuntimeError("AIG_STORAGE_BACKEND=s3 needs AIG_S3_BUCKET")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self._s3 = boto3.client(
+            "s3", endpoint_url=endpoint_url or None, region_name=region or None,
+            config=Config(max_pool_connections=2 * concurrency, retries={"max_attempts": 5, "mode": "standard"}),
+        )
+        # files over part_size go up as concurrent multipart uploads
+        self._transfer = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                        max_concurrency=concurrency, use_threads=True)
+        self._files = ThreadPoolExecutor(concurrency, thread_name_prefix="storage-file")
+        self._runs = ThreadPoolExecutor(2, thread_name_prefix="storage-run")  # orchestration only
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._failed: Set[str] = set()  # out of retries; still pending, retried every sync interval
+        self._rows: Dict[str, Optional[Dict]] = {}  # index rows of pending runs, uploaded last
+        self._retries, self._retry_delay = retries, retry_delay
+        self._stats = {"uploaded_runs": 0, "uploaded_bytes": 0, "failed_runs": 0, "fetched_files": 0,
+                       "synced_rows": 0}
+        self._sync_interval, self._sync_lag = sync_interval, sync_lag
+        os.makedirs(STATE_DIR, exist_ok=True)
+        self._resume()
+        if sync_interval > 0:
+            threading.Thread(target=self._sync_loop, daemon=True, name="storage-sync").start()
+
+    # ----------------- object primitives -----------------
+    def _key(self, rel: str) -> str:
+        return self.prefix + rel
+
+    def _missing(self, e) -> bool:
+        code = str(getattr(e, "response", {}).get("Error", {}).get("Code", ""))
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def upload_file(self, local: str, rel: str):
+        self._s3.upload_file(local, self.bucket, self._key(rel), Config=self._transfer)
+
+    def put_bytes(self, rel: str, data: bytes):
+        self._s3.put_object(Bucket=self.bucket, Key=self._key(rel), Body=data)
+
+    def get_bytes(self, rel: str) -> Optional[bytes]:
+        try:
+            return self._s3.get_object(Bucket=self.bucket, Key=self._key(rel))["Body"].read()
+        except Exception as e:
+            if self._missing(e):
+                return None
+            raise
+
+    def download_file(self, rel: str, local: str) -> bool:
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(local), suffix=".part")
+        os.close(fd)
+        try:
+            self._s3.download_file(self.bucket, self._key(rel), tmp, Config=self._transfer)
+            os.replace(tmp, local)  # readers never see a partial file
+            return True
+        except Exception as e:
+            if self._missing(e):
+                return False
+            raise
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def list_keys(self, rel_prefix: str, start_after: str = "") -> Iterator[str]:
+        pages = self._s3.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=self._key(rel_prefix),
+            **({"StartAfter": self._key(start_after)} if start_after else {}))
+        for page in pages:
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):]
+
+    def delete(self, rels: List[str]):
+        for i in range(0, len(rels), 1000):
+            self._s3.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": self._key(r)} for r in rels[i:i + 1000]]})
+
+    # ----------------- uploads -----------------
+    def _journal(self, op: str, run_id: str):
+        with file_lock(JOURNAL_FILE + ".lock"), open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": op, "run_id": run_id, "t": time.time()}) + "\n")
+
+    def _resume(self):
+        try:
+            with open(JOURNAL_FILE, encoding="utf-8") as f:
+                ops = [json.loads(l) for l in f if l.strip()]
+        except (OSError, ValueError):
+            return
+        todo: Dict[str, bool] = {}
+        for o in ops:
+            if o["op"] == "queued":
+                todo[o["run_id"]] = True
+            else:
+                todo.pop(o["run_id"], None)
+        with file_lock(JOURNAL_FILE + ".lock"), open(JOURNAL_FILE, "w", encoding="utf-8") as f:
+            for rid in todo:  # compacted: only what is still pending
+                f.write(json.dumps({"op": "queued", "run_id": rid, "t": time.time()}) + "\n")
+        if todo:
+            from . import read_index
+            rows = {r.get("run_id"): r for r in read_index()}  # one pass, not one per run
+            for rid in todo:
+                if os.path.isdir(os.path.join(OUTPUT_DIR, rid)):
+                    self._enqueue(rid, rows.get(rid))
+
+    def submit_run(self, run_id: str, row: Optional[Dict] = None):
+        if row is None:
+            from . import read_index
+            row = next((r for r in reversed(read_index()) if r.get("run_id") == run_id), None)
+        self._journal("queued", run_id)
+        self._enqueue(run_id, row)
+
+    def _enqueue(self, run_id: str, row: Optional[Dict]):
+        with self._lock:
+            self._pending[run_id] = self._pending.get(run_id, 0) + 1
+            self._rows[run_id] = row
+            metrics.set_gauge("aig_storage_pending_runs", len(self._pending))
+        self._runs.submit(self._upload_run, run_id)
+
+    def submit_file(self, path: str):
+        self._files.submit(self._upload_one, path, _rel(path))
+
+    def _upload_one(self, path: str, rel: str) -> int:
+        self.upload_file(path, rel)
+        return os.path.getsize(path)
+
+    def _upload_run(self, run_id: str, attempt: int = 1):
+        t0 = time.perf_counter()
+        run_dir = os.path.join(OUTPUT_DIR, run_id)
+        try:
+            files = [os.path.join(root, fn) for root, _, fns in os.walk(run_dir) for fn in fns
+                     if not fn.endswith((".tmp", ".part"))]
+            futures = [self._files.submit(self._upload_one, p, _rel(p)) for p in files]
+            done, _ = wait(futures)
+            size = sum(f.result() for f in done)  # re-raises the first failed upload
+            # the index row goes last: other nodes never see a run whose files are not there yet
+            with self._lock:
+                row = self._rows.get(run_id)
+            if row is not None:
+                row = {k: v for k, v in row.items() if k != "run_dir"}  # node-local path
+                self.put_bytes(f"{INDEX_PREFIX}{run_id}.json", json.dumps(row, ensure_ascii=False).encode())
+        except Exception:
+            if attempt < self._retries:
+                # back off on a timer, not on this worker: the other runs in the queue keep going
+                t = threading.Timer(self._retry_delay * 2 ** (attempt - 1), self._runs.submit,
+                                    (self._upload_run, run_id, attempt + 1))
+                t.daemon = True
+                t.start()
+                return
+            metrics.inc("aig_storage_uploads_total", outcome="failed")
+            with self._lock:
+                self._stats["failed_runs"] += 1
+                if self._pending.get(run_id, 0) > 1:
+                    self._done(run_id)  # another submission of the same run is still queued
+                else:
+                    # still pending, so retention keeps the only copy; stays "queued" in the journal
+                    self._failed.add(run_id)
+            return
+        dt = time.perf_counter() - t0
+        self._journal("done", run_id)
+        metrics.inc("aig_storage_uploads_total", outcome="ok")
+        metrics.observe("aig_storage_upload_seconds", dt)
+        with self._lock:
+            self._stats["uploaded_runs"] += 1
+            self._stats["uploaded_bytes"] += size
+            self._failed.discard(run_id)
+            self._done(run_id)
+
+    def retry_failed(self) -> int:
+        """
+        Queue the runs that ran out of retries again. Returns how many.
+        """
+        with self._lock:
+            runs, self._failed = sorted(self._failed), set()
+        for rid in runs:
+            self._runs.submit(self._upload_run, rid)
+        return len(runs)
+
+    def _done(self, run_id: str):
+        n = self._pending.get(run_id, 0) - 1
+        if n > 0:
+            self._pending[run_id] = n
+        else:
+            self._pending.pop(run_id, None)
+            self._rows.pop(run_id, None)
+        metrics.set_gauge("aig_storage_pending_runs", len(self._pending))
+
+    def pending(self, run_id: str) -> bool:
+        with self._lock:
+            return run_id in self._pending
+
+    def flush(self, timeout: float = 600.0) -> bool:
+        """
+        Wait for pending uploads (tests, shutdown). True if none are left; returns
+        False early once everything still pending has run out of retries.
+        """
+        end = time.time() + timeout
+        while time.time() < end:
+            with self._lock:
+                if not self._pending:
+                    return True
+                if set(self._pending) <= self._failed:
+                    return False
+            time.sleep(0.05)
+        return False
+
+    # ----------------- reads -----------------
+    def fetch(self, path: str) -> bool:
+        if os.path.exists(path):
+            return True
+        rel = _rel(path)
+        if rel.startswith(".."):
+            return False  # not under outputs/
+        t0 = time.perf_counter()
+        try:
+            ok = self.download_file(rel, path)
+        except Exception:
+            metrics.inc("aig_storage_fetch_errors_total")
+            return False  # store unreachable: treated like a missing file
+        if ok:
+            metrics.observe("aig_storage_fetch_seconds", time.perf_counter() - t0)
+            with self._lock:
+                self._stats["fetched_files"] += 1
+        return ok
+
+    # ----------------- index sync -----------------
+    def sync_index(self) -> int:
+        """
+        Append index rows uploaded by other nodes to the local generations.jsonl.
+        Run ids start with their timestamp, so listing resumes shortly before the
+        newest row seen (the lag covers clock skew and slow uploads).
+        """
+        from . import read_index, append_index_rows
+        try:
+            with open(CURSOR_FILE, encoding="utf-8") as f:
+                cursor = f.read().strip()
+        except OSError:
+            cursor = ""
+        start_after = ""
+        if cursor:
+            t = time.mktime(time.strptime(cursor[:15], "%Y%m%d_%H%M%S")) - self._sync_lag
+            start_after = INDEX_PREFIX + time.strftime("%Y%m%d_%H%M%S", time.localtime(t))
+
+        have = {r.get("run_id") for r in read_index()}
+        new_keys = [k for k in self.list_keys(INDEX_PREFIX, start_after)
+                    if k[len(INDEX_PREFIX):-len(".json")] not in have]
+        rows = [r for r in self._files.map(self._index_row, new_keys) if r]
+        for r in rows:
+            r["run_dir"] = os.path.join(OUTPUT_DIR, r["run_id"])
+        if rows:
+            rows.sort(key=lambda r: r["run_id"])
+            append_index_rows(rows)
+            latest = rows[-1]["run_id"]
+            if latest > cursor:
+                with open(CURSOR_FILE, "w", encoding="utf-8") as f:
+                    f.write(latest)
+            with self._lock:
+                self._stats["synced_rows"] += len(rows)
+        return len(rows)
+
+    def _index_row(self, key: str) -> Optional[Dict]:
+        data = self.get_bytes(key)
+        try:
+            return json.loads(data) if data else None
+        except ValueError:
+            return None
+
+    def _sync_loop(self):
+        while True:
+            self.retry_failed()
+            try:
+                self.sync_index()
+            except Exception:
+                metrics.inc("aig_storage_sync_errors_total")
+            time.sleep(self._sync_interval)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, backend="s3", bucket=self.bucket, prefix=self.prefix,
+                        pending_runs=len(self._pending), failed_pending=len(self._failed))
+
+
+_BACKEND: Optional[StorageBackend] = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            kind = STORAGE_BACKEND.lower()
+            if kind == "s3":
+                _BACKEND = S3Backend(S3_BUCKET, S3_PREFIX, S3_ENDPOINT, S3_REGION, STORAGE_UPLOAD_CONCURRENCY,
+                                     STORAGE_PART_SIZE, STORAGE_SYNC_INTERVAL, STORAGE_SYNC_LAG)
+            elif kind == "local":
+                _BACKEND = StorageBackend()
+            else:
+                raise RuntimeError(f"unknown AIG_STORAGE_BACKEND {STORAGE_BACKEND!r} (local | s3)")
+        return _BACKEND
+
+
+def check():
+    """
+    Round trip against the configured store: a small object, a multipart
+    upload, listing, download and delete. Raises RuntimeError on the first mismatch.
+    """
+    b = S3Backend(S3_BUCKET, S3_PREFIX, S3_ENDPOINT, S3_REGION, STORAGE_UPLOAD_CONCURRENCY,
+                  STORAGE_PART_SIZE, sync_interval=0)
+    probe = f"_check/{int(time.time())}"
+    tmp = tempfile.mkdtemp(prefix="aig_storage_check_")
+    try:
+        src = os.path.join(tmp, "big.bin")
+        with open(src, "wb") as f:
+            f.write(os.urandom(3 * STORAGE_PART_SIZE + 1))
+        t0 = time.perf_counter()
+        b.upload_file(src, f"{probe}/big.bin")
+        up = time.perf_counter() - t0
+        b.put_bytes(f"{probe}/small.json", b'{"ok": true}')
+        keys = sorted(b.list_keys(probe + "/"))
+        if keys != [f"{probe}/big.bin", f"{probe}/small.json"]:
+            raise RuntimeError(f"listing returned {keys}")
+        dst = os.path.join(tmp, "back.bin")
+        if not b.download_file(f"{probe}/big.bin", dst):
+            raise RuntimeError("uploaded object is missing")
+        with open(src, "rb") as f1, open(dst, "rb") as f2:
+            if f1.read() != f2.read():
+                raise RuntimeError("multipart round trip differs")
+        if b.get_bytes(f"{probe}/small.json") != b'{"ok": true}':
+            raise RuntimeError("small object round trip differs")
+        if b.get_bytes(f"{probe}/absent") is not None:
+            raise RuntimeError("a missing key did not read as missing")
+        b.delete(keys)
+        print(f"ok: {keys} · {os.path.getsize(src) / 2**20 / up:.1f} MiB/s multipart upload")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
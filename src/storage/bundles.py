@@ -0,0 +1,485 @@
+"""
+Run bundles: move history between nodes as one streamed tar archive.
+
+    python -m src.storage export history.tar --since 2026-01-01 --mode Text-to-Image --style Anime
+    python -m src.storage import history.tar
+    python -m src.storage export - | ssh other-node "cd app && python -m src.storage import -"
+
+Layout (plain tar, images are already compressed):
+
+  bundle.json                  format, bundle id, filters, the run ids that follow
+  runs/<run_id>/<file>         every file of the run, streamed from disk
+  runs/<run_id>.manifest.json  the run's index row, size + sha256 per file, content hash
+  checksums.sha256             sha256sum -c compatible list of every file
+
+Files are copied in large chunks and hashed on the way through, so nothing is
+held in memory beyond one buffer. Import verifies each run against its manifest,
+skips runs whose run_id or image content is already here, and moves the run into
+outputs/ atomically. It journals its progress: re-running an interrupted import
+of a bundle file seeks past the runs already merged.
+"""
+import os, io, json, time, shutil, hashlib, re, tarfile, queue, threading
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from .. import metrics
+from ..config import OUTPUT_DIR, SIMILARITY_INDEX
+from ..locks import file_lock
+from . import read_index, append_index_rows, load_run_meta, localize_paths, run_file_paths
+from .backends import STATE_DIR, get_backend
+
+FORMAT = "aig-bundle"
+VERSION = 1
+CHUNK = 1 << 20
+IMPORT_DIR = os.path.join(OUTPUT_DIR, ".import")
+CONTENT_HASHES = os.path.join(STATE_DIR, "content_hashes.json")
+
+_RUN_ID = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+
+def _is_content(name: str) -> bool:
+    # what makes two runs the same: their images, not meta.json (which holds node-local paths)
+    base = os.path.basename(name)
+    return base.startswith(("image_", "control_preview"))
+
+
+def content_hash(file_hashes: Dict[str, str]) -> str:
+    h = hashlib.sha256()
+    for name in sorted(n for n in file_hashes if _is_content(n)):
+        h.update(f"{os.path.basename(name)}\0{file_hashes[name]}\n".encode())
+    return h.hexdigest()
+
+
+class _Hasher:
+    """
+    One background thread that hashes what the copy loops hand it. hashlib releases
+    the GIL on large buffers, so hashing overlaps the reads and writes instead of
+    adding to them. Updates are applied in submission order.
+    """
+
+    def __init__(self):
+        self._q: "queue.Queue" = queue.Queue(maxsize=8)
+        threading.Thread(target=self._run, name="bundle-hash", daemon=True).start()
+
+    def _run(self):
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            item[0].update(item[1])
+            self._q.task_done()
+
+    def update(self, sha, data: bytes):
+        self._q.put((sha, data))
+
+    def hexdigest(self, sha) -> str:
+        self._q.join()
+        return sha.hexdigest()
+
+    def close(self):
+        self._q.put(None)
+
+
+class _HashingReader:
+    """
+    File wrapper that hashes whatever tarfile reads through it.
+    """
+
+    def __init__(self, f: BinaryIO, hasher: _Hasher):
+        self._f = f
+        self._hasher = hasher
+        self._sha = hashlib.sha256()
+
+    def read(self, n: int = -1) -> bytes:
+        data = self._f.read(n)
+        if data:
+            self._hasher.update(self._sha, data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest(self._sha)
+
+
+class _Sink:
+    """
+    Lets TarFile write in plain "w" mode to a pipe: it only needs tell(). The
+    streaming "w|" mode re-buffers every block through bytes concatenation, which
+    costs more than the disk and the hashing together.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._pos = 0
+
+    def write(self, data) -> int:
+        self._f.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class _Source:
+    """
+    Lets TarFile read in plain "r:" mode from a pipe: seeking forward reads and drops.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._pos = 0
+
+    def read(self, n: int = -1) -> bytes:
+        data = self._f.read(n)
+        self._pos += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence != 0 or pos < self._pos:
+            raise OSError("cannot seek backwards in a stream")
+        while self._pos < pos and self.read(min(CHUNK, pos - self._pos)):
+            pass
+        return self._pos
+
+
+# ----------------- selection -----------------
+def _row_date(row: Dict) -> str:
+    ts = row.get("timestamp") or ""
+    if len(ts) >= 10:
+        return ts[:10]
+    rid = row.get("run_id", "")
+    return f"{rid[:4]}-{rid[4:6]}-{rid[6:8]}" if rid[:8].isdigit() else ""
+
+
+def select_runs(since: Optional[str] = None, until: Optional[str] = None, modes: Iterable[str] = (),
+                styles: Iterable[str] = (), run_ids: Iterable[str] = ()) -> List[Dict]:
+    """
+    Index rows matching every given filter (dates are inclusive YYYY-MM-DD), oldest
+    first. Sweep cells come along with their parent run.
+    """
+    modes = {m.lower() for m in modes}
+    styles = {s.lower() for s in styles}
+    run_ids = set(run_ids)
+    rows = read_index()
+    picked = []
+    for r in rows:
+        if r.get("parent_run_id"):
+            continue
+        d = _row_date(r)
+        if (since and d < since) or (until and d > until):
+            continue
+        if modes and str(r.get("mode", "")).lower() not in modes:
+            continue
+        if styles and str(r.get("style", "")).lower() not in styles:
+            continue
+        if run_ids and r.get("run_id") not in run_ids:
+            continue
+        picked.append(r)
+    parents = {r["run_id"] for r in picked}
+    children = [r for r in rows if r.get("parent_run_id") in parents]
+    return picked + children
+
+
+def _run_files(run_id: str) -> List[Tuple[str, str]]:
+    """
+    (path on disk, name inside the run) for every file of a run; remote-only runs are fetched first.
+    """
+    run_dir = os.path.join(OUTPUT_DIR, run_id)
+    if not os.path.isdir(run_dir):
+        meta = load_run_meta(run_id)  # read-through from shared storage, if any
+        if meta is None:
+            return []
+        backend = get_backend()
+        for p in run_file_paths(meta):
+            backend.fetch(p)
+    out = []
+    for root, _, fns in os.walk(run_dir):
+        for fn in sorted(fns):
+            if fn.endswith((".tmp", ".part")):
+                continue
+            path = os.path.join(root, fn)
+            out.append((path, os.path.relpath(path, run_dir).replace(os.sep, "/")))
+    return out
+
+
+# ----------------- export -----------------
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def export_bundle(dest: BinaryIO, rows: List[Dict], filters: Optional[Dict] = None) -> Dict:
+    """
+    Stream the given runs into a tar written to `dest` (a file or a pipe). Returns a summary.
+    """
+    t0 = time.perf_counter()
+    bundle_id = time.strftime("%Y%m%d_%H%M%S") + "_" + hashlib.sha256(
+        "".join(r["run_id"] for r in rows).encode()).hexdigest()[:8]
+    summary = {"bundle_id": bundle_id, "runs": 0, "files": 0, "bytes": 0, "missing": []}
+    checksums = []
+    hasher = _Hasher()
+    try:
+        with tarfile.open(fileobj=_Sink(dest), mode="w", copybufsize=CHUNK, format=tarfile.PAX_FORMAT) as tar:
+            header = {"format": FORMAT, "version": VERSION, "bundle_id": bundle_id,
+                      "created": time.strftime("%Y-%m-%d %H:%M:%S"), "filters": filters or {},
+                      "runs": [r["run_id"] for r in rows]}
+            _add_bytes(tar, "bundle.json", json.dumps(header, indent=2).encode())
+
+            for row in rows:
+                rid = row["run_id"]
+                files = _run_files(rid)
+                if not files:
+                    summary["missing"].append(rid)
+                    continue
+                hashes, sizes = {}, {}
+                for path, name in files:
+                    arcname = f"runs/{rid}/{name}"
+                    with open(path, "rb") as f:
+                        info = tar.gettarinfo(arcname=arcname, fileobj=f)
+                        reader = _HashingReader(f, hasher)
+                        tar.addfile(info, reader)
+                    hashes[name], sizes[name] = reader.hexdigest(), info.size
+                    checksums.append(f"{hashes[name]}  {arcname}")
+                    summary["bytes"] += info.size
+                    summary["files"] += 1
+                manifest = {
+                    "row": {k: v for k, v in row.items() if k != "run_dir"},
+                    "files": [{"name": n, "size": sizes[n], "sha256": hashes[n]} for n in hashes],
+                    "content_hash": content_hash(hashes),
+                }
+                _add_bytes(tar, f"runs/{rid}.manifest.json", json.dumps(manifest).encode())
+                summary["runs"] += 1
+
+            _add_bytes(tar, "checksums.sha256", ("\n".join(checksums) + "\n").encode())
+    finally:
+        hasher.close()
+
+    summary["seconds"] = round(time.perf_counter() - t0, 3)
+    summary["mb_per_s"] = round(summary["bytes"] / 2**20 / max(summary["seconds"], 1e-9), 1)
+    metrics.inc("aig_bundle_bytes_total", summary["bytes"], direction="export")
+    return summary
+
+
+# ----------------- import -----------------
+def _local_content_hashes(rows: List[Dict]) -> Dict[str, str]:
+    """
+    content hash -> run_id for the local runs, hashed once and remembered in outputs/.storage/.
+    """
+    try:
+        with open(CONTENT_HASHES, encoding="utf-8") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+    changed = False
+    for r in rows:
+        rid = r.get("run_id")
+        if not rid or rid in known:
+            continue
+        run_dir = os.path.join(OUTPUT_DIR, rid)
+        if not os.path.isdir(run_dir):
+            continue  # remote-only: identified by run_id
+        hashes = {}
+        for fn in os.listdir(run_dir):
+            if _is_content(fn):
+                sha = hashlib.sha256()
+                with open(os.path.join(run_dir, fn), "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK), b""):
+                        sha.update(chunk)
+                hashes[fn] = sha.hexdigest()
+        known[rid] = content_hash(hashes)
+        changed = True
+    if changed:
+        _save_content_hashes(known)
+    # runs dropped from the index since (retention, another import's cleanup) no longer count
+    return {known[r["run_id"]]: r["run_id"] for r in rows if r.get("run_id") in known}
+
+
+def _save_content_hashes(known: Dict[str, str]):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp = CONTENT_HASHES + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(known, f)
+    os.replace(tmp, CONTENT_HASHES)
+
+
+def _remember_content_hash(run_id: str, digest: str):
+    try:
+        with open(CONTENT_HASHES, encoding="utf-8") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+    known[run_id] = digest
+    _save_content_hashes(known)
+
+
+def _safe_member(name: str) -> Optional[Tuple[str, str]]:
+    # runs/<run_id>/<relative path> -> (run_id, relative path); None for anything that could escape
+    parts = name.split("/")
+    if len(parts) < 3 or parts[0] != "runs" or not _RUN_ID.match(parts[1]):
+        return None
+    rel = parts[2:]
+    if any(p in ("", ".", "..") for p in rel) or os.path.isabs("/".join(rel)):
+        return None
+    return parts[1], "/".join(rel)
+
+
+def _read_header(path: str) -> Dict:
+    with tarfile.open(path, mode="r:") as tar:
+        member = tar.firstmember
+        if member is None or member.name != "bundle.json":
+            raise ValueError(f"{path} is not a run bundle (no bundle.json first)")
+        return json.load(tar.extractfile(member))
+
+
+class _Journal:
+    """
+    Per-bundle import progress: finished run ids and the archive offset after the last one.
+    """
+
+    def __init__(self, bundle_id: str):
+        os.makedirs(IMPORT_DIR, exist_ok=True)
+        self.path = os.path.join(IMPORT_DIR, f"{bundle_id}.journal.jsonl")
+        self.done: Dict[str, str] = {}
+        self.offset = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    self.done[e["run_id"]] = e["status"]
+                    self.offset = max(self.offset, e.get("offset", 0))
+        except OSError:
+            pass
+
+    def record(self, run_id: str, status: str, offset: int):
+        self.done[run_id] = status
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"run_id": run_id, "status": status, "offset": offset}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def import_bundle(src: str, index_similarity: bool = SIMILARITY_INDEX) -> Dict:
+    """
+    Merge a bundle (a path, or "-" for stdin) into outputs/ and the local index.
+    Returns a summary with per-run outcomes (imported, duplicate_run_id, duplicate_content, corrupt).
+    """
+    t0 = time.perf_counter()
+    seekable = src != "-"
+    header = _read_header(src) if seekable else None
+    journal = _Journal(header["bundle_id"]) if header else None
+    summary = {"imported": [], "duplicate_run_id": [], "duplicate_content": [], "corrupt": [], "bytes": 0,
+               "resumed_at": 0, "resumed_runs": 0}
+
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    with file_lock(IMPORT_DIR + ".lock"):
+        if header:
+            shutil.rmtree(os.path.join(IMPORT_DIR, header["bundle_id"]), ignore_errors=True)  # torn staging
+        rows = read_index()
+        have_ids = {r.get("run_id") for r in rows}
+        have_content = _local_content_hashes(rows)
+
+        hasher = _Hasher()
+        f = open(src, "rb") if seekable else os.fdopen(os.dup(0), "rb")
+        try:
+            if journal and journal.offset:
+                f.seek(journal.offset)  # members start on block boundaries; continue after the last merged run
+                summary["resumed_at"] = journal.offset
+                summary["resumed_runs"] = len(journal.done)
+            with tarfile.open(fileobj=f if seekable else _Source(f), mode="r:") as tar:
+                staged: Dict[str, Dict[str, Tuple[int, str]]] = {}
+                for member in tar:
+                    if member.name == "bundle.json":
+                        if header is None:
+                            header = json.load(tar.extractfile(member))
+                            journal = _Journal(header["bundle_id"])
+                            shutil.rmtree(os.path.join(IMPORT_DIR, header["bundle_id"]), ignore_errors=True)
+                        continue
+                    if header is None:
+                        raise ValueError("not a run bundle (no bundle.json first)")
+                    staging_root = os.path.join(IMPORT_DIR, header["bundle_id"])
+
+                    if member.name.endswith(".manifest.json") and member.name.startswith("runs/"):
+                        rid = member.name[len("runs/"):-len(".manifest.json")]
+                        if not _RUN_ID.match(rid):
+                            continue
+                        manifest = json.load(tar.extractfile(member))
+                        outcome = _merge_run(rid, manifest, staged.pop(rid, {}), staging_root, have_ids,
+                                             have_content)
+                        summary[outcome].append(rid)
+                        if outcome == "imported":
+                            have_ids.add(rid)
+                            have_content[manifest["content_hash"]] = rid
+                            summary["bytes"] += sum(x["size"] for x in manifest["files"])
+                        journal.record(rid, outcome, tar.offset)
+                        continue
+
+                    parsed = _safe_member(member.name) if member.isfile() else None
+                    if parsed is None:
+                        continue
+                    rid, rel = parsed
+                    if rid in have_ids or journal.done.get(rid) == "duplicate_content":
+                        continue  # skipped: tarfile seeks past the data
+                    dest = os.path.join(staging_root, rid, *rel.split("/"))
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    reader = _HashingReader(tar.extractfile(member), hasher)
+                    with open(dest, "wb") as out:
+                        shutil.copyfileobj(reader, out, CHUNK)
+                    staged.setdefault(rid, {})[rel] = (member.size, reader.hexdigest())
+        finally:
+            f.close()
+            hasher.close()
+
+        if header:
+            shutil.rmtree(os.path.join(IMPORT_DIR, header["bundle_id"]), ignore_errors=True)
+
+    summary["seconds"] = round(time.perf_counter() - t0, 3)
+    summary["mb_per_s"] = round(summary["bytes"] / 2**20 / max(summary["seconds"], 1e-9), 1)
+    metrics.inc("aig_bundle_bytes_total", summary["bytes"], direction="import")
+
+    if index_similarity and summary["imported"]:
+        from ..similarity import get_similarity_index
+        t1 = time.perf_counter()
+        summary["similarity_indexed"] = get_similarity_index().backfill()
+        summary["similarity_seconds"] = round(time.perf_counter() - t1, 3)
+    return summary
+
+
+def _merge_run(rid: str, manifest: Dict, staged: Dict[str, Tuple[int, str]], staging_root: str,
+               have_ids: set, have_content: Dict[str, str]) -> str:
+    run_stage = os.path.join(staging_root, rid)
+    try:
+        if rid in have_ids:
+            return "duplicate_run_id"
+        if manifest["content_hash"] in have_content:
+            return "duplicate_content"
+        expected = {x["name"]: (x["size"], x["sha256"]) for x in manifest["files"]}
+        if staged != expected:
+            return "corrupt"
+
+        # meta.json paths point at the exporting node; rewrite them for this one
+        run_dir = os.path.join(OUTPUT_DIR, rid)
+        meta_path = os.path.join(run_stage, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            localize_paths(meta, run_dir)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+
+        if os.path.exists(run_dir):
+            shutil.rmtree(run_dir)  # leftovers of a run that never made it into the index
+        os.replace(run_stage, run_dir)
+        row = dict(manifest["row"], run_dir=run_dir)
+        append_index_rows([row])
+        _remember_content_hash(rid, manifest["content_hash"])
+        get_backend().submit_run(rid, row)
+        return "imported"
+    finally:
+        shutil.rmtree(run_stage, ignore_errors=True)
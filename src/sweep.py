@@ -0,0 +1,174 @@
+import random
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from PIL import Image, ImageDraw, ImageFont
+
+from .agent_loop import run_agent_loop
+from .presets import STYLE_PRESETS
+from .pipeline_sdxl import get_txt2img, _device
+from .callbacks import step_kwargs
+from .metrics import span
+from .config import SWEEP_MAX_CELLS, SWEEP_MAX_BATCH
+
+AXIS_PARAMS = {"seed": int, "guidance": float, "steps": int, "style": str}
+
+
+def parse_axis(param: str, text: str) -> List:
+    """
+    "1, 2, 3" -> [1, 2, 3] typed for the parameter. Styles match STYLE_PRESETS case-insensitively.
+    """
+    cast = AXIS_PARAMS[param]
+    values = []
+    for raw in (text or "").split(","):
+        raw = raw.strip()
+        if not raw:
+            continue
+        if param == "style":
+            match = next((s for s in STYLE_PRESETS if s.lower() == raw.lower()), None)
+            if match is None:
+                raise ValueError(f"Unknown style '{raw}'. Choose from: {', '.join(STYLE_PRESETS)}")
+            values.append(match)
+        else:
+            values.append(cast(float(raw)) if cast is int else cast(raw))
+    if not values:
+        raise ValueError(f"No values given for the {param} axis.")
+    return values
+
+
+@dataclass
+class SweepCell:
+    x: int
+    y: int
+    seed: int
+    guidance: float
+    steps: int
+    style: str
+    agent: Dict
+    prompt: str
+    negative: str
+    image: Optional[Image.Image] = field(default=None, repr=False)
+
+    def settings(self, base: Dict) -> Dict:
+        s = dict(base)
+        s.update({"seed": self.seed, "guidance": self.guidance, "steps": self.steps, "num_images": 1})
+        return s
+
+
+def plan_cells(goal: str, prompt: str, negative: str, agent: Dict, settings: Dict,
+               x_axis: Tuple[str, List], y_axis: Optional[Tuple[str, List]] = None) -> List[SweepCell]:
+    """
+    One cell per (x, y) combination. The agent loop runs once per distinct
+    style; every other parameter reuses the prompts it was given.
+    """
+    y_axis = y_axis or (None, [None])
+    n = len(x_axis[1]) * len(y_axis[1])
+    if n > SWEEP_MAX_CELLS:
+        raise ValueError(f"Sweep has {n} cells; the limit is {SWEEP_MAX_CELLS}.")
+
+    base_seed = int(settings["seed"])
+    if base_seed < 0:
+        base_seed = random.randrange(2 ** 31)  # fixed for the whole grid so cells stay comparable
+
+    agents = {agent.get("style"): (agent, prompt, negative)}
+    cells = []
+    for yi, yv in enumerate(y_axis[1]):
+        for xi, xv in enumerate(x_axis[1]):
+            p = {"seed": base_seed, "guidance": float(settings["guidance"]),
+                 "steps": int(settings["steps"]), "style": agent.get("style")}
+            p[x_axis[0]] = xv
+            if y_axis[0]:
+                p[y_axis[0]] = yv
+            if p["style"] not in agents:
+                a = run_agent_loop(goal, style=p["style"])
+                agents[p["style"]] = (a, a["final_prompt"], a["final_negative_prompt"])
+            a, pr, ng = agents[p["style"]]
+            cells.append(SweepCell(xi, yi, int(p["seed"]), float(p["guidance"]), int(p["steps"]),
+                                   p["style"], a, pr, ng))
+    return cells
+
+
+@torch.no_grad()
+def _encode(pipe, prompt: str, negative: str):
+    return pipe.encode_prompt(
+        prompt=prompt,
+        device=pipe._execution_device,
+        num_images_per_prompt=1,
+        do_classifier_free_guidance=True,
+        negative_prompt=negative,
+    )
+
+
+def render_cells(cells: List[SweepCell], width: int, height: int) -> List[SweepCell]:
+    """
+    Encode each distinct prompt once, then denoise every group of cells that
+    shares (steps, guidance) in as few batched pipeline calls as possible.
+    """
+    pipe = get_txt2img()
+
+    embeds = {}
+    with span("sweep.encode"):
+        for c in cells:
+            key = (c.prompt, c.negative)
+            if key not in embeds:
+                embeds[key] = _encode(pipe, c.prompt, c.negative)
+
+    groups = defaultdict(list)
+    for c in cells:
+        groups[(c.steps, c.guidance)].append(c)
+
+    for (steps, guidance), group in groups.items():
+        for i in range(0, len(group), SWEEP_MAX_BATCH):
+            chunk = group[i:i + SWEEP_MAX_BATCH]
+            pe, npe, ppe, nppe = (torch.cat([embeds[(c.prompt, c.negative)][k] for c in chunk]) for k in range(4))
+            # per-cell generators: each image matches a single run with that seed
+            gens = [torch.Generator(device=_device()).manual_seed(c.seed) for c in chunk]
+            with span("pipeline.sweep"):
+                out = pipe(
+                    prompt_embeds=pe,
+                    negative_prompt_embeds=npe,
+                    pooled_prompt_embeds=ppe,
+                    negative_pooled_prompt_embeds=nppe,
+                    width=width,
+                    height=height,
+                    num_inference_steps=steps,
+                    guidance_scale=guidance,
+                    generator=gens,
+                    **step_kwargs(pipe),
+                )
+            for c, img in zip(chunk, out.images):
+                c.image = img
+    return cells
+
+
+def _label(value) -> str:
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def make_grid(cells: List[SweepCell], x_axis: Tuple[str, List], y_axis: Optional[Tuple[str, List]] = None,
+              cell_size: int = 384) -> Image.Image:
+    """
+    Labelled contact sheet: x values across the top, y values down the left.
+    """
+    cols = len(x_axis[1])
+    rows = len(y_axis[1]) if y_axis else 1
+    font = ImageFont.load_default()
+    top = 28
+    left = 120 if y_axis else 0
+
+    w0, h0 = cells[0].image.size
+    scale = cell_size / max(w0, h0)
+    cw, ch = int(w0 * scale), int(h0 * scale)
+
+    grid = Image.new("RGB", (left + cols * cw, top + rows * ch), "white")
+    draw = ImageDraw.Draw(grid)
+    for xi, xv in enumerate(x_axis[1]):
+        draw.text((left + xi * cw + 6, 8), f"{x_axis[0]}={_label(xv)}", fill="black", font=font)
+    if y_axis:
+        for yi, yv in enumerate(y_axis[1]):
+            draw.text((6, top + yi * ch + ch // 2), f"{y_axis[0]}={_label(yv)}", fill="black", font=font)
+    for c in cells:
+        grid.paste(c.image.resize((cw, ch), Image.LANCZOS), (left + c.x * cw, top + c.y * ch))
+    return grid
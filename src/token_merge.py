@@ -0,0 +1,176 @@
+import contextvars, math, threading, types
+from contextlib import contextmanager
+from typing import Callable, Tuple
+
+import torch
+
+# Token merging (ToMe for Stable Diffusion, Bolya & Hoffman 2023) on the UNet
+# self-attention layers: before attention, the `ratio` most redundant tokens are
+# averaged into similar ones, and after attention the result is copied back out.
+# The patch is installed once on the shared UNet and is inert unless a call runs
+# inside `token_merging(ratio)`, so requests with and without it can share the model.
+
+_RATIO: contextvars.ContextVar = contextvars.ContextVar("token_merge_ratio", default=0.0)
+_PATCH_LOCK = threading.Lock()
+
+# only blocks at most this many times below the latent resolution are merged;
+# for SDXL that is the 4096-token (at 1024²) level, where attention costs the most
+MAX_DOWNSAMPLE = 2
+STRIDE = (2, 2)  # one destination token per 2x2 patch
+
+
+def _identity(x):
+    return x
+
+
+def bipartite_soft_matching_2d(metric: torch.Tensor, h: int, w: int, r: int,
+                               stride: Tuple[int, int] = STRIDE, seed: int = 0) -> Tuple[Callable, Callable]:
+    """
+    merge/unmerge functions that remove `r` of the N = h*w tokens in `metric` (B, N, C).
+    One destination per stride patch (picked with a fixed-seed generator, so a
+    request's own RNG and reproducibility are untouched); every other token is a
+    source and the r most similar sources are averaged into their best destination.
+    """
+    B, N, _ = metric.shape
+    if r <= 0:
+        return _identity, _identity
+    sy, sx = stride
+    hsy, wsx = h // sy, w // sx
+    dev = metric.device
+
+    with torch.no_grad():
+        gen = torch.Generator(device="cpu").manual_seed(seed)
+        rand = torch.randint(sy * sx, (hsy, wsx, 1), generator=gen).to(dev)
+        view = torch.zeros(hsy, wsx, sy * sx, device=dev, dtype=torch.int64)
+        view.scatter_(2, rand, -torch.ones_like(rand))
+        view = view.view(hsy, wsx, sy, sx).transpose(1, 2).reshape(hsy * sy, wsx * sx)
+        if hsy * sy < h or wsx * sx < w:
+            buf = torch.zeros(h, w, device=dev, dtype=torch.int64)
+            buf[:hsy * sy, :wsx * sx] = view
+        else:
+            buf = view
+        order = buf.reshape(1, -1, 1).argsort(dim=1)  # destinations (-1) first
+        num_dst = hsy * wsx
+        a_idx, b_idx = order[:, num_dst:, :], order[:, :num_dst, :]
+
+        def split(x):
+            c = x.shape[-1]
+            src = torch.gather(x, 1, a_idx.expand(B, N - num_dst, c))
+            dst = torch.gather(x, 1, b_idx.expand(B, num_dst, c))
+            return src, dst
+
+        m = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = split(m)
+        scores = a @ b.transpose(-1, -2)
+        r = min(a.shape[1], r)
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx, src_idx = edge_idx[..., r:, :], edge_idx[..., :r, :]
+        dst_idx = torch.gather(node_idx[..., None], -2, src_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        src, dst = split(x)
+        n, t1, c = src.shape
+        unm = torch.gather(src, -2, unm_idx.expand(n, t1 - r, c))
+        src = torch.gather(src, -2, src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[..., :unm_len, :], x[..., unm_len:, :]
+        c = unm.shape[-1]
+        src = torch.gather(dst, -2, dst_idx.expand(B, r, c))
+        out = torch.zeros(B, N, c, device=x.device, dtype=x.dtype)
+        out.scatter_(-2, b_idx.expand(B, num_dst, c), dst)
+        a_full = a_idx.expand(B, a_idx.shape[1], 1)
+        out.scatter_(-2, torch.gather(a_full, 1, unm_idx).expand(B, unm_len, c), unm)
+        out.scatter_(-2, torch.gather(a_full, 1, src_idx).expand(B, r, c), src)
+        return out
+
+    return merge, unmerge
+
+
+def _patched_forward(self, hidden_states, encoder_hidden_states=None, attention_mask=None, **kwargs):
+    original = type(self).forward
+    ratio = _RATIO.get()
+    hw = self._aig_tome_state.get("hw")
+    if ratio <= 0 or hw is None or encoder_hidden_states is not None or hidden_states.dim() != 3:
+        return original(self, hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+
+    H, W = hw
+    n = hidden_states.shape[1]
+    ds = int(round(math.sqrt(H * W / n)))
+    if ds > MAX_DOWNSAMPLE:
+        return original(self, hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+
+    h, w = math.ceil(H / ds), math.ceil(W / ds)
+    merge, unmerge = bipartite_soft_matching_2d(hidden_states, h, w, int(n * ratio))
+    out = original(self, merge(hidden_states), None, attention_mask, **kwargs)
+    return unmerge(out)
+
+
+def _self_attention_layers(unet):
+    for name, module in unet.named_modules():
+        # diffusers BasicTransformerBlock: attn1 = self-attention, attn2 = cross-attention
+        if name.endswith("attn1"):
+            yield module
+
+
+def apply_patch(unet) -> int:
+    """
+    Install token merging on every self-attention layer of `unet`. Idempotent.
+    Returns the number of patched layers.
+    """
+    with _PATCH_LOCK:
+        if getattr(unet, "_aig_tome_state", None) is not None:
+            return unet._aig_tome_state["layers"]
+        state = {"hw": None, "layers": 0}
+
+        def _pre(module, args, kwargs):
+            sample = args[0] if args else kwargs.get("sample")
+            state["hw"] = tuple(sample.shape[-2:])
+
+        state["hook"] = unet.register_forward_pre_hook(_pre, with_kwargs=True)
+        for attn in _self_attention_layers(unet):
+            attn._aig_tome_state = state
+            attn.forward = types.MethodType(_patched_forward, attn)
+            state["layers"] += 1
+        unet._aig_tome_state = state
+        return state["layers"]
+
+
+def remove_patch(unet) -> int:
+    """
+    Undo apply_patch: restores the original attention forwards and removes the hook.
+    """
+    with _PATCH_LOCK:
+        state = getattr(unet, "_aig_tome_state", None)
+        if state is None:
+            return 0
+        state["hook"].remove()
+        n = 0
+        for attn in _self_attention_layers(unet):
+            if "forward" in attn.__dict__:
+                del attn.forward
+                del attn._aig_tome_state
+                n += 1
+        del unet._aig_tome_state
+        return n
+
+
+@contextmanager
+def token_merging(ratio: float):
+    """
+    Merge `ratio` (0..0.75) of the tokens in the high-resolution self-attention
+    layers for pipeline calls made inside this block. 0 = off.
+    """
+    ratio = max(0.0, min(0.75, float(ratio or 0.0)))
+    if ratio > 0:
+        from .model_loader import load_components
+        apply_patch(load_components()["unet"])
+    token = _RATIO.set(ratio)
+    try:
+        yield ratio
+    finally:
+        _RATIO.reset(token)
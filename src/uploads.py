@@ -0,0 +1,89 @@
+import hashlib, io
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from .config import UPLOAD_CACHE_BYTES, UPLOAD_MAX_SIDE, UPLOAD_PREVIEW_SIDE
+from .lru import ByteLRU
+
+# Uploaded references / bases / masks. Streamlit hands the script the same
+# upload on every rerun; it is hashed once, decoded once into a normalised copy
+# (EXIF orientation applied, converted, capped at UPLOAD_MAX_SIDE), and the
+# browser only gets a small preview. Pipelines receive an `Upload`, whose key
+# doubles as the cache key for control preprocessing and VAE latents.
+
+_DECODED = ByteLRU(UPLOAD_CACHE_BYTES, lambda im: im.width * im.height * len(im.getbands()))
+_PREVIEWS = ByteLRU(UPLOAD_CACHE_BYTES // 16, len)
+_DIGESTS = ByteLRU(4096, lambda _: 1)  # streamlit file_id -> content hash
+
+
+@dataclass(frozen=True)
+class Upload:
+    key: str                             # content hash + normalisation, stable across reruns and sessions
+    name: str = ""
+    mode: str = "RGB"
+    data: bytes = field(default=b"", repr=False, compare=False)  # the upload itself, to re-decode after eviction
+
+    @property
+    def image(self) -> Image.Image:
+        """
+        The decoded, normalised image (shared; do not modify it in place).
+        """
+        return _DECODED.get_or_create(self.key, self._decode)
+
+    def _decode(self) -> Image.Image:
+        im = Image.open(io.BytesIO(self.data))
+        im = ImageOps.exif_transpose(im)  # phone photos store rotation as a tag
+        im = im.convert(self.mode)
+        if UPLOAD_MAX_SIDE and max(im.size) > UPLOAD_MAX_SIDE:
+            im.thumbnail((UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE), Image.LANCZOS)
+        return im
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    def preview(self, max_side: int = UPLOAD_PREVIEW_SIDE) -> bytes:
+        """
+        JPEG bytes of a downscaled copy, for st.image.
+        """
+        def _make():
+            im = self.image.convert("RGB")
+            im.thumbnail((max_side, max_side))
+            buf = io.BytesIO()
+            im.save(buf, format="JPEG", quality=85)
+            return buf.getvalue()
+
+        return _PREVIEWS.get_or_create((self.key, max_side), _make)
+
+
+def from_uploaded(up, mode: str = "RGB") -> Optional[Upload]:
+    """
+    Upload for a streamlit UploadedFile (None if nothing was uploaded).
+    """
+    if up is None:
+        return None
+    data = up.getvalue()
+    file_id = getattr(up, "file_id", None)
+    digest = _DIGESTS.get(file_id) if file_id else None
+    if digest is None:
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if file_id:
+            _DIGESTS.put(file_id, digest)
+    return Upload(f"{digest}:{mode}:{UPLOAD_MAX_SIDE}", getattr(up, "name", ""), mode, data)
+
+
+def resolve(image: Union[Upload, Image.Image, None]) -> Tuple[Optional[Image.Image], Optional[str]]:
+    """
+    (PIL image, cache key) for pipeline inputs that may be an Upload or a plain image
+    (plain images have no key; the caches hash their pixels instead).
+    """
+    if isinstance(image, Upload):
+        return image.image, image.key
+    return image, None
+
+
+def cache_stats() -> dict:
+    return {"entries": len(_DECODED), "bytes": _DECODED.bytes, "max_bytes": _DECODED.max_bytes,
+            "hits": _DECODED.hits, "misses": _DECODED.misses}
@@ -1,7 +1,11 @@
 import io
+import os
+import mimetypes
 import zipfile
 from PIL import Image
 
+mimetypes.add_type("image/webp", ".webp")  # missing from older mimetypes tables
+
 def pil_to_bytes(img: Image.Image, fmt="PNG") -> bytes:
     buf = io.BytesIO() #Create an in-memory byte buffer
     img.save(buf, format=fmt)
@@ -13,4 +17,21 @@ def zip_images(images):
         for i, img in enumerate(images, 1):
             zf.writestr(f"image_{i}.png", pil_to_bytes(img))
     buf.seek(0) #Reset buffer position to beginning
-    return buf.getvalue()
\ No newline at end of file
+    return buf.getvalue()
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def mime_for(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+def zip_files(paths):
+    # already-encoded outputs go in as-is (stored, not re-compressed)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for p in paths:
+            if os.path.exists(p):
+                zf.write(p, arcname=os.path.basename(p))
+    buf.seek(0)
+    return buf.getvalue()
@@ -0,0 +1,62 @@
+import os, sys
+
+import pytest
+
+# the app runs from the repo root (streamlit run app.py), so `src` is imported as a top-level package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def llm_stub():
+    """
+    Start the stub LLM server on a free port: llm_stub(delay=..., fail_every=..., chunked=..., keep_alive=...)
+    returns its /v1 base URL. Servers are shut down after the test.
+    """
+    from src import llm_stub as stub
+    servers = []
+
+    def _start(**kwargs):
+        server = stub.serve(0, background=True, **kwargs)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield _start
+    for s in servers:
+        s.shutdown()
+        s.server_close()
+
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    """
+    An empty outputs/ under tmp_path for storage, retention, similarity and bundles,
+    with the local storage backend. Needs numpy and Pillow (the similarity index).
+    """
+    pytest.importorskip("numpy")
+    pytest.importorskip("PIL")
+    from src import retention, similarity, storage
+    from src.storage import backends, bundles
+
+    out = str(tmp_path / "outputs")
+    state = os.path.join(out, ".storage")
+    for mod in (storage, backends, retention, similarity, bundles):
+        monkeypatch.setattr(mod, "OUTPUT_DIR", out)
+    monkeypatch.setattr(storage, "INDEX_FILE", os.path.join(out, "generations.jsonl"))
+    monkeypatch.setattr(storage, "_INDEX_LOCK_FILE", os.path.join(out, "generations.jsonl.lock"))
+    monkeypatch.setattr(storage, "_INDEX_CACHE", {"sig": None, "offset": 0, "rows": [], "top": []})
+    monkeypatch.setattr(backends, "STATE_DIR", state)
+    monkeypatch.setattr(backends, "JOURNAL_FILE", os.path.join(state, "uploads.jsonl"))
+    monkeypatch.setattr(backends, "CURSOR_FILE", os.path.join(state, "index_cursor"))
+    monkeypatch.setattr(bundles, "STATE_DIR", state)
+    monkeypatch.setattr(bundles, "IMPORT_DIR", os.path.join(out, ".import"))
+    monkeypatch.setattr(bundles, "CONTENT_HASHES", os.path.join(state, "content_hashes.json"))
+    monkeypatch.setattr(retention, "REPORT_FILE", os.path.join(out, "retention.jsonl"))
+    monkeypatch.setattr(retention, "_SIZES", {})
+    monkeypatch.setattr(similarity, "_INDEX", similarity.SimilarityIndex(os.path.join(out, "similarity.bin")))
+    local = backends.StorageBackend()
+    for mod in (storage, retention, bundles):
+        monkeypatch.setattr(mod, "get_backend", lambda: local)
+    os.makedirs(out)
+    return out
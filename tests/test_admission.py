@@ -0,0 +1,126 @@
+import threading, time
+
+from src.admission import AdmissionController, classify
+
+
+def admit_in_thread(ctl, order, name, **kwargs):
+    """
+    Start a job that records its name once admitted and holds the slot until released.
+    Returns (thread, release event).
+    """
+    go = threading.Event()
+
+    def _job():
+        with ctl.admit(poll=0.05, **kwargs):
+            order.append(name)
+            go.wait(5)
+
+    t = threading.Thread(target=_job)
+    t.start()
+    return t, go
+
+
+def wait_for(cond, timeout=5.0):
+    end = time.time() + timeout
+    while not cond() and time.time() < end:
+        time.sleep(0.01)
+    return cond()
+
+
+# ----------------- admission -----------------
+def test_limit_and_fifo_order():
+    ctl, order = AdmissionController(limit=1), []
+    jobs = [admit_in_thread(ctl, order, "a")]
+    assert wait_for(lambda: order == ["a"])
+    for name in "bcd":
+        jobs.append(admit_in_thread(ctl, order, name))
+        assert wait_for(lambda: ctl.queue_depth() == len(jobs) - 1)  # arrival order is fixed
+    for t, go in jobs:
+        go.set()
+        t.join(5)
+    assert order == ["a", "b", "c", "d"]
+    assert ctl.queue_depth() == 0
+
+
+def test_positions_and_estimated_wait():
+    ctl = AdmissionController(limit=2)
+    running = [ctl.enqueue() for _ in range(2)]
+    for t in running:
+        assert ctl.wait(t, timeout=0)
+    queued = [ctl.enqueue() for _ in range(3)]
+    assert [ctl.position(t) for t in queued] == [0, 1, 2]
+    assert not ctl.wait(queued[0], timeout=0.01)
+    # two slots: the third queued job waits for a second round
+    assert ctl.estimated_wait(queued[2]) > ctl.estimated_wait(queued[1])
+    ctl.release(running[0])
+    assert ctl.wait(queued[0], timeout=0)
+    assert not ctl.wait(queued[2], timeout=0)  # not at the head yet
+    ctl.release(queued[1])  # gave up while queued
+    assert ctl.position(queued[2]) == 0
+    for t in (running[1], queued[0], queued[2]):
+        ctl.release(t)
+
+
+def test_shared_slots_across_controllers(tmp_path):
+    # two processes on one node, each with its own controller: one lock file per slot
+    a = AdmissionController(limit=1, shared=True, lock_dir=str(tmp_path))
+    b = AdmissionController(limit=1, shared=True, lock_dir=str(tmp_path))
+    ta = a.enqueue()
+    assert a.wait(ta, timeout=0)
+    tb = b.enqueue()
+    assert not b.wait(tb, timeout=0.3)
+    a.release(ta)
+    assert b.wait(tb, timeout=1.0)
+    b.release(tb)
+
+
+# ----------------- priority classes -----------------
+def test_interactive_jobs_queue_ahead_of_batch():
+    ctl = AdmissionController(limit=1)
+    running = ctl.enqueue("batch")
+    assert ctl.wait(running, timeout=0)
+    b1, i1, b2, i2 = ctl.enqueue("batch"), ctl.enqueue(), ctl.enqueue("batch"), ctl.enqueue("interactive")
+    assert [ctl.position(t) for t in (i1, i2, b1, b2)] == [0, 1, 2, 3]
+    assert ctl.enqueue("bogus").priority == "interactive"  # unknown classes are treated as the most urgent
+
+
+def test_classify_by_cost():
+    assert classify(20) == "interactive"
+    assert classify(50, num_images=4, width=1536, height=1536) == "batch"
+
+
+def test_batch_job_yields_and_resumes_ahead_of_later_batch():
+    ctl = AdmissionController(limit=1)
+    batch = ctl.enqueue("batch")
+    assert ctl.wait(batch, timeout=0)
+    assert ctl.preemptible(batch)
+    assert not ctl.should_yield(batch)  # nothing more urgent is waiting
+    later = ctl.enqueue("batch")
+    assert not ctl.should_yield(batch)  # same class: no preemption
+    urgent = ctl.enqueue("interactive")
+    assert ctl.should_yield(batch)
+
+    suspended = []
+    t = threading.Thread(target=lambda: suspended.append(ctl.suspend(batch)))
+    t.start()
+    assert ctl.wait(urgent, timeout=2)
+    assert ctl.position(batch) == 0 and ctl.position(later) == 1  # back ahead of the later arrival
+    ctl.release(urgent)
+    t.join(2)
+    assert suspended and batch.preemptions == 1 and batch.suspended_seconds == suspended[0]
+    assert not ctl.wait(later, timeout=0)
+    ctl.release(batch)
+    assert ctl.wait(later, timeout=0)
+    ctl.release(later)
+
+    stats = ctl.latency_stats()
+    assert stats["batch"]["count"] == 2 and stats["interactive"]["count"] == 1
+    assert stats["batch"]["p50"] is not None
+
+
+def test_no_preemption_when_disabled():
+    ctl = AdmissionController(limit=1, preemption=False)
+    batch = ctl.enqueue("batch")
+    assert ctl.wait(batch, timeout=0)
+    ctl.enqueue("interactive")
+    assert not ctl.preemptible(batch) and not ctl.should_yield(batch)
@@ -0,0 +1,129 @@
+import io, os, shutil, tarfile
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+from PIL import Image
+
+from src import storage
+from src.storage import bundles
+from src.storage.bundles import export_bundle, import_bundle, select_runs
+
+
+def add_runs(*specs):
+    """
+    (run_id, colour) pairs saved as one-image runs.
+    """
+    for rid, colour in specs:
+        storage.save_run(rid, {"mode": "Text-to-Image", "timestamp": "2020-01-01 00:00:00"},
+                         [Image.new("RGB", (8, 8), colour)])
+
+
+def export(tmp_path, name="history.tar"):
+    path = str(tmp_path / name)
+    with open(path, "wb") as f:
+        summary = export_bundle(f, select_runs())
+    return path, summary
+
+
+def forget_local(outputs):
+    # as if the bundle were imported on another node
+    ids = [r["run_id"] for r in storage.read_index()]
+    storage.compact_index(ids)
+    for rid in ids:
+        shutil.rmtree(os.path.join(outputs, rid))
+
+
+def index_ids():
+    return [r["run_id"] for r in storage.read_index()]
+
+
+@pytest.mark.parametrize("name,expected", [
+    ("runs/r1/image_1.png", ("r1", "image_1.png")),
+    ("runs/r1/sub/x.png", ("r1", "sub/x.png")),
+    ("runs/r1/../r2/image_1.png", None),
+    ("runs/../etc/passwd", None),
+    ("runs/r1//image_1.png", None),
+    ("runs/r1/./meta.json", None),
+    ("runs/r 1/image_1.png", None),
+    ("runs/r1", None),
+    ("other/r1/image_1.png", None),
+    ("/runs/r1/image_1.png", None),
+])
+def test_safe_member(name, expected):
+    assert bundles._safe_member(name) == expected
+
+
+def test_round_trip(outputs, tmp_path):
+    add_runs(("r1", "red"), ("r2", "blue"))
+    path, summary = export(tmp_path)
+    assert (summary["runs"], summary["missing"]) == (2, [])
+    forget_local(outputs)
+
+    result = import_bundle(path, index_similarity=False)
+    assert result["imported"] == ["r1", "r2"]
+    assert index_ids() == ["r1", "r2"]
+    meta = storage.load_run_meta("r1")
+    assert meta["image_paths"] == [os.path.join(outputs, "r1", "image_1.png")]
+    assert os.path.exists(meta["image_paths"][0])
+    # a second import of the same bundle finds it finished in the journal
+    again = import_bundle(path, index_similarity=False)
+    assert again["resumed_runs"] == 2 and again["imported"] == []
+    assert index_ids() == ["r1", "r2"]
+
+    # removed here since (e.g. by retention): its remembered content hash no longer blocks it
+    forget_local(outputs)
+    shutil.rmtree(os.path.join(outputs, ".import"))
+    assert import_bundle(path, index_similarity=False)["imported"] == ["r1", "r2"]
+
+
+def test_duplicate_and_corrupt_runs(outputs, tmp_path):
+    add_runs(("r1", "red"), ("r2", "blue"), ("r3", "green"))
+    path, _ = export(tmp_path)
+    shutil.copytree(os.path.join(outputs, "r1"), str(tmp_path / "r1"))
+    forget_local(outputs)
+    add_runs(("r3", "yellow"))  # another run under the same id
+    shutil.copytree(str(tmp_path / "r1"), os.path.join(outputs, "mine"))  # r1's images under another id
+    storage.append_index_rows([{"run_id": "mine", "run_dir": os.path.join(outputs, "mine")}])
+
+    # flip a byte of r2's image inside the archive, keeping its manifest
+    bad = str(tmp_path / "bad.tar")
+    with tarfile.open(path) as src, tarfile.open(bad, "w", format=tarfile.PAX_FORMAT) as dst:
+        for m in src:
+            data = src.extractfile(m).read() if m.isfile() else None
+            if m.name == "runs/r2/image_1.png":
+                data = bytes([data[0] ^ 1]) + data[1:]
+            dst.addfile(m, None if data is None else io.BytesIO(data))
+    result = import_bundle(bad, index_similarity=False)
+    assert result["duplicate_content"] == ["r1"] and result["corrupt"] == ["r2"]
+    assert result["duplicate_run_id"] == ["r3"] and result["imported"] == []
+    assert index_ids() == ["r3", "mine"]
+    assert not os.path.exists(os.path.join(outputs, "r2"))
+
+
+def test_interrupted_import_resumes_after_the_last_merged_run(outputs, tmp_path, monkeypatch):
+    add_runs(("r1", "red"), ("r2", "green"), ("r3", "blue"))
+    path, _ = export(tmp_path)
+    forget_local(outputs)
+
+    merge = bundles._merge_run
+    merged = []
+
+    def crash_on_r2(rid, *args):
+        if rid == "r2":
+            raise KeyboardInterrupt
+        merged.append(rid)
+        return merge(rid, *args)
+
+    monkeypatch.setattr(bundles, "_merge_run", crash_on_r2)
+    with pytest.raises(KeyboardInterrupt):
+        import_bundle(path, index_similarity=False)
+    assert index_ids() == ["r1"]
+
+    monkeypatch.setattr(bundles, "_merge_run", lambda rid, *args: (merged.append(rid), merge(rid, *args))[1])
+    result = import_bundle(path, index_similarity=False)
+    assert result["resumed_runs"] == 1 and result["resumed_at"] > 0
+    assert result["imported"] == ["r2", "r3"]
+    assert merged == ["r1", "r2", "r3"]  # r1's files were not read again
+    assert index_ids() == ["r1", "r2", "r3"]
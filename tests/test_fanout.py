@@ -0,0 +1,70 @@
+import pytest
+
+# fan-out renders through the SDXL pipeline module, so it needs the full stack to import
+for mod in ("torch", "diffusers", "streamlit"):
+    pytest.importorskip(mod)
+import numpy as np
+from PIL import Image
+
+from src import fanout
+from src.fanout import FanoutResult, cost_ratio, heuristic_score, preview_sheet, preview_size
+
+
+# ----------------- preview cost -----------------
+@pytest.mark.parametrize("wh,side,expected", [
+    ((1024, 1024), 512, (512, 512)),
+    ((1344, 768), 512, (512, 288)),   # same aspect, long side capped
+    ((1000, 600), 512, (512, 304)),   # rounded down to multiples of 8
+    ((512, 384), 768, (512, 384)),    # never upscaled
+    ((2048, 128), 512, (512, 64)),    # at least 64 px
+])
+def test_preview_size(wh, side, expected):
+    w, h = preview_size(*wh, side=side)
+    assert (w, h) == expected and w % 8 == 0 and h % 8 == 0
+
+
+def test_cost_ratio():
+    # K=4 at 30 steps / 1024² with 8-step 512² previews: about a third of four full renders
+    ratio = cost_ratio(4, 1024, 1024, 30, 1, 8, (512, 512))
+    assert ratio == pytest.approx((4 * 8 * 512 * 512 + 30 * 1024 * 1024) / (4 * 30 * 1024 * 1024))
+    assert 0.3 < ratio < 0.35
+    # full-size previews at full steps cost more than rendering every variant
+    assert cost_ratio(4, 1024, 1024, 30, 1, 30, (1024, 1024)) == pytest.approx(1.25)
+    # more images per run make the previews relatively cheaper
+    assert cost_ratio(4, 1024, 1024, 30, 4, 8, (512, 512)) < ratio
+
+
+# ----------------- scoring -----------------
+def test_heuristic_prefers_detail_over_flat_and_clipped():
+    rng = np.random.default_rng(0)
+    detailed = Image.fromarray((rng.random((128, 128, 3)) * 200 + 28).astype(np.uint8))
+    flat = Image.new("RGB", (128, 128), (120, 120, 120))
+    clipped = Image.new("RGB", (128, 128), "white")
+    scores = heuristic_score([flat, detailed, clipped])
+    assert len(scores) == 3 and int(np.argmax(scores)) == 1
+    assert scores[2] < scores[0]  # same flatness, but blown out
+    assert heuristic_score([flat, flat]) == [0.0, 0.0]  # relative within the set
+
+
+def test_registered_scorers(monkeypatch):
+    monkeypatch.setattr(fanout, "SCORERS", dict(fanout.SCORERS))
+    assert "heuristic" in fanout.SCORERS
+
+    @fanout.register_scorer("first")
+    def first(images, goal=""):
+        return [1.0] + [0.0] * (len(images) - 1)
+
+    assert fanout.SCORERS["first"] is first
+
+
+def test_preview_sheet_marks_the_winner():
+    previews = [Image.new("RGB", (64, 48), c) for c in ("red", "green", "blue")]
+    result = FanoutResult(images=[], winner=1, scores=[0.1, 0.9, -0.2], previews=previews, seed=1,
+                          scorer="heuristic", preview_steps=8, preview_size=(64, 48), cost_ratio=0.3)
+    variants = [{"style": s, "final_prompt": f"a fox, {s}", "variant": {"style": s}} for s in ("A", "B", "C")]
+    sheet = preview_sheet(result, variants, cell_size=128)
+    assert sheet.size == (3 * 128, 28 + 96)
+    assert sheet.getpixel((128 + 1, 60)) == (255, 170, 0)  # the winner's frame
+    d = result.as_dict(variants)
+    assert d["winner"] == 1 and [v["score"] for v in d["variants"]] == [0.1, 0.9, -0.2]
+    assert d["compute_vs_full_render_of_all"] == 0.3
@@ -0,0 +1,40 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.model_cache import ModelCache, module_bytes
+
+MB = 1 << 20
+
+
+def model(mb=1):
+    return torch.nn.Linear(1, mb * MB // 4, bias=False)  # float32 weights: mb MiB
+
+
+def test_pinned_models_do_not_count_against_the_budget():
+    cache = ModelCache(device_budget=2 * MB, device="cpu")
+    cache.put("unet", model(4), pinned=True)  # larger than the whole budget
+    for name in ("canny", "depth"):
+        cache.register(name, model)
+    cache.get("canny")
+    cache.get("depth")
+    stats = cache.stats()
+    assert stats["models"] == {"unet": "device", "canny": "device", "depth": "device"}
+    assert stats["pinned_bytes"] == 4 * MB and stats["device_bytes"] == 6 * MB
+    assert (stats["loads"], stats["evictions"]) == (2, 0)
+    cache.get("canny")
+    assert cache.stats()["hits"] == 1  # no reload: nothing thrashes
+
+
+def test_unpinned_models_share_the_budget_lru_first():
+    cache = ModelCache(device_budget=2 * MB, device="cpu")
+    cache.put("unet", model(4), pinned=True)
+    for name in ("canny", "depth", "pose"):
+        cache.register(name, model)
+        cache.get(name)
+    assert cache.stats()["models"] == {"unet": "device", "canny": "evicted", "depth": "device", "pose": "device"}
+    with cache.use("canny", "depth", "pose"):  # held models may go over the budget
+        assert cache.stats()["device_bytes"] == 4 * MB + 3 * MB
+    cache.get("canny")
+    assert cache.stats()["models"]["depth"] == "evicted"
+    assert module_bytes(cache.get("unet")) == 4 * MB
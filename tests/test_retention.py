@@ -0,0 +1,79 @@
+import json, os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from src import retention, storage
+from src.retention import RetentionPolicy, enforce
+
+
+def add_run(outputs, run_id, size=1000, day=1, parent=None):
+    run_dir = os.path.join(outputs, run_id)
+    os.makedirs(run_dir)
+    with open(os.path.join(run_dir, "image_1.png"), "wb") as f:
+        f.write(b"\0" * size)
+    with open(os.path.join(run_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"run_id": run_id}, f)
+    row = {"run_id": run_id, "timestamp": f"2020-01-{day:02d} 00:00:00", "run_dir": run_dir}
+    if parent:
+        row["parent_run_id"] = parent
+    storage.append_index_rows([row])
+
+
+def ids(group):
+    return [r["run_id"] for r in group]
+
+
+def test_groups_keep_sweeps_together():
+    rows = [{"run_id": "s_c01", "parent_run_id": "s"}, {"run_id": "s_c02", "parent_run_id": "s"},
+            {"run_id": "s"}, {"run_id": "solo"},
+            {"run_id": "x_c01", "parent_run_id": "x"}]  # parent not (yet) in the index
+    assert [ids(g) for g in retention._groups(rows)] == [["s", "s_c01", "s_c02"], ["solo"], ["x_c01"]]
+
+
+def test_size_cap_evicts_oldest_first(outputs):
+    for i in range(1, 5):
+        add_run(outputs, f"r{i}", day=i)
+    report = enforce(RetentionPolicy(max_bytes=2500))
+    assert report.removed == ["r1", "r2"]
+    assert [r["run_id"] for r in storage.read_index()] == ["r3", "r4"]
+    assert not os.path.exists(os.path.join(outputs, "r1"))
+
+
+def test_age_limit_evicts_sweep_with_its_cells(outputs):
+    add_run(outputs, "s_c01", day=1, parent="s")
+    add_run(outputs, "s_c02", day=1, parent="s")
+    add_run(outputs, "s", day=1)
+    add_run(outputs, "solo", day=2)
+    report = enforce(RetentionPolicy(max_age_days=1, keep_last=1))
+    assert report.removed == ["s", "s_c01", "s_c02"]  # keep_last counts the sweep as one unit
+    assert [r["run_id"] for r in storage.read_index()] == ["solo"]
+
+
+def test_starred_cell_protects_its_sweep(outputs):
+    add_run(outputs, "s_c01", parent="s")
+    add_run(outputs, "s")
+    add_run(outputs, "solo", day=2)
+    storage.set_starred("s_c01")
+    assert enforce(RetentionPolicy(max_bytes=1)).removed == ["solo"]
+    assert enforce(RetentionPolicy(max_bytes=1, keep_starred=False)).removed == ["s", "s_c01"]
+
+
+def test_missing_parent_drops_its_cells(outputs):
+    add_run(outputs, "s_c01", parent="s")
+    add_run(outputs, "s")
+    add_run(outputs, "solo", day=2)
+    os.rename(os.path.join(outputs, "s"), os.path.join(outputs, "..", "elsewhere"))
+    enforce(RetentionPolicy(max_age_days=100000))
+    assert [r["run_id"] for r in storage.read_index()] == ["solo"]
+    assert not os.path.exists(os.path.join(outputs, "s_c01"))
+
+
+def test_batches_report_pending(outputs):
+    for i in range(1, 5):
+        add_run(outputs, f"r{i}", day=i)
+    report = enforce(RetentionPolicy(max_bytes=1), max_removals=2)
+    assert report.removed == ["r1", "r2"] and report.pending
+    assert enforce(RetentionPolicy(max_bytes=1), max_removals=2).removed == ["r3", "r4"]
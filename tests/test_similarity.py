@@ -0,0 +1,38 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+from PIL import Image
+
+from src.similarity import SimilarityIndex
+
+
+def gradient(shift=0):
+    a = (np.add.outer(np.arange(64), np.arange(64)) * 2 + shift) % 256
+    return Image.fromarray(a.astype(np.uint8)).convert("RGB")
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SimilarityIndex(str(tmp_path / "similarity.bin"))
+
+
+def test_many_images_in_one_run_do_not_crowd_out_others(index):
+    # an inpaint run can hold far more than 16 images, all near the query
+    index.add("big", [gradient()] * 100)
+    index.add("a", [gradient(3)])
+    index.add("b", [Image.new("RGB", (64, 64), "white"), gradient(5)])
+    hits = index.search(gradient(), k=3)
+    assert [h["run_id"] for h in hits][0] == "big"
+    assert sorted(h["run_id"] for h in hits) == ["a", "b", "big"]
+    assert next(h for h in hits if h["run_id"] == "b")["image"] == 2  # the run's best image
+
+
+def test_k_best_runs_and_exclusions(index):
+    index.add("q", [gradient()])
+    for i in range(5):
+        index.add(f"r{i}", [gradient(40 * i)] * 20)
+    hits = index.similar_to_run("q", k=2)
+    assert len(hits) == 2 and "q" not in {h["run_id"] for h in hits}
+    assert [h["distance"] for h in hits] == sorted(h["distance"] for h in hits)
+    assert all(h["distance"] <= 4 for h in index.search(gradient(), k=10, max_distance=4))
@@ -0,0 +1,69 @@
+import json, os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+from PIL import Image
+
+from src import metrics, storage
+
+
+def read_meta(outputs, run_id):
+    with open(os.path.join(outputs, run_id, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_stored_timings_include_save_run(outputs, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    with metrics.run_timings() as t:
+        with metrics.span("vae_decode"):
+            pass
+        storage.save_run("r1", {"mode": "Text-to-Image"}, [Image.new("RGB", (8, 8))])
+    stored = read_meta(outputs, "r1")["timings"]
+    assert {"vae_decode", "save_images", "save_run"} <= set(stored["stages"])
+    assert stored == t.as_dict()
+    # reopening the run from history shows the same numbers as right after generating
+    assert storage.load_run_meta("r1")["timings"] == stored
+
+
+def test_no_timings_outside_a_run(outputs):
+    storage.save_run("r1", {"mode": "Text-to-Image"}, [Image.new("RGB", (8, 8))])
+    assert "timings" not in read_meta(outputs, "r1")
+
+
+# ----------------- index cache -----------------
+def append_raw(data: bytes):
+    with open(storage.INDEX_FILE, "ab") as f:
+        f.write(data)
+
+
+def test_index_reads_only_appended_lines(outputs, monkeypatch):
+    storage.append_index_rows([{"run_id": "a"}, {"run_id": "b", "parent_run_id": "a"}])
+    assert [r["run_id"] for r in storage.read_index()] == ["a", "b"]
+
+    parsed = []
+    parse = storage._parse_lines
+    monkeypatch.setattr(storage, "_parse_lines", lambda data, rows: (parsed.append(data), parse(data, rows)))
+    assert [r["run_id"] for r in storage.read_index()] == ["a", "b"]
+    assert parsed == []  # unchanged file: served from the cache
+    storage.append_index_rows([{"run_id": "c"}])
+    assert [r["run_id"] for r in storage.load_index()] == ["c", "a"]  # newest first, no sweep cells
+    assert parsed == [b'{"run_id": "c"}\n']
+
+
+def test_index_waits_for_a_whole_line(outputs):
+    storage.append_index_rows([{"run_id": "a"}])
+    append_raw(b'{"run_id": "b"')  # another process is mid-write
+    assert [r["run_id"] for r in storage.read_index()] == ["a"]
+    append_raw(b'}\nnot json\n{"run_id": "c"}\n')
+    assert [r["run_id"] for r in storage.read_index()] == ["a", "b", "c"]  # broken lines are skipped
+
+
+def test_index_rewrite_is_parsed_again(outputs):
+    storage.append_index_rows([{"run_id": r} for r in "abc"])
+    assert len(storage.read_index()) == 3
+    assert storage.compact_index(["b"]) == 2  # a new file (os.replace), possibly of the same size
+    assert [r["run_id"] for r in storage.read_index()] == ["a", "c"]
+    os.remove(storage.INDEX_FILE)
+    assert storage.read_index() == []
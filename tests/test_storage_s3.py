@@ -0,0 +1,211 @@
+import json, os, threading
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from src import retention, storage
+from src.storage import backends
+
+BUCKET = "aig"
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch):
+    """
+    One node with its own outputs/ under tmp_path, against an in-process S3 stand-in.
+    node.backend(**kwargs) builds an S3Backend that the storage and retention modules use.
+    """
+    out = str(tmp_path / "outputs")
+    state = os.path.join(out, ".storage")
+    for mod in (storage, backends, retention):
+        monkeypatch.setattr(mod, "OUTPUT_DIR", out)
+    monkeypatch.setattr(storage, "INDEX_FILE", os.path.join(out, "generations.jsonl"))
+    monkeypatch.setattr(storage, "_INDEX_LOCK_FILE", os.path.join(out, "generations.jsonl.lock"))
+    monkeypatch.setattr(storage, "_INDEX_CACHE", {"sig": None, "offset": 0, "rows": [], "top": []})
+    monkeypatch.setattr(backends, "STATE_DIR", state)
+    monkeypatch.setattr(backends, "JOURNAL_FILE", os.path.join(state, "uploads.jsonl"))
+    monkeypatch.setattr(backends, "CURSOR_FILE", os.path.join(state, "index_cursor"))
+    monkeypatch.setattr(retention, "REPORT_FILE", os.path.join(out, "retention.jsonl"))
+    monkeypatch.setattr(retention, "_SIZES", {})
+    for k, v in {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test",
+                 "AWS_DEFAULT_REGION": "us-east-1"}.items():
+        monkeypatch.setenv(k, v)
+
+    class Node:
+        outputs = out
+        journal = os.path.join(state, "uploads.jsonl")
+
+        @staticmethod
+        def backend(**kwargs):
+            b = backends.S3Backend(BUCKET, "nodes", region="us-east-1", concurrency=2, sync_interval=0,
+                                   retry_delay=0, **kwargs)
+            monkeypatch.setattr(storage, "get_backend", lambda: b)
+            monkeypatch.setattr(retention, "get_backend", lambda: b)
+            return b
+
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        os.makedirs(out)
+        yield Node
+
+
+def make_run(outputs: str, run_id: str, size: int = 1024):
+    run_dir = os.path.join(outputs, run_id)
+    os.makedirs(run_dir)
+    with open(os.path.join(run_dir, "image_1.png"), "wb") as f:
+        f.write(os.urandom(size))
+    with open(os.path.join(run_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"run_id": run_id, "run_dir": run_dir, "image_paths": [os.path.join(run_dir, "image_1.png")]}, f)
+    storage.append_index_rows([{"run_id": run_id, "timestamp": "2020-01-01 00:00:00", "run_dir": run_dir}])
+
+
+def journal_ops(node):
+    with open(node.journal, encoding="utf-8") as f:
+        return [(o["op"], o["run_id"]) for o in map(json.loads, f)]
+
+
+def keys(backend):
+    return sorted(backend.list_keys(""))
+
+
+# ----------------- uploads -----------------
+def test_submit_upload_pending(node):
+    b = node.backend()
+    make_run(node.outputs, "r1")
+    gate = threading.Event()
+    upload = b.upload_file
+    b.upload_file = lambda local, rel: (gate.wait(5), upload(local, rel))
+
+    b.submit_run("r1")
+    assert b.pending("r1")
+    assert journal_ops(node) == [("queued", "r1")]
+    gate.set()
+    assert b.flush(timeout=10)
+    assert not b.pending("r1")
+    assert keys(b) == ["index/r1.json", "r1/image_1.png", "r1/meta.json"]
+    # the index row is node-independent: no run_dir
+    assert json.loads(b.get_bytes("index/r1.json")) == {"run_id": "r1", "timestamp": "2020-01-01 00:00:00"}
+    assert journal_ops(node) == [("queued", "r1"), ("done", "r1")]
+    assert b.stats()["uploaded_runs"] == 1
+
+
+def test_failed_upload_stays_pending_and_is_not_evicted(node):
+    b = node.backend(retries=2)
+    make_run(node.outputs, "ok")
+    make_run(node.outputs, "broken")
+    b.submit_run("ok")
+    assert b.flush(timeout=10)
+
+    upload, calls = b.upload_file, []
+
+    def failing(local, rel):
+        calls.append(rel)
+        raise ConnectionError("store unreachable")
+
+    b.upload_file = failing
+    b.submit_run("broken")
+    assert not b.flush(timeout=10)  # returns once only out-of-retry runs are left
+    assert b.pending("broken")
+    assert b.stats()["failed_runs"] == 1 and b.stats()["failed_pending"] == 1
+    assert len(calls) == 2 * 2  # two files, two attempts
+
+    report = retention.enforce(retention.RetentionPolicy(max_bytes=1))
+    assert report.removed == ["ok"]  # uploaded: only the local copy goes
+    assert os.path.isdir(os.path.join(node.outputs, "broken"))
+
+    b.upload_file = upload
+    assert b.retry_failed() == 1
+    assert b.flush(timeout=10)
+    assert not b.pending("broken")
+    assert "broken/image_1.png" in keys(b)
+    assert retention.enforce(retention.RetentionPolicy(max_bytes=1)).removed == ["broken"]
+
+
+def test_retry_backoff_does_not_hold_the_queue(node):
+    b = node.backend(retries=2)
+    b._retry_delay = 1.0
+    upload = b.upload_file
+
+    def flaky(local, rel):
+        if rel.startswith("broken"):
+            raise ConnectionError("store unreachable")
+        return upload(local, rel)
+
+    b.upload_file = flaky
+    for rid in ("broken1", "broken2", "ok"):  # as many failing runs as run workers
+        make_run(node.outputs, rid)
+        b.submit_run(rid)
+    for _ in range(50):
+        if not b.pending("ok"):
+            break
+        threading.Event().wait(0.01)
+    assert not b.pending("ok")  # uploaded while both failed runs were backing off
+    assert b.pending("broken1") and b.pending("broken2")
+    assert not b.flush(timeout=10)
+    assert b.stats()["failed_pending"] == 2
+
+
+def test_index_row_passed_in_is_uploaded(node, monkeypatch):
+    b = node.backend()
+    make_run(node.outputs, "r1")
+    row = {"run_id": "r1", "timestamp": "2020-01-01 00:00:00", "run_dir": os.path.join(node.outputs, "r1")}
+    monkeypatch.setattr(storage, "read_index", lambda: pytest.fail("the index is not re-read per upload"))
+    b.submit_run("r1", row)
+    assert b.flush(timeout=10)
+    assert json.loads(b.get_bytes("index/r1.json")) == {"run_id": "r1", "timestamp": "2020-01-01 00:00:00"}
+
+
+def test_resume_from_journal(node):
+    make_run(node.outputs, "queued")
+    make_run(node.outputs, "uploaded")
+    os.makedirs(os.path.dirname(node.journal), exist_ok=True)
+    with open(node.journal, "w", encoding="utf-8") as f:
+        for op, rid in [("queued", "queued"), ("queued", "uploaded"), ("done", "uploaded"), ("queued", "gone")]:
+            f.write(json.dumps({"op": op, "run_id": rid, "t": 0}) + "\n")
+
+    b = node.backend()  # a restart
+    assert b.flush(timeout=10)
+    assert keys(b) == ["index/queued.json", "queued/image_1.png", "queued/meta.json"]
+    # compacted to what was pending, then the finished upload
+    assert journal_ops(node) == [("queued", "queued"), ("queued", "gone"), ("done", "queued")]
+
+
+# ----------------- reads -----------------
+def test_sync_index_and_read_through(node):
+    b = node.backend()
+    row = {"run_id": "20200101_000000_abcd", "timestamp": "2020-01-01 00:00:00", "mode": "Text-to-Image"}
+    b.put_bytes(f"index/{row['run_id']}.json", json.dumps(row).encode())
+    b.put_bytes(f"{row['run_id']}/meta.json", json.dumps({"run_id": row["run_id"], "run_dir": "/elsewhere",
+                                                          "image_paths": ["/elsewhere/image_1.png"]}).encode())
+    b.put_bytes(f"{row['run_id']}/image_1.png", b"png")
+
+    assert b.sync_index() == 1
+    assert b.sync_index() == 0
+    assert [r["run_id"] for r in storage.read_index()] == [row["run_id"]]
+
+    meta = storage.load_run_meta(row["run_id"])  # fetched on first read, paths pointed at this node
+    assert meta["image_paths"] == [os.path.join(node.outputs, row["run_id"], "image_1.png")]
+    assert b.fetch(meta["image_paths"][0])
+    assert not b.fetch(os.path.join(node.outputs, row["run_id"], "missing.png"))
+
+
+# ----------------- check -----------------
+def test_check_round_trip(node, monkeypatch, capsys):
+    monkeypatch.setattr(backends, "S3_BUCKET", BUCKET)
+    monkeypatch.setattr(backends, "S3_REGION", "us-east-1")
+    monkeypatch.setattr(backends, "STORAGE_PART_SIZE", 5 << 20)  # the smallest part S3 accepts
+    backends.check()
+    assert capsys.readouterr().out.startswith("ok:")
+
+
+def test_check_reports_mismatch(node, monkeypatch):
+    monkeypatch.setattr(backends, "S3_BUCKET", BUCKET)
+    monkeypatch.setattr(backends, "S3_REGION", "us-east-1")
+    monkeypatch.setattr(backends, "STORAGE_PART_SIZE", 5 << 20)
+    monkeypatch.setattr(backends.S3Backend, "get_bytes", lambda self, rel: b"{}")
+    with pytest.raises(RuntimeError, match="small object"):
+        backends.check()
@@ -0,0 +1,70 @@
+import pytest
+
+# sweep renders through the SDXL pipeline module, so it needs the full stack to import
+for mod in ("torch", "diffusers", "streamlit"):
+    pytest.importorskip(mod)
+
+from src import sweep
+from src.sweep import parse_axis, plan_cells
+
+SETTINGS = {"seed": 7, "guidance": 6.0, "steps": 30}
+AGENT = {"style": "Photoreal", "final_prompt": "a fox", "final_negative_prompt": "blurry"}
+
+
+@pytest.fixture
+def agent_runs(monkeypatch):
+    """
+    Replace the agent loop (run once per distinct style); returns the styles it was run for.
+    """
+    runs = []
+
+    def _run(goal, style):
+        runs.append(style)
+        return {"style": style, "final_prompt": f"a fox, {style}", "final_negative_prompt": "blurry"}
+
+    monkeypatch.setattr(sweep, "run_agent_loop", _run)
+    return runs
+
+
+# ----------------- axes -----------------
+def test_parse_axis_types_values():
+    assert parse_axis("seed", "1, 2,3,") == [1, 2, 3]
+    assert parse_axis("steps", "20.0, 30") == [20, 30]
+    assert parse_axis("guidance", "4, 7.5") == [4.0, 7.5]
+    assert parse_axis("style", "anime, CINEMATIC") == ["Anime", "Cinematic"]
+
+
+@pytest.mark.parametrize("param,text,match", [("seed", " , ", "No values"), ("style", "Anime, Pastel", "Unknown style"),
+                                              ("steps", "ten", "could not convert")])
+def test_parse_axis_rejects(param, text, match):
+    with pytest.raises(ValueError, match=match):
+        parse_axis(param, text)
+
+
+# ----------------- cells -----------------
+def test_plan_cells_grid_order(agent_runs):
+    cells = plan_cells("a fox", "a fox", "blurry", AGENT, SETTINGS,
+                       ("guidance", [4.0, 8.0]), ("seed", [1, 2, 3]))
+    assert [(c.x, c.y) for c in cells] == [(x, y) for y in range(3) for x in range(2)]
+    assert [(c.guidance, c.seed) for c in cells[:3]] == [(4.0, 1), (8.0, 1), (4.0, 2)]
+    assert {c.steps for c in cells} == {30} and {c.prompt for c in cells} == {"a fox"}
+    assert agent_runs == []  # the given prompts are reused
+    assert cells[0].settings({"width": 1024, "seed": 7})["seed"] == 1
+
+
+def test_plan_cells_runs_the_agent_once_per_style(agent_runs):
+    cells = plan_cells("a fox", "a fox", "blurry", AGENT, SETTINGS,
+                       ("style", ["Photoreal", "Anime", "Cinematic"]), ("seed", [1, 2]))
+    assert agent_runs == ["Anime", "Cinematic"]
+    assert [c.prompt for c in cells[:3]] == ["a fox", "a fox, Anime", "a fox, Cinematic"]
+
+
+def test_plan_cells_fixes_a_random_seed_for_the_grid(agent_runs):
+    cells = plan_cells("a fox", "a fox", "blurry", AGENT, dict(SETTINGS, seed=-1), ("steps", [10, 20, 30]))
+    assert len({c.seed for c in cells}) == 1 and cells[0].seed >= 0
+
+
+def test_plan_cells_limit(agent_runs, monkeypatch):
+    monkeypatch.setattr(sweep, "SWEEP_MAX_CELLS", 4)
+    with pytest.raises(ValueError, match="5 cells"):
+        plan_cells("a fox", "a fox", "blurry", AGENT, SETTINGS, ("seed", [1, 2, 3, 4, 5]))